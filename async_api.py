@@ -0,0 +1,247 @@
+"""
+Native async versions of the database endpoints.
+
+These handlers run on the event loop instead of Starlette's threadpool, so a single
+worker can keep many requests in flight while the database does the waiting. The
+query logic is shared with the sync handlers: each endpoint hands the functions in
+crud.py to AsyncSession.run_sync, which drives them over the async driver.
+"""
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Literal, Optional
+from datetime import datetime
+
+import crud
+from etags import not_modified, not_modified_response
+from geo import parse_bbox
+from serializers import json_response
+from database import get_async_db
+from schemas import (
+    FarmSurveyCreate, FarmSurveyUpdate, FarmSurvey as FarmSurveySchema,
+    TreeCreate, TreeUpdate, Tree as TreeSchema,
+    SurveyBatchRequest, SurveyBatchResponse, SyncChanges, SearchHit, TreeStat as TreeStatSchema
+)
+
+router = APIRouter()
+
+
+@router.post("/surveys/", response_model=FarmSurveySchema, status_code=201)
+async def create_survey(survey: FarmSurveyCreate, db: AsyncSession = Depends(get_async_db)):
+    """Create a new farm survey"""
+    return await db.run_sync(crud.create_survey, survey)
+
+
+@router.post("/surveys/batch", response_model=SurveyBatchResponse)
+async def batch_upsert_surveys(batch: SurveyBatchRequest, db: AsyncSession = Depends(get_async_db)):
+    """Create or update many surveys and their trees in a single transaction"""
+    return await db.run_sync(crud.batch_upsert_surveys, batch)
+
+
+@router.get("/surveys/", response_model=List[FarmSurveySchema])
+async def get_surveys(
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of surveys to return"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor value from the previous page"),
+    include_trees: bool = Query(True, description="Include each survey's trees; list views can skip them"),
+    fields: Optional[str] = Query(
+        None, description="Comma-separated response fields to return (survey_id is always included), e.g. survey_id,farmer_name,geo_location"
+    ),
+    crop_type: Optional[str] = Query(None, description="Only surveys of this crop type"),
+    sync_status: Optional[bool] = Query(None, description="Only synced (true) or unsynced (false) surveys"),
+    farmer_name_prefix: Optional[str] = Query(
+        None, min_length=1, max_length=100, description="Only farmer names starting with this text (case-sensitive)"
+    ),
+    updated_since: Optional[datetime] = Query(None, description="Only surveys updated at or after this time"),
+    updated_before: Optional[datetime] = Query(None, description="Only surveys updated before this time"),
+    sort: Literal["survey_id", "-survey_id", "last_updated", "-last_updated", "farmer_name", "-farmer_name"] = Query(
+        "survey_id", description="Sort field, prefixed with - for descending; ties are broken by survey_id"
+    ),
+    if_none_match: Optional[str] = Header(None, description="ETag of the cached page; 304 if still current"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get the farm surveys matching the filters, in `sort` order; the X-Next-Cursor header points at the next page"""
+    projection = crud.parse_survey_fields(fields)
+    filters = crud.SurveyFilters(crop_type, sync_status, farmer_name_prefix, updated_since, updated_before)
+    etag = await db.run_sync(crud.surveys_etag, skip, limit, cursor, include_trees, projection, filters, sort)
+    if not_modified(if_none_match, etag):
+        return not_modified_response(etag, if_none_match)
+    surveys, next_cursor = await db.run_sync(crud.list_surveys, skip, limit, cursor, include_trees, projection, filters, sort)
+    headers = {"ETag": etag}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+    return json_response(surveys, headers)
+
+
+@router.get("/surveys/near", response_model=List[FarmSurveySchema])
+async def get_surveys_near(
+    lat: float = Query(..., ge=-90, le=90, description="Latitude of the center point"),
+    lon: float = Query(..., ge=-180, le=180, description="Longitude of the center point"),
+    radius_km: float = Query(..., gt=0, le=20000, description="Search radius in kilometers"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of surveys to return"),
+    include_trees: bool = Query(False, description="Include each survey's trees"),
+    fields: Optional[str] = Query(
+        None, description="Comma-separated response fields to return (survey_id is always included), e.g. survey_id,farmer_name,geo_location"
+    ),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get surveys within a radius of a point, nearest first"""
+    projection = crud.parse_survey_fields(fields)
+    return json_response(await db.run_sync(crud.surveys_near, lat, lon, radius_km, limit, include_trees, projection))
+
+
+@router.get("/surveys/within", response_model=List[FarmSurveySchema])
+async def get_surveys_within(
+    bbox: str = Query(..., description="Bounding box as min_lon,min_lat,max_lon,max_lat"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of surveys to return"),
+    include_trees: bool = Query(False, description="Include each survey's trees"),
+    fields: Optional[str] = Query(
+        None, description="Comma-separated response fields to return (survey_id is always included), e.g. survey_id,farmer_name,geo_location"
+    ),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get surveys inside a bounding box (min_lon greater than max_lon crosses the antimeridian)"""
+    try:
+        bounds = parse_bbox(bbox)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid bbox: {exc}")
+    projection = crud.parse_survey_fields(fields)
+    return json_response(await db.run_sync(crud.surveys_within, bounds, limit, include_trees, projection))
+
+
+@router.get("/surveys/{survey_id}", response_model=FarmSurveySchema)
+async def get_survey(
+    survey_id: int,
+    include_trees: bool = Query(True, description="Include the survey's trees"),
+    if_none_match: Optional[str] = Header(None, description="ETag of the cached survey; 304 if still current"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get a specific farm survey by ID"""
+    etag = await db.run_sync(crud.survey_etag, survey_id, include_trees)
+    if not_modified(if_none_match, etag):
+        return not_modified_response(etag, if_none_match)
+    survey = await db.run_sync(crud.get_survey, survey_id, include_trees, etag)
+    return json_response(survey, {"ETag": crud.survey_etag_for(survey, include_trees)})
+
+
+@router.put("/surveys/{survey_id}", response_model=FarmSurveySchema)
+async def update_survey(
+    survey_id: int,
+    survey_update: FarmSurveyUpdate,
+    db: AsyncSession = Depends(get_async_db),
+    last_updated: Optional[datetime] = Query(None, description="Last updated timestamp for conflict resolution"),
+    if_match: Optional[str] = Header(None, description="Only update if the survey still has this ETag (412 otherwise)"),
+    version: Optional[int] = Query(None, description="Only update if the survey still has this version (409 otherwise)")
+):
+    """Update a farm survey with conflict resolution using its version, last_updated timestamp or If-Match"""
+    survey = await db.run_sync(crud.update_survey, survey_id, survey_update, last_updated, if_match, version)
+    return json_response(survey, {"ETag": crud.survey_etag_for(survey)})
+
+
+@router.delete("/surveys/{survey_id}", status_code=204)
+async def delete_survey(survey_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Delete a farm survey (cascades to delete all associated trees)"""
+    await db.run_sync(crud.delete_survey, survey_id)
+    return None
+
+
+# Tree endpoints
+@router.post("/surveys/{survey_id}/trees/", response_model=TreeSchema, status_code=201)
+async def create_tree(survey_id: int, tree: TreeCreate, db: AsyncSession = Depends(get_async_db)):
+    """Create a new tree record for a survey"""
+    return await db.run_sync(crud.create_tree, survey_id, tree)
+
+
+@router.post("/surveys/{survey_id}/trees/bulk", response_model=List[TreeSchema], status_code=201)
+async def create_trees(survey_id: int, trees: List[TreeCreate], db: AsyncSession = Depends(get_async_db)):
+    """Create many tree records for a survey in one transaction"""
+    return await db.run_sync(crud.create_trees, survey_id, trees)
+
+
+@router.put("/surveys/{survey_id}/trees/", response_model=List[TreeSchema])
+async def replace_trees(
+    survey_id: int,
+    trees: List[TreeCreate],
+    merge_species: bool = Query(False, description="Merge trees of the same species into one record"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Replace all tree records of a survey in one transaction"""
+    return await db.run_sync(crud.replace_trees, survey_id, trees, merge_species)
+
+
+@router.get("/surveys/{survey_id}/trees/", response_model=List[TreeSchema])
+async def get_trees(
+    survey_id: int,
+    limit: Optional[int] = Query(None, ge=1, description="Maximum number of trees to return (default: all)"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor value from the previous page"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get all trees for a specific survey, ordered by ID"""
+    trees, next_cursor = await db.run_sync(crud.list_trees, survey_id, limit, cursor)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor is not None else None
+    return json_response(trees, headers)
+
+
+@router.get("/trees/{tree_id}", response_model=TreeSchema)
+async def get_tree(
+    tree_id: int,
+    if_none_match: Optional[str] = Header(None, description="ETag of the cached tree; 304 if still current"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get a specific tree by ID"""
+    etag = await db.run_sync(crud.tree_etag, tree_id)
+    if not_modified(if_none_match, etag):
+        return not_modified_response(etag, if_none_match)
+    tree = await db.run_sync(crud.get_tree, tree_id, etag)
+    return json_response(tree, {"ETag": crud.tree_etag_for(tree)})
+
+
+@router.put("/trees/{tree_id}", response_model=TreeSchema)
+async def update_tree(
+    tree_id: int,
+    tree_update: TreeUpdate,
+    if_match: Optional[str] = Header(None, description="Only update if the tree still has this ETag (412 otherwise)"),
+    version: Optional[int] = Query(None, description="Only update if the tree still has this version (409 otherwise)"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Update a tree record, optionally only if it still has the given version or ETag"""
+    tree = await db.run_sync(crud.update_tree, tree_id, tree_update, if_match, version)
+    return json_response(tree, {"ETag": crud.tree_etag_for(tree)})
+
+
+@router.delete("/trees/{tree_id}", status_code=204)
+async def delete_tree(tree_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Delete a tree record"""
+    await db.run_sync(crud.delete_tree, tree_id)
+    return None
+
+
+@router.get("/sync/changes", response_model=SyncChanges)
+async def get_changes(
+    since: Optional[str] = Query(None, description="Cursor returned by the previous sync; omit for a full sync"),
+    limit: int = Query(1000, ge=1, le=10000, description="Maximum number of surveys, of trees and of deletes to return"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get surveys, trees and deletes changed since the given cursor, a page at a time; repeat
+    with next_cursor while has_more is true"""
+    return json_response(await db.run_sync(crud.get_changes, since, limit))
+
+
+@router.get("/search", response_model=List[SearchHit])
+async def search(
+    q: str = Query(..., min_length=1, max_length=200, description="Words to find in farmer names, species and tree notes; each may be the start of a word"),
+    skip: int = Query(0, ge=0, le=1000, description="Number of hits to skip"),
+    limit: int = Query(20, ge=1, le=100, description="Maximum number of hits to return"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Full-text search over farmer names, tree species and tree notes, best match first"""
+    return json_response(await db.run_sync(crud.search, q, skip, limit))
+
+
+@router.get("/stats/{dimension}", response_model=List[TreeStatSchema])
+async def get_tree_stats(
+    dimension: Literal["species", "crop_type", "region"],
+    limit: int = Query(1000, ge=1, le=10000, description="Maximum number of groups to return"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get tree totals per species, crop type or 1-degree region from the precomputed statistics"""
+    return await db.run_sync(crud.get_tree_stats, dimension, limit)
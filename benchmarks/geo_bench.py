@@ -0,0 +1,109 @@
+"""
+Benchmark the grid-cell spatial index behind GET /surveys/near and /surveys/within.
+
+Seeds a throwaway SQLite database with N survey locations clustered around a few
+farming regions, then times radius and bounding-box queries through crud.py against
+a naive full scan that checks every row.
+
+Usage:
+    python benchmarks/geo_bench.py --points 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import sessionmaker
+
+import crud
+from database import Base
+from geo import bbox_for_radius, haversine_km
+from models import FarmSurvey
+
+REGIONS = [(12.97, 77.59), (-1.29, 36.82), (40.71, -74.00), (-23.55, -46.63), (52.52, 13.40)]
+
+
+def seed(engine, points: int, seed_value: int):
+    """Insert clustered survey locations in chunks"""
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        for start in range(0, points, 50000):
+            rows = []
+            for _ in range(min(50000, points - start)):
+                lat, lon = rng.choice(REGIONS)
+                rows.append({
+                    "farmer_name": "Farmer", "crop_type": "Wheat", "sync_status": False, "last_updated": now,
+                    "latitude": max(-90.0, min(90.0, rng.gauss(lat, 2.0))),
+                    "longitude": max(-180.0, min(180.0, rng.gauss(lon, 2.0))),
+                })
+            conn.execute(insert(FarmSurvey), rows)
+
+
+def full_scan_near(db, lat, lon, radius_km):
+    """Baseline: check the distance of every stored survey"""
+    return [
+        survey_id for survey_id, s_lat, s_lon
+        in db.execute(select(FarmSurvey.survey_id, FarmSurvey.latitude, FarmSurvey.longitude))
+        if haversine_km(lat, lon, s_lat, s_lon) <= radius_km
+    ]
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--points", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=20, help="Random query centers per case")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    path = tempfile.mktemp(suffix=".db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    start = time.perf_counter()
+    seed(engine, args.points, args.seed)
+    print(f"Seeded {args.points:,} surveys in {time.perf_counter() - start:.1f}s")
+
+    db = sessionmaker(bind=engine)()
+    rng = random.Random(args.seed + 1)
+    centers = [rng.choice(REGIONS) for _ in range(args.queries)]
+    centers = [(lat + rng.uniform(-1, 1), lon + rng.uniform(-1, 1)) for lat, lon in centers]
+
+    print(f"{'case':<28}{'indexed ms':>12}{'full scan ms':>14}{'results':>10}")
+    for radius_km in (5, 25, 100):
+        indexed, scanned, found = [], [], []
+        for lat, lon in centers[:5]:
+            indexed.append(timed(lambda: crud.surveys_near(db, lat, lon, radius_km, limit=1000), 3))
+            scanned.append(timed(lambda: full_scan_near(db, lat, lon, radius_km), 1))
+            found.append(len(crud.surveys_near(db, lat, lon, radius_km, limit=1000)))
+        print(f"{f'near radius={radius_km}km':<28}{statistics.median(indexed):>12.2f}"
+              f"{statistics.median(scanned):>14.1f}{statistics.median(found):>10.0f}")
+
+    within = []
+    for lat, lon in centers:
+        bbox = bbox_for_radius(lat, lon, 10)
+        within.append(timed(lambda: crud.surveys_within(db, bbox, limit=1000), 3))
+    print(f"{'within 20km box':<28}{statistics.median(within):>12.2f}{'-':>14}{'-':>10}")
+
+    db.close()
+    engine.dispose()
+    os.unlink(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Benchmark the fast read path of GET /surveys/ against the validating ORM path.
+
+Seeds a throwaway SQLite database with surveys and trees, then times turning one page
+into response bytes two ways:
+- validated: load ORM objects with selectinload, build validated schemas per survey
+  and tree, then let FastAPI validate them again against response_model, convert them
+  with jsonable_encoder and json.dumps them (what GET /surveys/ did before
+  serializers.py)
+- fast: crud.list_surveys (column SELECTs shaped into dicts) + json_response
+
+Usage:
+    python benchmarks/serialization_bench.py --surveys 100 --trees 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import selectinload, sessionmaker
+
+import crud
+from database import Base
+from models import FarmSurvey, Tree
+from schemas import FarmSurvey as FarmSurveySchema
+from serializers import json_response
+
+SPECIES = ["Oak", "Pine", "Teak", "Mango", "Neem", "Coconut", "Eucalyptus"]
+
+
+def seed(engine, surveys: int, trees: int, seed_value: int):
+    """Insert surveys with the given number of trees each"""
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(FarmSurvey), [
+            {"farmer_name": f"Farmer {index}", "crop_type": rng.choice(["Wheat", "Rice", "Corn"]),
+             "latitude": rng.uniform(-60, 60), "longitude": rng.uniform(-180, 180),
+             "sync_status": rng.random() < 0.5, "last_updated": now}
+            for index in range(surveys)
+        ])
+        if not trees:
+            return
+        conn.execute(insert(Tree), [
+            {"survey_id": survey_id, "species_name": rng.choice(SPECIES), "tree_count": rng.randint(1, 500),
+             "height_avg": round(rng.uniform(1, 30), 1), "diameter_avg": round(rng.uniform(5, 120), 1),
+             "age_avg": rng.randint(1, 80), "notes": "Surveyed on foot", "created_at": now, "updated_at": now}
+            for survey_id in range(1, surveys + 1)
+            for _ in range(trees)
+        ])
+
+
+def validated_path(db, limit: int, field) -> bytes:
+    surveys = db.scalars(
+        select(FarmSurvey).order_by(FarmSurvey.survey_id).limit(limit).options(selectinload(FarmSurvey.trees))
+    ).all()
+    content = [crud._db_to_schema(survey) for survey in surveys]
+    jsonable = asyncio.run(serialize_response(field=field, response_content=content))
+    db.expunge_all()
+    return JSONResponse(jsonable).body
+
+
+def fast_path(db, limit: int) -> bytes:
+    surveys, _ = crud.list_surveys(db, limit=limit)
+    return json_response(surveys).body
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--surveys", type=int, default=100, help="Surveys per page")
+    parser.add_argument("--trees", type=int, default=20, help="Trees per survey")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    path = tempfile.mktemp(suffix=".db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    seed(engine, args.surveys, args.trees, args.seed)
+    db = sessionmaker(bind=engine)()
+    field = create_model_field(name="Response_get_surveys", type_=List[FarmSurveySchema], mode="serialization")
+
+    # Both paths must produce the same document
+    body = fast_path(db, args.surveys)
+    assert json.loads(validated_path(db, args.surveys, field)) == json.loads(body)
+
+    validated_ms = timed(lambda: validated_path(db, args.surveys, field), args.repeat)
+    fast_ms = timed(lambda: fast_path(db, args.surveys), args.repeat)
+    print(f"{args.surveys} surveys x {args.trees} trees per page, {len(body):,} bytes")
+    print(f"{'validated (ORM + models)':<26}{validated_ms:>10.2f} ms")
+    print(f"{'fast (rows + to_json)':<26}{fast_ms:>10.2f} ms  ({validated_ms / fast_ms:.1f}x faster)")
+
+    db.close()
+    engine.dispose()
+    os.unlink(path)
+
+
+if __name__ == "__main__":
+    main()
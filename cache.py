@@ -0,0 +1,225 @@
+"""
+Read cache for single-record survey and tree lookups.
+
+crud.py reads through `cache` in get_survey, get_tree and the unpaginated tree list
+of a survey, and deletes the affected keys after every write commits. Entries also
+expire after CACHE_TTL_SECONDS, which bounds staleness from writes that bypass the
+API (scripts, other services) or race with a concurrent read.
+
+The backend is chosen from the environment:
+- default: an in-process LRU holding at most CACHE_MAX_ENTRIES entries. Each worker
+  has its own copy, so only use it with a single worker.
+- CACHE_URL=redis://host:6379/0: entries live in Redis (requires the `redis`
+  package), so every worker sees the same entries and the same invalidations.
+  Values are stored as JSON, and the async endpoints run the Redis calls in a worker
+  thread rather than on the event loop.
+- CACHE_ENABLED=false: no caching.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Iterable, Optional
+
+from sqlalchemy.util.concurrency import await_only, in_greenlet
+
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CACHE_URL = os.getenv("CACHE_URL")
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "300"))
+
+
+class CacheBackend:
+    """Interface of a cache backend; the base class caches nothing"""
+    name = "disabled"
+
+    def __init__(self, ttl_seconds: float = CACHE_TTL_SECONDS, max_entries: Optional[int] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """Cached value for the key, or None"""
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: Any):
+        """Store a value under the key"""
+
+    def delete(self, keys: Iterable[str]):
+        """Invalidate the keys"""
+
+    def clear(self):
+        """Drop every entry"""
+
+    def size(self) -> Optional[int]:
+        """Number of entries held, if the backend knows it"""
+        return 0
+
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters and configuration"""
+        return {
+            "backend": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "size": self.size(),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+    def _count(self, counter: str, amount: int = 1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+
+class MemoryCache(CacheBackend):
+    """Thread-safe LRU with a per-entry TTL, private to this process"""
+    name = "memory"
+
+    def __init__(self, ttl_seconds: float = CACHE_TTL_SECONDS, max_entries: int = CACHE_MAX_ENTRIES):
+        super().__init__(ttl_seconds, max_entries)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, keys: Iterable[str]):
+        with self._lock:
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self) -> Optional[int]:
+        return len(self._entries)
+
+
+class RedisCache(CacheBackend):
+    """Entries stored in Redis with a TTL, shared by every worker; Redis does the evicting"""
+    name = "redis"
+    prefix = "farm-survey:"
+
+    def __init__(self, url: str, ttl_seconds: float = CACHE_TTL_SECONDS):
+        super().__init__(ttl_seconds)
+        try:
+            import redis
+        except ImportError as exc:
+            raise RuntimeError("CACHE_URL points at Redis but the `redis` package is not installed") from exc
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self._call(self._client.get, self.prefix + key)
+        self._count("hits" if raw is not None else "misses")
+        return loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Any):
+        self._call(self._client.set, self.prefix + key, dumps(value), px=int(self.ttl_seconds * 1000))
+
+    def delete(self, keys: Iterable[str]):
+        keys = [self.prefix + key for key in keys]
+        if keys:
+            self._count("invalidations", self._call(self._client.delete, *keys))
+
+    def clear(self):
+        keys = self._call(lambda: list(self._client.scan_iter(match=self.prefix + "*")))
+        if keys:
+            self._call(self._client.delete, *keys)
+
+    @staticmethod
+    def _call(method: Callable, *args, **kwargs) -> Any:
+        """Run a blocking Redis command. Under AsyncSession.run_sync (the async endpoints) the
+        caller is on the event loop, so the command is awaited in a worker thread instead."""
+        if in_greenlet():
+            return await_only(asyncio.to_thread(method, *args, **kwargs))
+        return method(*args, **kwargs)
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+def dumps(value: Any) -> bytes:
+    """JSON encoding of a cached value, with datetimes as {"dt": isoformat} like cursors.py"""
+    return json.dumps(value, default=_encode_datetime, separators=(",", ":")).encode()
+
+
+def loads(raw: bytes) -> Any:
+    """Decode a value encoded by dumps"""
+    return json.loads(raw, object_hook=_decode_datetime)
+
+
+def _encode_datetime(value: Any) -> dict:
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    raise TypeError(f"Cannot cache a {type(value).__name__}")
+
+
+def _decode_datetime(obj: dict) -> Any:
+    return datetime.fromisoformat(obj["dt"]) if obj.keys() == {"dt"} else obj
+
+
+def create_cache() -> CacheBackend:
+    """Backend selected by CACHE_ENABLED / CACHE_URL"""
+    if not CACHE_ENABLED:
+        return CacheBackend()
+    if CACHE_URL:
+        return RedisCache(CACHE_URL)
+    return MemoryCache()
+
+
+cache = create_cache()
+
+
+def survey_key(survey_id: int, include_trees: bool = True) -> str:
+    return f"survey:{survey_id}:{'trees' if include_trees else 'bare'}"
+
+
+def tree_key(tree_id: int) -> str:
+    return f"tree:{tree_id}"
+
+
+def survey_trees_key(survey_id: int) -> str:
+    return f"survey-trees:{survey_id}"
+
+
+def invalidate_survey(survey_id: int, tree_ids: Iterable[int] = ()):
+    """Drop a survey (both representations), its tree list and the given trees"""
+    cache.delete([survey_key(survey_id), survey_key(survey_id, False), survey_trees_key(survey_id),
+                  *(tree_key(tree_id) for tree_id in tree_ids)])
+
+
+def invalidate_tree(tree_id: int, survey_id: int):
+    """Drop a tree and the cached views of its survey that include it"""
+    cache.delete([tree_key(tree_id), survey_key(survey_id), survey_trees_key(survey_id)])
@@ -0,0 +1,160 @@
+"""
+Response compression for low-bandwidth clients.
+
+CompressionMiddleware compresses response bodies of at least COMPRESSION_MINIMUM_SIZE
+bytes with Brotli, when the optional `brotli` package is installed and the client
+accepts `br`, or with gzip otherwise. Streaming responses such as GET /export/surveys
+are compressed chunk by chunk, so memory stays flat. A compressed response's ETag
+gets the coding as a suffix, since a strong validator must differ between encodings. Only JSON, MessagePack and text
+bodies are compressed; anything else, bodies that are already encoded and event
+streams (which must not be buffered) pass through untouched.
+"""
+import os
+import zlib
+from typing import Dict, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from etags import representation_etag
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1000"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+COMPRESSIBLE_TYPES = (
+    "application/json", "application/msgpack", "application/x-ndjson", "application/javascript",
+    "application/manifest+json", "text/csv", "text/css", "text/html", "text/javascript", "text/plain",
+)
+
+
+class GzipCompressor:
+    encoding = "gzip"
+
+    def __init__(self):
+        # wbits=31 writes the gzip container rather than a raw zlib stream
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliCompressor:
+    encoding = "br"
+
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+def choose_compressor(accept_encoding: str) -> Optional[type]:
+    """Compressor for the best coding the Accept-Encoding header allows (Brotli over gzip), or None"""
+    accepted = _codings(accept_encoding)
+    for compressor in (BrotliCompressor, GzipCompressor):
+        if compressor is BrotliCompressor and brotli is None:
+            continue
+        if accepted.get(compressor.encoding, accepted.get("*", 0)) > 0:
+            return compressor
+    return None
+
+
+class CompressionMiddleware:
+    """Compress large textual responses with Brotli or gzip, as negotiated by Accept-Encoding"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        compressor = None
+        if scope["type"] == "http":
+            compressor = choose_compressor(Headers(scope=scope).get("accept-encoding", ""))
+        if compressor is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSender(send, compressor, self.minimum_size).send)
+
+
+class _CompressingSender:
+    """Decides on the first body chunk whether to compress, then compresses every chunk"""
+
+    def __init__(self, send: Send, compressor: type, minimum_size: int):
+        self._send = send
+        self._compressor_class = compressor
+        self._minimum_size = minimum_size
+        self._start: Optional[Message] = None
+        self._compressor = None
+
+    async def send(self, message: Message):
+        if message["type"] == "http.response.start":
+            # Hold the headers until the first chunk shows whether the body is worth compressing
+            self._start = message
+            return
+        if message["type"] != "http.response.body":
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self._start is not None:
+            start, self._start = self._start, None
+            headers = MutableHeaders(raw=start["headers"])
+            media_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+            if "content-encoding" in headers or media_type not in COMPRESSIBLE_TYPES:
+                await self._send(start)
+                await self._send(message)
+                return
+            headers.add_vary_header("Accept-Encoding")
+            if len(body) < self._minimum_size and not more_body:
+                await self._send(start)
+                await self._send(message)
+                return
+            self._compressor = self._compressor_class()
+            body = self._compressor.compress(body)
+            headers["Content-Encoding"] = self._compressor.encoding
+            if "etag" in headers:
+                headers["ETag"] = representation_etag(headers["etag"], self._compressor.encoding)
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                body += self._compressor.finish()
+                headers["Content-Length"] = str(len(body))
+            await self._send(start)
+        elif self._compressor is not None:
+            body = self._compressor.compress(body)
+            if not more_body:
+                body += self._compressor.finish()
+        else:
+            await self._send(message)
+            return
+        await self._send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+
+def _codings(accept_encoding: str) -> Dict[str, float]:
+    """Content codings of an Accept-Encoding header with their quality values"""
+    codings = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        quality = 1.0
+        name, _, value = params.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        if coding.strip():
+            codings[coding.strip().lower()] = quality
+    return codings
@@ -9,18 +9,23 @@ from sqlalchemy.pool import StaticPool
 import os
 import tempfile
 
-from database import Base, get_db
-from models import FarmSurvey
-from main import app
-
-
 # Create a temporary database for testing
 TEST_DB_FILE = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
 TEST_DB_PATH = TEST_DB_FILE.name
 TEST_DB_FILE.close()
 
-# Create test database engine
+# Point the app's own engine (used by the startup schema check) at the test database too
 TEST_SQLALCHEMY_DATABASE_URL = f"sqlite:///{TEST_DB_PATH}"
+os.environ["DATABASE_URL"] = TEST_SQLALCHEMY_DATABASE_URL
+
+from cache import cache
+from database import Base, get_db
+from models import FarmSurvey
+from main import app
+from migrations import upgrade
+from profiler import assert_max_queries
+
+# Create test database engine
 
 test_engine = create_engine(
     TEST_SQLALCHEMY_DATABASE_URL,
@@ -35,7 +40,7 @@ TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=test_
 def db_session():
     """Create a fresh database session for each test"""
     # Create all tables
-    Base.metadata.create_all(bind=test_engine)
+    upgrade(test_engine)
     
     # Create session
     session = TestingSessionLocal()
@@ -44,8 +49,9 @@ def db_session():
         yield session
     finally:
         session.close()
-        # Drop all tables after test
+        # Drop all tables after test, along with any records cached from them
         Base.metadata.drop_all(bind=test_engine)
+        cache.clear()
 
 
 @pytest.fixture(scope="function")
@@ -66,6 +72,12 @@ def client(db_session):
     app.dependency_overrides.clear()
 
 
+@pytest.fixture
+def max_queries():
+    """Context manager factory failing the test if its block runs more than `limit` statements"""
+    return lambda limit: assert_max_queries(test_engine, limit)
+
+
 @pytest.fixture
 def sample_survey_data():
     """Sample survey data for testing"""
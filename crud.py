@@ -0,0 +1,1242 @@
+"""
+Database operations behind the API endpoints.
+
+Every function takes a synchronous SQLAlchemy Session as its first argument so the
+same code serves both the threadpool handlers in main.py and the native async
+handlers in async_api.py (which call these through AsyncSession.run_sync).
+"""
+from fastapi import HTTPException
+from sqlalchemy import select, insert, update, delete, func, and_, or_, tuple_
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm.exc import StaleDataError
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import csv
+import io
+import os
+
+from models import FarmSurvey, Tree, DeletedRecord
+from cache import cache, invalidate_survey, invalidate_tree, survey_key, survey_trees_key, tree_key
+from cursors import encode_cursor, decode_cursor
+from etags import make_etag, precondition_met
+from events import publish, survey_event, tree_event
+from stats import StatsDelta, get_stats
+from search import search as search_index
+from geo import BoundingBox, bbox_for_radius, cell_for, cell_ranges, haversine_km
+from schemas import (
+    FarmSurveyCreate, FarmSurveyUpdate, FarmSurvey as FarmSurveySchema, GeoLocation,
+    TreeCreate, TreeUpdate, Tree as TreeSchema,
+    SurveyBatchRequest, SurveyBatchResponse, SurveyBatchResult,
+    TreeStat as TreeStatSchema
+)
+
+
+def create_survey(db: Session, survey: FarmSurveyCreate) -> FarmSurveySchema:
+    """Create a new farm survey"""
+    db_survey = FarmSurvey(
+        farmer_name=survey.farmer_name,
+        crop_type=survey.crop_type,
+        latitude=survey.geo_location.latitude,
+        longitude=survey.geo_location.longitude,
+        sync_status=survey.sync_status,
+        last_updated=datetime.utcnow()
+    )
+    db.add(db_survey)
+    db.commit()
+    db.refresh(db_survey)
+    publish([survey_event("created", db_survey.survey_id, db_survey.last_updated)])
+
+    # Convert to response schema (a new survey has no trees to load)
+    return _db_to_schema(db_survey, include_trees=False)
+
+
+def batch_upsert_surveys(db: Session, batch: SurveyBatchRequest) -> SurveyBatchResponse:
+    """Create or update many surveys and their trees in a single transaction"""
+    now = datetime.utcnow()
+    results: List[Optional[SurveyBatchResult]] = [None] * len(batch.surveys)
+
+    # Fetch the current timestamp, version and statistics group of every survey targeted
+    # for update in one query
+    update_ids = {item.survey_id for item in batch.surveys if item.survey_id is not None}
+    existing = {}
+    if update_ids:
+        rows = db.execute(
+            select(FarmSurvey.survey_id, FarmSurvey.last_updated, FarmSurvey.version,
+                   FarmSurvey.crop_type, FarmSurvey.geo_cell)
+            .where(FarmSurvey.survey_id.in_(update_ids))
+        )
+        existing = {survey_id: (last_updated, version, (crop_type, geo_cell))
+                    for survey_id, last_updated, version, crop_type, geo_cell in rows}
+
+    to_create, to_update, seen = [], [], set()
+    for index, item in enumerate(batch.surveys):
+        if item.survey_id is None:
+            to_create.append((index, item))
+            continue
+
+        detail = None
+        if item.survey_id in seen:
+            detail = "Conflict: Survey appears more than once in the batch."
+        elif item.survey_id not in existing:
+            detail = "Survey not found"
+        elif (item.version is not None and existing[item.survey_id][1] != item.version) or \
+                (item.last_updated is not None and
+                 abs((existing[item.survey_id][0] - _naive_utc(item.last_updated)).total_seconds()) > 1):
+            detail = "Conflict: Survey was modified since last read. Please fetch the latest version and retry."
+        seen.add(item.survey_id)
+
+        if detail is not None:
+            results[index] = SurveyBatchResult(
+                index=index, survey_id=item.survey_id, status="conflict", detail=detail
+            )
+        else:
+            to_update.append((index, item))
+
+    if to_create:
+        survey_ids = bulk_insert_surveys(db, [item for _, item in to_create], now)
+        for (index, _), survey_id in zip(to_create, survey_ids):
+            results[index] = SurveyBatchResult(index=index, survey_id=survey_id, status="created")
+
+    if to_update:
+        update_ids = [item.survey_id for _, item in to_update]
+        stats_delta = StatsDelta()
+        # Passing the version read above makes this a compare-and-swap per row: the ORM adds
+        # "AND version = ?" and raises StaleDataError if a concurrent write got there first
+        try:
+            db.execute(update(FarmSurvey), [
+                {"survey_id": item.survey_id, "version": existing[item.survey_id][1], **_survey_values(item, now)}
+                for _, item in to_update
+            ])
+        except StaleDataError:
+            db.rollback()
+            raise HTTPException(
+                status_code=409,
+                detail="Conflict: Surveys in the batch were modified concurrently. Please retry the batch."
+            )
+        # Trees sent with an updated survey replace the ones already stored
+        replaced = [item.survey_id for _, item in to_update if item.trees is not None]
+        removed = []
+        if replaced:
+            # The statistics lose exactly the rows deleted, under the group they were counted in
+            removed = db.execute(
+                delete(Tree).where(Tree.survey_id.in_(replaced))
+                .returning(Tree.tree_id, Tree.survey_id, Tree.species_name, Tree.tree_count)
+            ).all()
+            if removed:
+                db.execute(insert(DeletedRecord), [
+                    {"entity_type": "tree", "entity_id": tree.tree_id, "survey_id": tree.survey_id, "deleted_at": now}
+                    for tree in removed
+                ])
+            for tree in removed:
+                stats_delta.add(*existing[tree.survey_id][2], tree.species_name, -tree.tree_count, -1)
+        # Kept trees move to the survey's new crop type and region, if those changed
+        new_keys = {
+            item.survey_id: (item.crop_type, cell_for(item.geo_location.latitude, item.geo_location.longitude))
+            for _, item in to_update
+        }
+        stats_delta.move_survey_trees(db, {
+            item.survey_id: existing[item.survey_id][2] for _, item in to_update
+            if item.trees is None and existing[item.survey_id][2] != new_keys[item.survey_id]
+        })
+        new_trees = []
+        for index, item in to_update:
+            results[index] = SurveyBatchResult(index=index, survey_id=item.survey_id, status="updated")
+            for tree in item.trees or []:
+                new_trees.append(_tree_values(item.survey_id, tree, now))
+                stats_delta.add(*new_keys[item.survey_id], tree.species_name, tree.tree_count)
+        if new_trees:
+            insert_rows(db, Tree, new_trees)
+        stats_delta.apply(db)
+
+    db.commit()
+
+    if to_update:
+        removed_by_survey = {}
+        for tree in removed:
+            removed_by_survey.setdefault(tree.survey_id, []).append(tree.tree_id)
+        for survey_id in update_ids:
+            invalidate_survey(survey_id, removed_by_survey.get(survey_id, ()))
+    # One event per survey written; clients refetch it with its trees
+    publish(survey_event(result.status, result.survey_id, now) for result in results if result.status != "conflict")
+
+    return SurveyBatchResponse(results=results)
+
+
+def bulk_insert_surveys(db: Session, surveys: List[FarmSurveyCreate], now: datetime) -> List[int]:
+    """Insert surveys (and the TreeCreate list in each one's `trees` attribute, if any) with
+    one multi-row INSERT per table. Returns the new survey IDs in input order; does not commit."""
+    if not surveys:
+        return []
+    survey_ids = [
+        survey_id for survey_id, in
+        insert_rows(db, FarmSurvey, [_survey_values(survey, now) for survey in surveys], FarmSurvey.survey_id)
+    ]
+    new_trees = []
+    stats_delta = StatsDelta()
+    for survey, survey_id in zip(surveys, survey_ids):
+        geo_cell = cell_for(survey.geo_location.latitude, survey.geo_location.longitude)
+        for tree in getattr(survey, "trees", None) or []:
+            new_trees.append(_tree_values(survey_id, tree, now))
+            stats_delta.add(survey.crop_type, geo_cell, tree.species_name, tree.tree_count)
+    if new_trees:
+        insert_rows(db, Tree, new_trees)
+        stats_delta.apply(db)
+    return survey_ids
+
+
+def insert_rows(db: Session, model, rows: List[dict], *returning) -> list:
+    """Insert rows into the model's table with one multi-row INSERT (split into batches by
+    the driver's parameter limit only). If `returning` columns are given, the first being the
+    primary key, returns them for the new rows in input order; does not commit.
+
+    The statement goes through the Core table: an ORM bulk insert starts a new statement
+    wherever the pattern of None values changes, and sort_by_parameter_order makes SQLite
+    fall back to one INSERT per row. The database assigns primary keys in VALUES order,
+    so sorting the RETURNING rows by key restores input order instead."""
+    if not rows:
+        return []
+    statement = insert(model.__table__)
+    if not returning:
+        db.execute(statement, rows)
+        return []
+    return sorted(db.execute(statement.returning(*returning), rows).all(), key=lambda row: row[0])
+
+
+class SurveyFilters(NamedTuple):
+    """Conditions on the surveys listed by list_surveys; None leaves a field unfiltered"""
+    crop_type: Optional[str] = None
+    sync_status: Optional[bool] = None
+    farmer_name_prefix: Optional[str] = None
+    updated_since: Optional[datetime] = None
+    updated_before: Optional[datetime] = None
+
+
+# Sort orders of list_surveys (prefixed with "-" for descending); survey_id breaks ties.
+# Each is served by an index: the primary key, ix_farm_surveys_last_updated (or the
+# composite crop_type/sync_status indexes when filtering on those) or ix_farm_surveys_farmer_name.
+SURVEY_SORTS = {
+    "survey_id": FarmSurvey.survey_id,
+    "last_updated": FarmSurvey.last_updated,
+    "farmer_name": FarmSurvey.farmer_name,
+}
+
+
+def list_surveys(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    include_trees: bool = True,
+    fields: Optional[List[str]] = None,
+    filters: SurveyFilters = SurveyFilters(),
+    sort: str = "survey_id"
+) -> Tuple[List[dict], Optional[str]]:
+    """Get a page of the farm surveys matching `filters` in `sort` order, plus the cursor of
+    the next page (if any). `fields` (from parse_survey_fields) limits the columns selected and returned."""
+    query = _survey_page_query(_survey_select(fields), skip, cursor, filters, sort)
+    surveys = _survey_rows(db, query.limit(limit + 1), include_trees, limit, fields)
+    next_cursor = None
+    has_more = len(surveys) > limit
+    surveys = surveys[:max(limit, 0)]
+    if has_more and surveys:  # an empty page has no last row to resume after
+        last_id = surveys[-1]["survey_id"]
+        name = sort.lstrip("-")
+        if name == "survey_id":
+            next_cursor = encode_cursor([last_id])
+        elif name in surveys[-1]:
+            next_cursor = encode_cursor([surveys[-1][name], last_id])
+        else:
+            # The projection left out the sort column
+            value = db.scalar(select(SURVEY_SORTS[name]).where(FarmSurvey.survey_id == last_id))
+            next_cursor = encode_cursor([value, last_id])
+    return surveys, next_cursor
+
+
+def surveys_etag(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    include_trees: bool = True,
+    fields: Optional[List[str]] = None,
+    filters: SurveyFilters = SurveyFilters(),
+    sort: str = "survey_id"
+) -> str:
+    """ETag of a survey list page from the IDs and versions of the surveys on it (and of the
+    first survey after it, which decides the next cursor) and, with trees, the newest updated_at
+    and count of their trees, so writes to other surveys leave the page's ETag alone"""
+    if fields is not None:
+        include_trees = "trees" in fields
+    page = _survey_page_query(
+        select(FarmSurvey.survey_id, FarmSurvey.version), skip, cursor, filters, sort
+    ).limit(max(limit, 0) + 1).cte("page")
+    columns = [page.c.survey_id, page.c.version]
+    if include_trees:
+        page_trees = Tree.survey_id.in_(select(page.c.survey_id))
+        columns += [select(func.max(Tree.updated_at)).where(page_trees).scalar_subquery(),
+                    select(func.count()).where(page_trees).scalar_subquery()]
+    # The sort (with survey_id breaking ties) fixes the order of a given set of surveys and versions
+    rows = sorted(tuple(row) for row in db.execute(select(*columns)))
+    return make_etag("surveys", skip, limit, cursor, include_trees, fields, *filters, sort, rows)
+
+
+def survey_etag(db: Session, survey_id: int, include_trees: bool = True) -> str:
+    """ETag of a survey from its version and, with trees, their newest updated_at and count"""
+    columns = [FarmSurvey.version]
+    if include_trees:
+        columns += [select(func.max(Tree.updated_at)).where(Tree.survey_id == survey_id).scalar_subquery(),
+                    select(func.count()).where(Tree.survey_id == survey_id).scalar_subquery()]
+    row = db.execute(select(*columns).where(FarmSurvey.survey_id == survey_id)).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Survey not found")
+    return make_etag("survey", survey_id, *row)
+
+
+def survey_etag_for(survey: dict, include_trees: bool = True) -> str:
+    """survey_etag of a survey dict returned by get_survey/update_survey"""
+    if not include_trees:
+        return make_etag("survey", survey["survey_id"], survey["version"])
+    newest_tree = max((tree["updated_at"] for tree in survey["trees"]), default=None)
+    return make_etag("survey", survey["survey_id"], survey["version"], newest_tree, len(survey["trees"]))
+
+
+def get_survey(db: Session, survey_id: int, include_trees: bool = True, etag: Optional[str] = None) -> dict:
+    """Get a specific farm survey by ID. With the current survey_etag, a cached copy that
+    doesn't match it (a write by another worker, or a read that cached the old row after
+    the write invalidated it) is dropped and the survey is read again."""
+    key = survey_key(survey_id, include_trees)
+    cached = cache.get(key)
+    if cached is not None:
+        if etag is None or survey_etag_for(cached, include_trees) == etag:
+            return cached
+        cache.delete([key])
+
+    surveys = _survey_rows(db, select(*SURVEY_COLUMNS).where(FarmSurvey.survey_id == survey_id), include_trees)
+    if not surveys:
+        raise HTTPException(status_code=404, detail="Survey not found")
+    cache.set(key, surveys[0])
+    return surveys[0]
+
+
+# First search distance of surveys_near, and how much each further ring widens it
+NEAR_START_KM = 10.0
+NEAR_GROWTH = 2
+
+
+def surveys_near(
+    db: Session,
+    latitude: float,
+    longitude: float,
+    radius_km: float,
+    limit: int = 100,
+    include_trees: bool = False,
+    fields: Optional[List[str]] = None
+) -> List[dict]:
+    """Get the surveys within radius_km of a point, nearest first.
+
+    The search starts NEAR_START_KM out and widens NEAR_GROWTH times per ring until
+    `limit` surveys lie within the searched distance (nothing farther can be nearer) or
+    radius_km is reached, so a large radius around a busy point doesn't read the table."""
+    searched_km = min(NEAR_START_KM, radius_km)
+    while True:
+        bbox = bbox_for_radius(latitude, longitude, searched_km)
+        candidates = db.execute(
+            select(FarmSurvey.survey_id, FarmSurvey.latitude, FarmSurvey.longitude).where(_within_bbox(bbox))
+        ).all()
+
+        # Exact distance check on the candidates the grid index returned
+        distances = {}
+        for survey_id, lat, lon in candidates:
+            distance = haversine_km(latitude, longitude, lat, lon)
+            if distance <= searched_km:
+                distances[survey_id] = distance
+        if len(distances) >= limit or searched_km >= radius_km:
+            break
+        searched_km = min(searched_km * NEAR_GROWTH, radius_km)
+    nearest = sorted(distances, key=lambda survey_id: (distances[survey_id], survey_id))[:limit]
+    if not nearest:
+        return []
+
+    query = _survey_select(fields).where(FarmSurvey.survey_id.in_(nearest))
+    surveys = {survey["survey_id"]: survey for survey in _survey_rows(db, query, include_trees, fields=fields)}
+    return [surveys[survey_id] for survey_id in nearest]
+
+
+def surveys_within(
+    db: Session,
+    bbox: BoundingBox,
+    limit: int = 100,
+    include_trees: bool = False,
+    fields: Optional[List[str]] = None
+) -> List[dict]:
+    """Get the surveys inside a bounding box, ordered by ID"""
+    query = _survey_select(fields).where(_within_bbox(bbox)).order_by(FarmSurvey.survey_id).limit(limit)
+    return _survey_rows(db, query, include_trees, fields=fields)
+
+
+def update_survey(
+    db: Session,
+    survey_id: int,
+    survey_update: FarmSurveyUpdate,
+    last_updated: Optional[datetime] = None,
+    if_match: Optional[str] = None,
+    version: Optional[int] = None
+) -> dict:
+    """Update a farm survey with conflict resolution using its version, last_updated timestamp or an If-Match ETag.
+
+    The update is a single UPDATE ... WHERE survey_id = ? [AND version = ?] RETURNING, so
+    two concurrent writers can't both pass the conflict check."""
+    if if_match is not None:
+        # The client may hold the ETag of either representation (with or without trees);
+        # both derive from the version, which then guards the UPDATE
+        current = db.execute(
+            select(FarmSurvey.version,
+                   select(func.max(Tree.updated_at)).where(Tree.survey_id == survey_id).scalar_subquery(),
+                   select(func.count()).where(Tree.survey_id == survey_id).scalar_subquery())
+            .where(FarmSurvey.survey_id == survey_id)
+        ).first()
+        if current is None:
+            raise HTTPException(status_code=404, detail="Survey not found")
+        etags = [make_etag("survey", survey_id, *current), make_etag("survey", survey_id, current[0])]
+        if not precondition_met(if_match, etags):
+            raise HTTPException(
+                status_code=412,
+                detail="Precondition failed: Survey was modified since last read. Please fetch the latest version and retry."
+            )
+        if version is not None and version != current[0]:
+            raise HTTPException(
+                status_code=409,
+                detail="Conflict: Survey was modified since last read. Please fetch the latest version and retry."
+            )
+        version = current[0]
+
+    conditions = [FarmSurvey.survey_id == survey_id]
+    if version is not None:
+        conditions.append(FarmSurvey.version == version)
+    if last_updated is not None:
+        # Legacy timestamp check, keeping its one-second tolerance
+        conditions.append(FarmSurvey.last_updated.between(last_updated - timedelta(seconds=1),
+                                                          last_updated + timedelta(seconds=1)))
+
+    values = {"last_updated": datetime.utcnow(), "version": FarmSurvey.version + 1}
+    if survey_update.farmer_name is not None:
+        values["farmer_name"] = survey_update.farmer_name
+    if survey_update.crop_type is not None:
+        values["crop_type"] = survey_update.crop_type
+    if survey_update.geo_location is not None:
+        values["latitude"] = survey_update.geo_location.latitude
+        values["longitude"] = survey_update.geo_location.longitude
+        values["geo_cell"] = cell_for(values["latitude"], values["longitude"])
+    if survey_update.sync_status is not None:
+        values["sync_status"] = survey_update.sync_status
+
+    # Trees are counted under the survey's crop type and region, so move them if those change.
+    # The UPDATE only applies to the group read here, so that is the one they are moved out of.
+    old_key = None
+    if survey_update.crop_type is not None or survey_update.geo_location is not None:
+        old_key = db.execute(
+            select(FarmSurvey.crop_type, FarmSurvey.geo_cell).where(FarmSurvey.survey_id == survey_id)
+        ).first()
+        if old_key is None:
+            raise HTTPException(status_code=404, detail="Survey not found")
+        conditions += [FarmSurvey.crop_type == old_key.crop_type, FarmSurvey.geo_cell == old_key.geo_cell]
+
+    row = db.execute(
+        update(FarmSurvey).where(*conditions).values(**values).returning(*SURVEY_COLUMNS)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        db.rollback()
+        current = db.execute(
+            select(FarmSurvey.crop_type, FarmSurvey.geo_cell).where(FarmSurvey.survey_id == survey_id)
+        ).first()
+        if current is None:
+            raise HTTPException(status_code=404, detail="Survey not found")
+        if old_key is not None and tuple(current) != tuple(old_key):
+            # Another update moved the survey to a different group first; retry from there
+            return update_survey(db, survey_id, survey_update, last_updated, if_match, version)
+        raise HTTPException(
+            status_code=412 if if_match is not None else 409,
+            detail="Conflict: Survey was modified since last read. Please fetch the latest version and retry."
+        )
+
+    survey = _survey_dict(row)
+    _attach_trees(db, [survey])
+    if old_key is not None:
+        # The trees just loaded, under the write lock the UPDATE took, are the ones moved
+        stats_delta = StatsDelta()
+        new_key = (values.get("crop_type", old_key.crop_type), values.get("geo_cell", old_key.geo_cell))
+        for tree in survey["trees"]:
+            stats_delta.move(tuple(old_key), new_key, tree["species_name"], tree["tree_count"])
+        stats_delta.apply(db)
+    db.commit()
+    invalidate_survey(survey_id)
+    publish([survey_event("updated", survey_id, survey["last_updated"])])
+    return survey
+
+
+def delete_survey(db: Session, survey_id: int) -> None:
+    """Delete a farm survey (cascades to delete all associated trees).
+
+    Plain DELETE ... RETURNING statements without the version check the ORM would add, so
+    an update landing after the survey was looked up can't fail the delete, and the
+    statistics are taken from the rows actually deleted."""
+    trees = db.execute(
+        delete(Tree).where(Tree.survey_id == survey_id)
+        .returning(Tree.tree_id, Tree.species_name, Tree.tree_count)
+        .execution_options(synchronize_session=False)
+    ).all()
+    survey = db.execute(
+        delete(FarmSurvey).where(FarmSurvey.survey_id == survey_id)
+        .returning(FarmSurvey.crop_type, FarmSurvey.geo_cell)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if survey is None:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="Survey not found")
+    stats_delta = StatsDelta()
+    for tree in trees:
+        stats_delta.add(survey.crop_type, survey.geo_cell, tree.species_name, -tree.tree_count, -1)
+    stats_delta.apply(db)
+    deleted_at = datetime.utcnow()
+    db.add(DeletedRecord(entity_type="survey", entity_id=survey_id, survey_id=survey_id, deleted_at=deleted_at))
+    db.commit()
+    invalidate_survey(survey_id, [tree.tree_id for tree in trees])
+    publish([survey_event("deleted", survey_id, deleted_at)])
+
+
+def create_tree(db: Session, survey_id: int, tree: TreeCreate) -> TreeSchema:
+    """Create a new tree record for a survey"""
+    # Verify survey exists
+    survey = db.query(FarmSurvey).filter(FarmSurvey.survey_id == survey_id).first()
+    if not survey:
+        raise HTTPException(status_code=404, detail="Survey not found")
+
+    db_tree = Tree(
+        survey_id=survey_id,
+        species_name=tree.species_name,
+        tree_count=tree.tree_count,
+        height_avg=tree.height_avg,
+        diameter_avg=tree.diameter_avg,
+        age_avg=tree.age_avg,
+        notes=tree.notes,
+        created_at=datetime.utcnow(),
+        updated_at=datetime.utcnow()
+    )
+    db.add(db_tree)
+    stats_delta = StatsDelta()
+    stats_delta.add(survey.crop_type, survey.geo_cell, tree.species_name, tree.tree_count)
+    stats_delta.apply(db)
+    db.commit()
+    db.refresh(db_tree)
+    invalidate_tree(db_tree.tree_id, survey_id)
+    publish([tree_event("created", db_tree.tree_id, survey_id, db_tree.updated_at)])
+
+    return _db_tree_to_schema(db_tree)
+
+
+def create_trees(db: Session, survey_id: int, trees: List[TreeCreate]) -> List[dict]:
+    """Add many tree records to a survey with one multi-row INSERT in one transaction"""
+    survey = db.execute(
+        select(FarmSurvey.crop_type, FarmSurvey.geo_cell).where(FarmSurvey.survey_id == survey_id)
+    ).first()
+    if survey is None:
+        raise HTTPException(status_code=404, detail="Survey not found")
+
+    stats_delta = StatsDelta()
+    created = _insert_trees(db, survey_id, survey.crop_type, survey.geo_cell, trees, stats_delta)
+    stats_delta.apply(db)
+    db.commit()
+    invalidate_survey(survey_id)
+    publish(tree_event("created", tree["tree_id"], survey_id, tree["updated_at"]) for tree in created)
+    return created
+
+
+def replace_trees(db: Session, survey_id: int, trees: List[TreeCreate], merge_species: bool = False) -> List[dict]:
+    """Replace all tree records of a survey in one transaction, optionally merging
+    records of the same species into one first"""
+    if merge_species:
+        trees = _merge_species(trees)
+
+    now = datetime.utcnow()
+    # Delete first: the statistics then lose exactly the rows deleted, and the survey's group
+    # is read under the write lock the DELETE took
+    removed = db.execute(
+        delete(Tree).where(Tree.survey_id == survey_id).returning(Tree.tree_id, Tree.species_name, Tree.tree_count)
+    ).all()
+    survey = db.execute(
+        select(FarmSurvey.crop_type, FarmSurvey.geo_cell).where(FarmSurvey.survey_id == survey_id)
+    ).first()
+    if survey is None:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="Survey not found")
+    stats_delta = StatsDelta()
+    for tree in removed:
+        stats_delta.add(survey.crop_type, survey.geo_cell, tree.species_name, -tree.tree_count, -1)
+    if removed:
+        db.execute(insert(DeletedRecord), [
+            {"entity_type": "tree", "entity_id": tree.tree_id, "survey_id": survey_id, "deleted_at": now}
+            for tree in removed
+        ])
+    created = _insert_trees(db, survey_id, survey.crop_type, survey.geo_cell, trees, stats_delta, now)
+    stats_delta.apply(db)
+    db.commit()
+    removed_ids = [tree.tree_id for tree in removed]
+    invalidate_survey(survey_id, removed_ids)
+    publish([*(tree_event("deleted", tree_id, survey_id, now) for tree_id in removed_ids),
+             *(tree_event("created", tree["tree_id"], survey_id, now) for tree in created)])
+    return created
+
+
+def list_trees(
+    db: Session,
+    survey_id: int,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+) -> Tuple[List[dict], Optional[str]]:
+    """Get the trees of a survey ordered by ID, plus the cursor of the next page (if any)"""
+    # Only the complete list is cached; pages are cheap keyset seeks
+    cacheable = limit is None and cursor is None
+    if cacheable:
+        cached = cache.get(survey_trees_key(survey_id))
+        if cached is not None:
+            return cached, None
+
+    # Verify survey exists
+    if db.scalar(select(FarmSurvey.survey_id).where(FarmSurvey.survey_id == survey_id)) is None:
+        raise HTTPException(status_code=404, detail="Survey not found")
+
+    query = select(*TREE_COLUMNS).where(Tree.survey_id == survey_id).order_by(Tree.tree_id)
+    if cursor is not None:
+        query = query.where(Tree.tree_id > _decode_id_cursor(cursor))
+    if limit is None:
+        trees = [_tree_row(row) for row in db.execute(query)]
+        if cacheable:
+            cache.set(survey_trees_key(survey_id), trees)
+        return trees, None
+
+    trees = [_tree_row(row) for row in db.execute(query.limit(limit + 1))]
+    next_cursor = None
+    if len(trees) > limit:
+        trees = trees[:limit]
+        next_cursor = encode_cursor([trees[-1]["tree_id"]])
+    return trees, next_cursor
+
+
+def tree_etag(db: Session, tree_id: int) -> str:
+    """ETag of a tree from its version"""
+    version = db.scalar(select(Tree.version).where(Tree.tree_id == tree_id))
+    if version is None:
+        raise HTTPException(status_code=404, detail="Tree not found")
+    return make_etag("tree", tree_id, version)
+
+
+def tree_etag_for(tree: dict) -> str:
+    """tree_etag of a tree dict returned by get_tree/update_tree"""
+    return make_etag("tree", tree["tree_id"], tree["version"])
+
+
+def get_tree(db: Session, tree_id: int, etag: Optional[str] = None) -> dict:
+    """Get a specific tree by ID; a cached copy that doesn't match the current tree_etag is
+    dropped and the tree read again, as in get_survey"""
+    cached = cache.get(tree_key(tree_id))
+    if cached is not None:
+        if etag is None or tree_etag_for(cached) == etag:
+            return cached
+        cache.delete([tree_key(tree_id)])
+
+    row = db.execute(select(*TREE_COLUMNS).where(Tree.tree_id == tree_id)).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Tree not found")
+    result = _tree_row(row)
+    cache.set(tree_key(tree_id), result)
+    return result
+
+
+# Times update_tree retries when a concurrent write beats it and the client didn't ask for
+# conflict detection
+TREE_UPDATE_ATTEMPTS = 5
+
+
+def update_tree(
+    db: Session,
+    tree_id: int,
+    tree_update: TreeUpdate,
+    if_match: Optional[str] = None,
+    version: Optional[int] = None
+) -> dict:
+    """Update a tree record with a single UPDATE ... WHERE tree_id = ? [AND version = ?] RETURNING,
+    optionally only if it still has the given version or If-Match ETag"""
+    values = tree_update.model_dump(exclude_none=True)
+    values.update(updated_at=datetime.utcnow(), version=Tree.version + 1)
+    recount = "species_name" in values or "tree_count" in values
+    for attempt in range(TREE_UPDATE_ATTEMPTS):
+        current = None
+        expected = version
+        if if_match is not None or recount:
+            # The statistics need the old species and count, and If-Match the current version.
+            # The version read here then guards the UPDATE, so a write in between is noticed.
+            current = db.execute(
+                select(Tree.version, Tree.species_name, Tree.tree_count, FarmSurvey.crop_type, FarmSurvey.geo_cell)
+                .join(FarmSurvey, Tree.survey_id == FarmSurvey.survey_id)
+                .where(Tree.tree_id == tree_id)
+            ).first()
+            if current is None:
+                raise HTTPException(status_code=404, detail="Tree not found")
+            if not precondition_met(if_match, [make_etag("tree", tree_id, current.version)]):
+                raise HTTPException(
+                    status_code=412,
+                    detail="Precondition failed: Tree was modified since last read. Please fetch the latest version and retry."
+                )
+            if version is not None and version != current.version:
+                raise HTTPException(
+                    status_code=409,
+                    detail="Conflict: Tree was modified since last read. Please fetch the latest version and retry."
+                )
+            expected = current.version
+
+        conditions = [Tree.tree_id == tree_id]
+        if expected is not None:
+            conditions.append(Tree.version == expected)
+        row = db.execute(
+            update(Tree).where(*conditions).values(**values).returning(*TREE_COLUMNS)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if row is not None:
+            break
+        db.rollback()
+        if db.scalar(select(Tree.tree_id).where(Tree.tree_id == tree_id)) is None:
+            raise HTTPException(status_code=404, detail="Tree not found")
+        # A client that sent no version or If-Match gets last-write-wins: read the tree again and retry
+        if if_match is not None or version is not None or attempt == TREE_UPDATE_ATTEMPTS - 1:
+            raise HTTPException(
+                status_code=412 if if_match is not None else 409,
+                detail="Conflict: Tree was modified since last read. Please fetch the latest version and retry."
+            )
+
+    tree = _tree_row(row)
+    if recount:
+        stats_delta = StatsDelta()
+        stats_delta.add(current.crop_type, current.geo_cell, current.species_name, -current.tree_count, -1)
+        stats_delta.add(current.crop_type, current.geo_cell, tree["species_name"], tree["tree_count"])
+        stats_delta.apply(db)
+    db.commit()
+    invalidate_tree(tree_id, tree["survey_id"])
+    publish([tree_event("updated", tree_id, tree["survey_id"], tree["updated_at"])])
+    return tree
+
+
+def delete_tree(db: Session, tree_id: int) -> None:
+    """Delete a tree record with a plain DELETE ... RETURNING, as in delete_survey"""
+    tree = db.execute(
+        delete(Tree).where(Tree.tree_id == tree_id)
+        .returning(Tree.survey_id, Tree.species_name, Tree.tree_count)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if tree is None:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="Tree not found")
+    survey = db.execute(
+        select(FarmSurvey.crop_type, FarmSurvey.geo_cell).where(FarmSurvey.survey_id == tree.survey_id)
+    ).one()
+    stats_delta = StatsDelta()
+    stats_delta.add(survey.crop_type, survey.geo_cell, tree.species_name, -tree.tree_count, -1)
+    stats_delta.apply(db)
+    deleted_at = datetime.utcnow()
+    db.add(DeletedRecord(entity_type="tree", entity_id=tree_id, survey_id=tree.survey_id, deleted_at=deleted_at))
+    db.commit()
+    invalidate_tree(tree_id, tree.survey_id)
+    publish([tree_event("deleted", tree_id, tree.survey_id, deleted_at)])
+
+
+def get_tree_stats(db: Session, dimension: str, limit: int = 1000) -> List[TreeStatSchema]:
+    """Get tree totals grouped by species, crop type or region, largest first"""
+    return [TreeStatSchema.model_validate(row) for row in get_stats(db, dimension, limit)]
+
+
+def search(db: Session, q: str, skip: int = 0, limit: int = 20) -> List[dict]:
+    """Get surveys and trees matching a full-text query, best match first, as SearchHit dicts"""
+    return search_index(db, q, skip, limit)
+
+
+# How far behind the clock the change feed stays. Writes stamp last_updated/updated_at/
+# deleted_at when they start, not when they commit, so a row stamped a moment ago may
+# still be in flight behind a newer one that is already visible; returning it later
+# would put it behind a client's cursor. Writes taking longer than this can still be
+# missed, so keep it above the longest write transaction.
+SYNC_SAFETY_LAG = timedelta(seconds=float(os.getenv("SYNC_SAFETY_LAG_SECONDS", "5")))
+# Position after every row stamped at the same time, for cursors from before they held IDs
+_AFTER_ALL_IDS = 2 ** 63 - 1
+
+
+def get_changes(db: Session, since: Optional[str] = None, limit: int = 1000) -> dict:
+    """Get up to `limit` surveys, trees and deletes each changed since the given cursor, as a
+    SyncChanges dict; has_more says whether another call with next_cursor returns more.
+
+    Each kind is read in (timestamp, id) order from its own keyset position, so rows
+    sharing a timestamp are never skipped at a page boundary, and only up to
+    SYNC_SAFETY_LAG before now."""
+    horizon = datetime.utcnow() - SYNC_SAFETY_LAG
+    if since is None:
+        # A full sync has nothing cached locally, so earlier deletes don't concern it
+        positions = [(datetime.min, 0), (datetime.min, 0), (horizon, 0)]
+    else:
+        positions = _decode_sync_cursor(since)
+
+    survey_rows, more_surveys = _changes_after(
+        db, select(*SURVEY_COLUMNS), FarmSurvey.last_updated, FarmSurvey.survey_id, positions[0], horizon, limit
+    )
+    tree_rows, more_trees = _changes_after(
+        db, select(*TREE_COLUMNS), Tree.updated_at, Tree.tree_id, positions[1], horizon, limit
+    )
+    deleted_rows, more_deleted = [], False
+    if since is not None:
+        deleted_rows, more_deleted = _changes_after(
+            db, select(DeletedRecord.id, DeletedRecord.entity_type, DeletedRecord.entity_id,
+                       DeletedRecord.survey_id, DeletedRecord.deleted_at),
+            DeletedRecord.deleted_at, DeletedRecord.id, positions[2], horizon, limit
+        )
+
+    if survey_rows:
+        positions[0] = (survey_rows[-1].last_updated, survey_rows[-1].survey_id)
+    if tree_rows:
+        positions[1] = (tree_rows[-1].updated_at, tree_rows[-1].tree_id)
+    if deleted_rows:
+        positions[2] = (deleted_rows[-1].deleted_at, deleted_rows[-1].id)
+    return {
+        "surveys": [_survey_dict(row) for row in survey_rows],
+        "trees": [_tree_row(row) for row in tree_rows],
+        "deleted": [
+            {"entity_type": row.entity_type, "entity_id": row.entity_id, "survey_id": row.survey_id,
+             "deleted_at": row.deleted_at}
+            for row in deleted_rows
+        ],
+        "next_cursor": encode_cursor([value for position in positions for value in position]),
+        "has_more": more_surveys or more_trees or more_deleted,
+    }
+
+
+EXPORT_CSV_COLUMNS = [
+    "survey_id", "farmer_name", "crop_type", "latitude", "longitude", "sync_status", "last_updated",
+    "tree_id", "species_name", "tree_count", "height_avg", "diameter_avg", "age_avg", "notes",
+    "tree_created_at", "tree_updated_at",
+]
+
+
+def export_surveys(
+    db: Session,
+    export_format: str = "ndjson",
+    updated_since: Optional[datetime] = None,
+    updated_until: Optional[datetime] = None,
+    crop_type: Optional[str] = None,
+    chunk_size: int = 1000
+) -> Iterator[str]:
+    """Stream every matching survey with its trees as NDJSON lines or CSV rows (one row per tree)
+
+    Rows are read in chunks of chunk_size (a server-side cursor on Postgres) and each
+    chunk is dropped from the session once written, so memory stays flat regardless of
+    table size. The generator closes the session when it finishes.
+    """
+    query = (
+        select(FarmSurvey)
+        .options(selectinload(FarmSurvey.trees))
+        .order_by(FarmSurvey.survey_id)
+        .execution_options(yield_per=chunk_size)
+    )
+    if updated_since is not None:
+        query = query.where(FarmSurvey.last_updated >= updated_since)
+    if updated_until is not None:
+        query = query.where(FarmSurvey.last_updated < updated_until)
+    if crop_type is not None:
+        query = query.where(FarmSurvey.crop_type == crop_type)
+
+    try:
+        if export_format == "csv":
+            yield _csv_line(EXPORT_CSV_COLUMNS)
+        for surveys in db.scalars(query).partitions():
+            if export_format == "csv":
+                yield "".join(_csv_line(row) for survey in surveys for row in _survey_csv_rows(survey))
+            else:
+                yield "".join(_db_to_schema(survey).model_dump_json() + "\n" for survey in surveys)
+            db.expunge_all()
+    finally:
+        db.close()
+
+
+def _db_to_schema(db_survey: FarmSurvey, include_trees: bool = True) -> FarmSurveySchema:
+    """Helper function to convert database model to Pydantic schema"""
+    trees = []
+    if include_trees and db_survey.trees:
+        trees = [_db_tree_to_schema(tree) for tree in db_survey.trees]
+
+    return FarmSurveySchema(
+        survey_id=db_survey.survey_id,
+        farmer_name=db_survey.farmer_name,
+        crop_type=db_survey.crop_type,
+        geo_location=GeoLocation(
+            latitude=db_survey.latitude,
+            longitude=db_survey.longitude
+        ),
+        sync_status=db_survey.sync_status,
+        last_updated=db_survey.last_updated,
+        version=db_survey.version,
+        trees=trees
+    )
+
+
+def _db_tree_to_schema(db_tree: Tree) -> TreeSchema:
+    """Helper function to convert Tree database model to Pydantic schema"""
+    return TreeSchema(
+        tree_id=db_tree.tree_id,
+        survey_id=db_tree.survey_id,
+        species_name=db_tree.species_name,
+        tree_count=db_tree.tree_count,
+        height_avg=db_tree.height_avg,
+        diameter_avg=db_tree.diameter_avg,
+        age_avg=db_tree.age_avg,
+        notes=db_tree.notes,
+        created_at=db_tree.created_at,
+        updated_at=db_tree.updated_at,
+        version=db_tree.version
+    )
+
+
+# Columns behind the read endpoints, which skip ORM objects and Pydantic models and
+# return dicts shaped like the FarmSurvey/Tree response schemas (see serializers.py)
+SURVEY_COLUMNS = (
+    FarmSurvey.survey_id, FarmSurvey.farmer_name, FarmSurvey.crop_type, FarmSurvey.latitude,
+    FarmSurvey.longitude, FarmSurvey.sync_status, FarmSurvey.last_updated, FarmSurvey.version,
+)
+TREE_COLUMNS = (
+    Tree.tree_id, Tree.survey_id, Tree.species_name, Tree.tree_count, Tree.height_avg,
+    Tree.diameter_avg, Tree.age_avg, Tree.notes, Tree.created_at, Tree.updated_at, Tree.version,
+)
+# Columns behind each field of the survey response, in response order, for sparse fieldsets
+SURVEY_FIELDS = {
+    "farmer_name": (FarmSurvey.farmer_name,),
+    "crop_type": (FarmSurvey.crop_type,),
+    "geo_location": (FarmSurvey.latitude, FarmSurvey.longitude),
+    "sync_status": (FarmSurvey.sync_status,),
+    "survey_id": (FarmSurvey.survey_id,),
+    "last_updated": (FarmSurvey.last_updated,),
+    "version": (FarmSurvey.version,),
+    "trees": (),
+}
+
+
+def parse_survey_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Field names requested by a comma-separated `fields` parameter, in response order and
+    always including survey_id, or None (every field) when the parameter is absent"""
+    if fields is None:
+        return None
+    names = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = names - SURVEY_FIELDS.keys()
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}. Valid fields: {', '.join(SURVEY_FIELDS)}"
+        )
+    names.add("survey_id")
+    return [name for name in SURVEY_FIELDS if name in names]
+
+
+def _survey_select(fields: Optional[List[str]] = None):
+    """SELECT of SURVEY_COLUMNS, or only the columns behind the given fields"""
+    if fields is None:
+        return select(*SURVEY_COLUMNS)
+    return select(*(column for name in fields for column in SURVEY_FIELDS[name]))
+
+
+def _survey_rows(
+    db: Session,
+    query,
+    include_trees: bool,
+    limit: Optional[int] = None,
+    fields: Optional[List[str]] = None
+) -> List[dict]:
+    """Run a SELECT from _survey_select and build response dicts, loading the trees of all
+    returned surveys with one extra SELECT (only the first `limit` surveys, if given).
+    With fields, only those keys are built and trees are loaded only if "trees" is one of them."""
+    if fields is None:
+        surveys = [_survey_dict(row) for row in db.execute(query)]
+    else:
+        include_trees = "trees" in fields
+        surveys = [_survey_fields_dict(row, fields) for row in db.execute(query)]
+    if include_trees:
+        _attach_trees(db, surveys[:limit])
+    return surveys
+
+
+def _survey_dict(row) -> dict:
+    """Response dict (without trees yet) for a row of SURVEY_COLUMNS"""
+    survey_id, farmer_name, crop_type, latitude, longitude, sync_status, last_updated, version = row
+    return {
+        "farmer_name": farmer_name,
+        "crop_type": crop_type,
+        "geo_location": {"latitude": latitude, "longitude": longitude},
+        "sync_status": sync_status,
+        "survey_id": survey_id,
+        "last_updated": last_updated,
+        "version": version,
+        "trees": [],
+    }
+
+
+def _survey_fields_dict(row, fields: List[str]) -> dict:
+    """Response dict holding only the given fields for a row of _survey_select(fields)"""
+    survey = {}
+    for name in fields:
+        if name == "geo_location":
+            survey[name] = {"latitude": row.latitude, "longitude": row.longitude}
+        elif name == "trees":
+            survey[name] = []
+        else:
+            survey[name] = getattr(row, name)
+    return survey
+
+
+def _attach_trees(db: Session, surveys: List[dict]):
+    """Fill in the trees of the given survey dicts with one SELECT"""
+    if not surveys:
+        return
+    trees_by_survey = {survey["survey_id"]: survey["trees"] for survey in surveys}
+    query = select(*TREE_COLUMNS).where(Tree.survey_id.in_(trees_by_survey)).order_by(Tree.tree_id)
+    for row in db.execute(query):
+        trees_by_survey[row.survey_id].append(_tree_row(row))
+
+
+def _tree_row(row) -> dict:
+    """Response dict for a row of TREE_COLUMNS"""
+    (tree_id, survey_id, species_name, tree_count, height_avg, diameter_avg, age_avg, notes,
+     created_at, updated_at, version) = row
+    return {
+        "species_name": species_name,
+        "tree_count": tree_count,
+        "height_avg": height_avg,
+        "diameter_avg": diameter_avg,
+        "age_avg": age_avg,
+        "notes": notes,
+        "tree_id": tree_id,
+        "survey_id": survey_id,
+        "created_at": created_at,
+        "updated_at": updated_at,
+        "version": version,
+    }
+
+
+def _within_bbox(bbox: BoundingBox):
+    """Helper function to build a filter that seeks the geo_cell index, then checks the exact box"""
+    min_lat, min_lon, max_lat, max_lon = bbox
+    cells = or_(*(FarmSurvey.geo_cell.between(low, high) for low, high in cell_ranges(bbox)))
+    if min_lon <= max_lon:
+        longitude = FarmSurvey.longitude.between(min_lon, max_lon)
+    else:
+        # The box crosses the antimeridian
+        longitude = or_(FarmSurvey.longitude >= min_lon, FarmSurvey.longitude <= max_lon)
+    return and_(cells, FarmSurvey.latitude.between(min_lat, max_lat), longitude)
+
+
+def _decode_id_cursor(cursor: str) -> int:
+    """Helper function to decode a keyset pagination cursor holding the last seen ID"""
+    try:
+        (last_id,) = decode_cursor(cursor)
+    except ValueError:
+        last_id = None
+    if not isinstance(last_id, int):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    return last_id
+
+
+def _survey_page_query(query, skip: int, cursor: Optional[str], filters: SurveyFilters, sort: str):
+    """Helper function to filter, order and position a survey SELECT for a list_surveys page"""
+    name, descending = sort.lstrip("-"), sort.startswith("-")
+    keys = [FarmSurvey.survey_id] if name == "survey_id" else [SURVEY_SORTS[name], FarmSurvey.survey_id]
+    query = query.where(*_survey_conditions(filters)).order_by(*(key.desc() if descending else key for key in keys))
+    if cursor is not None:
+        # Keyset pagination: seek past the last sort position instead of counting skipped rows
+        position = _decode_sort_cursor(cursor, name)
+        if len(keys) == 1:
+            bound, value = keys[0], position[0]
+        else:
+            bound, value = tuple_(*keys), tuple_(*position)
+            # Implied by the row comparison, but lets PostgreSQL seek the index on the sort column too
+            query = query.where(keys[0] <= position[0] if descending else keys[0] >= position[0])
+        query = query.where(bound < value if descending else bound > value)
+    elif skip:
+        query = query.offset(skip)
+    return query
+
+
+def _decode_sort_cursor(cursor: str, sort: str) -> list:
+    """Helper function to decode a list_surveys cursor: [last ID] when sorting by ID,
+    otherwise [last sort value, last ID]"""
+    if sort == "survey_id":
+        return [_decode_id_cursor(cursor)]
+    try:
+        value, last_id = decode_cursor(cursor)
+    except ValueError:
+        value = last_id = None
+    expected = datetime if sort == "last_updated" else str
+    if not isinstance(value, expected) or not isinstance(last_id, int):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    return [value, last_id]
+
+
+def _survey_conditions(filters: SurveyFilters) -> list:
+    """Helper function to build the WHERE conditions of SurveyFilters. Each can seek an index:
+    crop_type and sync_status lead composite indexes with last_updated, and the farmer name
+    prefix is a range on ix_farm_surveys_farmer_name (LIKE 'x%' would not use it on SQLite)."""
+    conditions = []
+    if filters.crop_type is not None:
+        conditions.append(FarmSurvey.crop_type == filters.crop_type)
+    if filters.sync_status is not None:
+        conditions.append(FarmSurvey.sync_status == filters.sync_status)
+    if filters.farmer_name_prefix:
+        prefix = filters.farmer_name_prefix
+        conditions.append(FarmSurvey.farmer_name >= prefix)
+        if prefix[-1] != "\U0010ffff":
+            # The first string after every string that starts with the prefix
+            conditions.append(FarmSurvey.farmer_name < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+    if filters.updated_since is not None:
+        conditions.append(FarmSurvey.last_updated >= _naive_utc(filters.updated_since))
+    if filters.updated_before is not None:
+        conditions.append(FarmSurvey.last_updated < _naive_utc(filters.updated_before))
+    return conditions
+
+
+def _decode_sync_cursor(cursor: str) -> List[Tuple[datetime, int]]:
+    """Helper function to decode a get_changes cursor into (timestamp, id) positions of the
+    surveys, trees and deletes read so far. A cursor holding one timestamp (from before
+    positions held IDs) stands for every row stamped up to that time."""
+    try:
+        values = decode_cursor(cursor)
+    except ValueError:
+        values = []
+    if len(values) == 1 and isinstance(values[0], datetime):
+        return [(values[0], _AFTER_ALL_IDS)] * 3
+    positions = list(zip(values[0::2], values[1::2]))
+    if len(values) != 6 or not all(isinstance(at, datetime) and isinstance(row_id, int) for at, row_id in positions):
+        raise HTTPException(status_code=400, detail="Invalid sync cursor")
+    return positions
+
+
+def _changes_after(db: Session, query, stamp, key, position: Tuple[datetime, int], horizon: datetime, limit: int):
+    """Helper function to read up to `limit` rows after a (timestamp, id) position and stamped
+    no later than `horizon`, in that order; returns them and whether more remain"""
+    rows = db.execute(
+        query
+        # The first condition is implied by the row comparison, but lets the timestamp index seek
+        .where(stamp >= position[0], tuple_(stamp, key) > tuple_(*position), stamp <= horizon)
+        .order_by(stamp, key)
+        .limit(limit + 1)
+    ).all()
+    return rows[:limit], len(rows) > limit
+
+
+def _naive_utc(value: datetime) -> datetime:
+    """Helper function to compare a client timestamp with the stored naive UTC ones"""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _survey_values(survey: FarmSurveyCreate, now: datetime) -> dict:
+    """Helper function to build column values for a bulk survey insert or update"""
+    return {
+        "farmer_name": survey.farmer_name,
+        "crop_type": survey.crop_type,
+        "latitude": survey.geo_location.latitude,
+        "longitude": survey.geo_location.longitude,
+        "geo_cell": cell_for(survey.geo_location.latitude, survey.geo_location.longitude),
+        "sync_status": survey.sync_status,
+        "last_updated": now,
+    }
+
+
+def _tree_values(survey_id: int, tree: TreeCreate, now: datetime) -> dict:
+    """Helper function to build column values for a bulk tree insert"""
+    return {
+        "survey_id": survey_id,
+        "species_name": tree.species_name,
+        "tree_count": tree.tree_count,
+        "height_avg": tree.height_avg,
+        "diameter_avg": tree.diameter_avg,
+        "age_avg": tree.age_avg,
+        "notes": tree.notes,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def _insert_trees(
+    db: Session,
+    survey_id: int,
+    crop_type: str,
+    geo_cell: int,
+    trees: List[TreeCreate],
+    stats_delta: StatsDelta,
+    now: Optional[datetime] = None
+) -> List[dict]:
+    """Helper function to insert trees with one multi-row INSERT ... RETURNING and record
+    them in stats_delta. Returns the response dicts in input order; does not commit."""
+    if not trees:
+        return []
+    now = now or datetime.utcnow()
+    rows = insert_rows(db, Tree, [_tree_values(survey_id, tree, now) for tree in trees], *TREE_COLUMNS)
+    for tree in trees:
+        stats_delta.add(crop_type, geo_cell, tree.species_name, tree.tree_count)
+    return [_tree_row(row) for row in rows]
+
+
+def _merge_species(trees: List[TreeCreate]) -> List[TreeCreate]:
+    """Helper function to combine trees of the same species into one record: counts are
+    summed, averages weighted by tree_count (over the records that have them) and notes joined"""
+    groups = {}
+    for tree in trees:
+        groups.setdefault(tree.species_name, []).append(tree)
+
+    merged = []
+    for species_name, group in groups.items():
+        if len(group) == 1:
+            merged.append(group[0])
+            continue
+
+        def weighted(field: str) -> Optional[float]:
+            known = [(getattr(tree, field), tree.tree_count) for tree in group if getattr(tree, field) is not None]
+            if not known:
+                return None
+            return sum(value * count for value, count in known) / sum(count for _, count in known)
+
+        age_avg = weighted("age_avg")
+        notes = [tree.notes for tree in group if tree.notes]
+        merged.append(TreeCreate(
+            species_name=species_name,
+            tree_count=sum(tree.tree_count for tree in group),
+            height_avg=weighted("height_avg"),
+            diameter_avg=weighted("diameter_avg"),
+            age_avg=round(age_avg) if age_avg is not None else None,
+            notes="; ".join(notes) if notes else None,
+        ))
+    return merged
+
+
+def _survey_csv_rows(db_survey: FarmSurvey) -> Iterator[list]:
+    """Helper function to flatten a survey into CSV rows, one per tree (or one row without trees)"""
+    survey_columns = [
+        db_survey.survey_id, db_survey.farmer_name, db_survey.crop_type, db_survey.latitude,
+        db_survey.longitude, db_survey.sync_status, db_survey.last_updated.isoformat(),
+    ]
+    if not db_survey.trees:
+        yield survey_columns + [None] * (len(EXPORT_CSV_COLUMNS) - len(survey_columns))
+    for tree in db_survey.trees:
+        yield survey_columns + [
+            tree.tree_id, tree.species_name, tree.tree_count, tree.height_avg, tree.diameter_avg,
+            tree.age_avg, tree.notes, tree.created_at.isoformat(), tree.updated_at.isoformat(),
+        ]
+
+
+def _csv_line(values: list) -> str:
+    """Helper function to render one CSV row"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
@@ -1,7 +1,16 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, List, NamedTuple, Optional
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -10,17 +19,196 @@ load_dotenv()
 # Database URL
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./farm_survey.db")
 
-# Create engine
-if "sqlite" in SQLALCHEMY_DATABASE_URL:
-    engine = create_engine(
-        SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+# An async driver in the URL (e.g. sqlite+aiosqlite://, postgresql+asyncpg://) switches
+# the API to native async handlers. A sync engine on the backend's default driver is
+# still created for table creation and scripts.
+_url = make_url(SQLALCHEMY_DATABASE_URL)
+ASYNC_DATABASE = _url.get_dialect().is_async
+SYNC_DATABASE_URL = _url.set(drivername=_url.get_backend_name()) if ASYNC_DATABASE else _url
+IS_SQLITE = _url.get_backend_name() == "sqlite"
+
+# Connection pool settings (ignored for in-memory SQLite, which uses a single connection)
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+POOL_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# PRAGMAs applied to every new SQLite connection. WAL lets readers run alongside a
+# writer, and busy_timeout makes writers wait for the lock instead of failing with
+# "database is locked". A negative cache_size is in KiB.
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-64000")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+}
+
+
+class PoolStats:
+    """Thread-safe counters for connection checkouts and the time spent waiting on the pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_checkout(self, waited: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+
+class CapturedStatement(NamedTuple):
+    """One statement run by the database, as captured by track_queries(capture=True)"""
+    statement: str
+    parameters: Any
+    seconds: float
+    executemany: bool
+
+
+class QueryStats:
+    """Statements executed, time spent executing them and time spent waiting for a pooled
+    connection, collected by track_queries(). `statements` lists each statement when
+    capturing, and is None otherwise."""
+
+    __slots__ = ("queries", "seconds", "pool_wait_seconds", "statements", "parent")
+
+    def __init__(self, capture: bool = False, parent: Optional["QueryStats"] = None):
+        self.queries = 0
+        self.seconds = 0.0
+        self.pool_wait_seconds = 0.0
+        self.statements: Optional[List[CapturedStatement]] = [] if capture else None
+        self.parent = parent
+
+    def chain(self) -> Iterator["QueryStats"]:
+        """These stats and those of every enclosing track_queries() block"""
+        stats = self
+        while stats is not None:
+            yield stats
+            stats = stats.parent
+
+
+_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+@contextmanager
+def track_queries(capture: bool = False) -> Iterator[QueryStats]:
+    """Collect QueryStats for the database work done inside the block, on any engine, and
+    with `capture` every statement with its parameters and timing. The stats follow the
+    context into threadpool handlers and async drivers, so wrapping a request counts every
+    statement it causes. Work inside nested blocks counts toward every enclosing block."""
+    stats = QueryStats(capture, _query_stats.get())
+    token = _query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _query_stats.reset(token)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _query_stats.get() is not None:
+        context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    current = _query_stats.get()
+    started = getattr(context, "_query_started", None)
+    if current is None or started is None:
+        return
+    elapsed = time.perf_counter() - started
+    for stats in current.chain():
+        stats.queries += 1
+        stats.seconds += elapsed
+        if stats.statements is not None:
+            stats.statements.append(CapturedStatement(statement, parameters, elapsed, executemany))
+
+
+class _TimedPoolMixin:
+    """Records how long each checkout waits for a connection, including pool timeouts"""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            self._record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        self._record_wait(time.perf_counter() - start)
+        return connection
+
+    @staticmethod
+    def _record_wait(waited: float, timed_out: bool = False):
+        _pool_stats.record_checkout(waited, timed_out)
+        current = _query_stats.get()
+        if current is not None:
+            for stats in current.chain():
+                stats.pool_wait_seconds += waited
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+_pool_stats = PoolStats()
+
+
+def _engine_options(url, poolclass) -> dict:
+    """Build create_engine keyword arguments for the given URL"""
+    options = {}
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}
+    if url.database in (None, "", ":memory:"):
+        return options
+    options.update(
+        poolclass=poolclass,
+        pool_size=POOL_SIZE,
+        max_overflow=POOL_MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+        pool_recycle=POOL_RECYCLE,
+        pool_pre_ping=POOL_PRE_PING,
     )
-else:
-    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    return options
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply SQLITE_PRAGMAS to a freshly opened SQLite connection"""
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+# Create engine
+engine = create_engine(SYNC_DATABASE_URL, **_engine_options(SYNC_DATABASE_URL, TimedQueuePool))
+if IS_SQLITE:
+    event.listen(engine, "connect", _set_sqlite_pragmas)
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Create the async engine and session factory only when an async driver is configured
+async_engine = None
+AsyncSessionLocal = None
+if ASYNC_DATABASE:
+    async_engine = create_async_engine(_url, **_engine_options(_url, TimedAsyncAdaptedQueuePool))
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False)
+    if IS_SQLITE:
+        event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
 # Create Base class for models
 Base = declarative_base()
 
@@ -33,3 +221,29 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    """Dependency to get an async database session"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def pool_stats() -> dict:
+    """Current size of the connection pool serving the API plus checkout/wait counters"""
+    pool = (async_engine.sync_engine if ASYNC_DATABASE else engine).pool
+    stats = {
+        "pool_class": type(pool).__name__,
+        "checkouts": _pool_stats.checkouts,
+        "timeouts": _pool_stats.timeouts,
+        "wait_seconds_total": _pool_stats.wait_seconds_total,
+        "wait_seconds_max": _pool_stats.wait_seconds_max,
+        "wait_seconds_avg": _pool_stats.wait_seconds_total / _pool_stats.checkouts if _pool_stats.checkouts else 0.0,
+    }
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=pool.overflow(),
+            max_overflow=POOL_MAX_OVERFLOW,
+        )
+    return stats
@@ -0,0 +1,84 @@
+"""
+Strong ETags for conditional requests.
+
+ETags are hashed from the version columns (FarmSurvey.version, Tree.version, the
+newest Tree.updated_at of a survey, and for collections the newest timestamp plus the
+row count) rather than from the
+response body, so crud.py can compute them with one small query and a matching
+If-None-Match is answered with 304 before anything is loaded or serialized.
+
+A strong ETag must change with the bytes sent, so the middlewares that re-encode a
+response tag it with representation_etag(): MessagePack bodies get a "-msgpack"
+suffix and gzip/Brotli bodies "-gzip"/"-br". The comparisons below ignore these
+suffixes, since every representation carries the same document.
+"""
+import hashlib
+from typing import List, Optional
+
+from fastapi import Response
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag (quoted hash) of the given version values"""
+    digest = hashlib.blake2b("|".join(str(part) for part in parts).encode(), digest_size=16)
+    return f'"{digest.hexdigest()}"'
+
+
+def representation_etag(etag: str, suffix: str) -> str:
+    """ETag of an encoding of the representation the given ETag belongs to"""
+    return f'{etag[:-1]}-{suffix}"' if etag.endswith('"') else etag
+
+
+def not_modified(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches the current ETag in any representation (weak comparison)"""
+    return _matching_tag(if_none_match, etag) is not None
+
+
+def precondition_met(if_match: Optional[str], etags: List[str]) -> bool:
+    """Whether an If-Match header is absent or matches one of the current ETags in any
+    representation (strong comparison)"""
+    if if_match is None:
+        return True
+    tags = _parse(if_match)
+    current = {_document(etag) for etag in etags}
+    return "*" in tags or any(_document(tag) in current for tag in tags if not tag.startswith("W/"))
+
+
+def not_modified_response(etag: str, if_none_match: Optional[str] = None) -> Response:
+    """Empty 304 response for a client whose cached copy is current. It carries the tag the
+    client sent, which names the representation it holds."""
+    return Response(status_code=304, headers={"ETag": _matching_tag(if_none_match, etag) or etag})
+
+
+# Suffixes representation_etag() adds, outermost last
+REPRESENTATION_SUFFIXES = ("-gzip", "-br", "-msgpack")
+
+
+def _matching_tag(if_none_match: Optional[str], etag: str) -> Optional[str]:
+    """The If-None-Match entry matching the ETag (the ETag itself for "*"), or None"""
+    if not if_none_match:
+        return None
+    document = _document(etag)
+    for tag in _parse(if_none_match):
+        if tag == "*":
+            return etag
+        if _document(tag) == document:
+            return tag
+    return None
+
+
+def _parse(header: str) -> List[str]:
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+
+def _document(tag: str) -> str:
+    """The tag without W/ and representation suffixes"""
+    tag = tag[2:] if tag.startswith("W/") else tag
+    stripped = True
+    while stripped:
+        stripped = False
+        for suffix in REPRESENTATION_SUFFIXES:
+            if tag.endswith(suffix + '"'):
+                tag = tag[:-len(suffix) - 1] + '"'
+                stripped = True
+    return tag
@@ -0,0 +1,227 @@
+"""
+Live change events for GET /events (Server-Sent Events).
+
+crud.py calls publish() right after every write commits, with one compact event per
+changed survey or tree:
+
+    {"entity": "tree", "op": "updated", "id": 7, "survey_id": 3, "last_updated": "2024-06-01T09:30:00.120000"}
+
+so open pages can refresh just those records instead of polling the list. Each event
+is encoded once and the same bytes are queued for every subscriber. A subscriber is a
+bounded queue on the event loop, so thousands of idle connections cost a few KB each
+and no thread. One that falls EVENTS_QUEUE_SIZE batches behind is disconnected rather
+than buffered without limit; EventSource reconnects by itself, and a client that may
+have missed events catches up with GET /sync/changes.
+
+The backend is chosen from the environment:
+- default: events reach the subscribers of the worker that made the write, so only
+  use it with a single worker.
+- EVENTS_URL=redis://host:6379/0: events are published to a Redis channel (requires
+  the `redis` package) and every worker relays them to its own subscribers.
+"""
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import AsyncIterator, Iterable, List, Optional, Set
+
+EVENTS_URL = os.getenv("EVENTS_URL")
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "256"))
+EVENTS_MAX_SUBSCRIBERS = int(os.getenv("EVENTS_MAX_SUBSCRIBERS", "10000"))
+EVENTS_KEEPALIVE_SECONDS = float(os.getenv("EVENTS_KEEPALIVE_SECONDS", "15"))
+# Milliseconds EventSource waits before reconnecting
+EVENTS_RETRY_MS = 3000
+
+
+class Subscriber:
+    """One open event stream: the frames waiting to be sent to it"""
+
+    def __init__(self, queue_size: int):
+        self.queue: "asyncio.Queue[bytes]" = asyncio.Queue(queue_size)
+        self.closed = False
+
+
+class EventHub:
+    """This worker's subscribers. Only touched from the event loop; other threads hand
+    frames over with deliver_threadsafe()."""
+
+    def __init__(self, queue_size: int = EVENTS_QUEUE_SIZE, max_subscribers: int = EVENTS_MAX_SUBSCRIBERS):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._subscribers: Set[Subscriber] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self) -> Subscriber:
+        """Register a subscriber; must be called on the event loop. Raises OverflowError when full."""
+        if len(self._subscribers) >= self.max_subscribers:
+            raise OverflowError("Too many event subscribers")
+        self._loop = asyncio.get_running_loop()
+        subscriber = Subscriber(self.queue_size)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def deliver(self, frames: bytes):
+        """Queue encoded frames for every subscriber (on the event loop)"""
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.queue.put_nowait(frames)
+            except asyncio.QueueFull:
+                # Too slow to keep up: drop it; it reconnects and resyncs
+                subscriber.closed = True
+                self._subscribers.discard(subscriber)
+                self.dropped += 1
+        self.delivered += 1
+
+    def deliver_threadsafe(self, frames: bytes):
+        """deliver() from any thread (request threadpool, backend listener, the loop itself)"""
+        loop = self._loop
+        if loop is None or not self._subscribers or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self.deliver, frames)
+        except RuntimeError:
+            # The loop closed in between
+            pass
+
+
+class LocalBroker:
+    """Events stay in this process"""
+    name = "local"
+
+    def __init__(self, hub: EventHub):
+        self.hub = hub
+
+    def start(self):
+        """Begin receiving events from other workers (nothing to do here)"""
+
+    def publish(self, payloads: List[str]):
+        self.hub.deliver_threadsafe(encode_frames(payloads))
+
+
+class RedisBroker(LocalBroker):
+    """Events go through a Redis pub/sub channel, so subscribers of every worker see them.
+    Publishing only queues the batch for a background thread, so a write never waits on
+    Redis; another thread relays the channel to this worker's hub. Both are started on
+    first use, in the worker process (serve.py forks after importing the app)."""
+    name = "redis"
+    channel = "farm-survey:events"
+
+    def __init__(self, url: str, hub: EventHub):
+        super().__init__(hub)
+        try:
+            import redis
+        except ImportError as exc:
+            raise RuntimeError("EVENTS_URL points at Redis but the `redis` package is not installed") from exc
+        self._redis = redis
+        self._url = url
+        self._outbox: "queue.SimpleQueue[List[str]]" = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._publisher: Optional[threading.Thread] = None
+        self._listener: Optional[threading.Thread] = None
+
+    def start(self):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name="events-listener", daemon=True)
+                self._listener.start()
+
+    def publish(self, payloads: List[str]):
+        with self._lock:
+            if self._publisher is None or not self._publisher.is_alive():
+                self._publisher = threading.Thread(target=self._publish, name="events-publisher", daemon=True)
+                self._publisher.start()
+        self._outbox.put(payloads)
+
+    def _publish(self):
+        client = self._redis.Redis.from_url(self._url)
+        while True:
+            payloads = self._outbox.get()
+            try:
+                client.publish(self.channel, "[" + ",".join(payloads) + "]")
+            except self._redis.RedisError:
+                # Events are best effort; clients resync from GET /sync/changes
+                pass
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis.Redis.from_url(self._url).pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    payloads = [json.dumps(event, separators=(",", ":")) for event in json.loads(message["data"])]
+                    self.hub.deliver_threadsafe(encode_frames(payloads))
+            except self._redis.RedisError:
+                time.sleep(1)
+
+
+def create_broker(hub: EventHub) -> LocalBroker:
+    """Backend selected by EVENTS_URL"""
+    if EVENTS_URL:
+        return RedisBroker(EVENTS_URL, hub)
+    return LocalBroker(hub)
+
+
+hub = EventHub()
+broker = create_broker(hub)
+
+
+def stats() -> dict:
+    """Subscriber and delivery counters of this worker"""
+    return {
+        "backend": broker.name,
+        "subscribers": hub.subscribers,
+        "max_subscribers": hub.max_subscribers,
+        "batches_delivered": hub.delivered,
+        "subscribers_dropped": hub.dropped,
+    }
+
+
+def survey_event(op: str, survey_id: int, last_updated: datetime) -> dict:
+    return {"entity": "survey", "op": op, "id": survey_id, "survey_id": survey_id,
+            "last_updated": last_updated.isoformat()}
+
+
+def tree_event(op: str, tree_id: int, survey_id: int, last_updated: datetime) -> dict:
+    return {"entity": "tree", "op": op, "id": tree_id, "survey_id": survey_id,
+            "last_updated": last_updated.isoformat()}
+
+
+def publish(events: Iterable[dict]):
+    """Send committed changes to every subscriber; safe to call from any thread"""
+    payloads = [json.dumps(event, separators=(",", ":")) for event in events]
+    if payloads:
+        broker.publish(payloads)
+
+
+def encode_frames(payloads: List[str]) -> bytes:
+    """SSE frames of a batch of JSON-encoded events"""
+    return "".join(f"data: {payload}\n\n" for payload in payloads).encode()
+
+
+async def stream(subscriber: Subscriber, keepalive_seconds: float = EVENTS_KEEPALIVE_SECONDS) -> AsyncIterator[bytes]:
+    """Body of a GET /events response: frames as they arrive, and a comment line when idle so
+    proxies keep the connection open. Unsubscribes when the client goes away."""
+    try:
+        yield f"retry: {EVENTS_RETRY_MS}\n\n".encode()
+        while not subscriber.closed:
+            try:
+                frames = await asyncio.wait_for(subscriber.queue.get(), keepalive_seconds)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            if frames:
+                yield frames
+    finally:
+        hub.unsubscribe(subscriber)
@@ -0,0 +1,110 @@
+"""
+Grid-cell spatial indexing for survey locations.
+
+The globe is divided into CELL_SIZE_DEG x CELL_SIZE_DEG cells numbered row by row
+(row = latitude band, column = longitude), and each survey stores its cell number in
+the B-tree indexed `geo_cell` column. Cells in the same latitude band are numbered
+consecutively, so a bounding box becomes one `geo_cell BETWEEN lo AND hi` range per
+band. Candidates from the index are then checked exactly (bounding box in SQL,
+haversine distance in Python for radius queries).
+"""
+import math
+from typing import List, Tuple
+
+CELL_SIZE_DEG = 0.1
+LAT_CELLS = int(round(180 / CELL_SIZE_DEG))
+LON_CELLS = int(round(360 / CELL_SIZE_DEG))
+# Regions used for dashboard statistics are blocks of REGION_CELLS x REGION_CELLS cells (1 degree)
+REGION_CELLS = 10
+# Above this many latitude bands, a single range covering the whole band span is used
+MAX_CELL_RANGES = 256
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+# (min_lat, min_lon, max_lat, max_lon); min_lon > max_lon means the box crosses the antimeridian
+BoundingBox = Tuple[float, float, float, float]
+
+
+def _row(latitude: float) -> int:
+    return min(max(int((latitude + 90) / CELL_SIZE_DEG), 0), LAT_CELLS - 1)
+
+
+def _col(longitude: float) -> int:
+    return min(max(int((longitude + 180) / CELL_SIZE_DEG), 0), LON_CELLS - 1)
+
+
+def cell_for(latitude: float, longitude: float) -> int:
+    """Grid cell number containing the given point"""
+    return _row(latitude) * LON_CELLS + _col(longitude)
+
+
+def region_for_cell(cell: int) -> str:
+    """Statistics region of a grid cell, named by the latitude/longitude of its south-west corner"""
+    row, col = divmod(cell, LON_CELLS)
+    return region_name(row // REGION_CELLS, col // REGION_CELLS)
+
+
+def region_name(region_row: int, region_col: int) -> str:
+    """Name of the region at the given row/column of the region grid, e.g. "12,77" """
+    degrees = REGION_CELLS * CELL_SIZE_DEG
+    return f"{round(region_row * degrees - 90):d},{round(region_col * degrees - 180):d}"
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points in kilometers"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bbox_for_radius(latitude: float, longitude: float, radius_km: float) -> BoundingBox:
+    """Smallest latitude/longitude box containing every point within radius_km of the center"""
+    d_lat = radius_km / KM_PER_DEGREE_LAT
+    min_lat, max_lat = latitude - d_lat, latitude + d_lat
+    if min_lat <= -90 or max_lat >= 90:
+        # The circle covers a pole, so every longitude is in range
+        return max(min_lat, -90.0), -180.0, min(max_lat, 90.0), 180.0
+
+    # Use the box edge nearest the pole, where a degree of longitude is shortest
+    widest_lat = max(abs(min_lat), abs(max_lat))
+    d_lon = radius_km / (KM_PER_DEGREE_LAT * math.cos(math.radians(widest_lat)))
+    if d_lon >= 180:
+        return min_lat, -180.0, max_lat, 180.0
+    min_lon, max_lon = longitude - d_lon, longitude + d_lon
+    if min_lon < -180:
+        min_lon += 360
+    if max_lon > 180:
+        max_lon -= 360
+    return min_lat, min_lon, max_lat, max_lon
+
+
+def cell_ranges(bbox: BoundingBox) -> List[Tuple[int, int]]:
+    """Inclusive geo_cell ranges that cover the bounding box"""
+    min_lat, min_lon, max_lat, max_lon = bbox
+    first_row, last_row = _row(min_lat), _row(max_lat)
+    full_width = min_lon <= -180 and max_lon >= 180
+    if full_width or last_row - first_row + 1 > MAX_CELL_RANGES:
+        return [(first_row * LON_CELLS, last_row * LON_CELLS + LON_CELLS - 1)]
+
+    if min_lon <= max_lon:
+        col_spans = [(_col(min_lon), _col(max_lon))]
+    else:
+        col_spans = [(_col(min_lon), LON_CELLS - 1), (0, _col(max_lon))]
+    return [
+        (row * LON_CELLS + first_col, row * LON_CELLS + last_col)
+        for row in range(first_row, last_row + 1)
+        for first_col, last_col in col_spans
+    ]
+
+
+def parse_bbox(value: str) -> BoundingBox:
+    """Parse a "min_lon,min_lat,max_lon,max_lat" string (GeoJSON order), raising ValueError if invalid"""
+    parts = [float(part) for part in value.split(",")]
+    if len(parts) != 4:
+        raise ValueError("bbox must have four comma-separated numbers")
+    min_lon, min_lat, max_lon, max_lat = parts
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+        raise ValueError("bbox coordinates are out of range")
+    return min_lat, min_lon, max_lat, max_lon
@@ -0,0 +1,196 @@
+"""
+Chunked bulk import of surveys from CSV or NDJSON files.
+
+The file is parsed as a stream, each record is validated against SurveyImportRecord,
+and valid records are written with multi-row INSERTs committed every `batch_size`
+rows. Invalid records are reported and skipped without aborting the file. When a
+job_id is given, the position of the last committed row is stored in the same
+transaction as the data, so re-running the same job resumes after it.
+
+File formats match GET /export/surveys:
+- CSV: one row per tree. Consecutive rows sharing a non-empty `survey_id` value (a
+  key local to the file) belong to the same survey; rows without one are separate
+  surveys. Tree columns may be left blank for surveys without trees.
+- NDJSON: one survey object per line with `geo_location` and a nested `trees` list.
+
+Usage:
+    python importer.py surveys.csv --batch-size 5000 --job-id coop-2024-06
+"""
+import argparse
+import csv
+import json
+import sys
+from datetime import datetime
+from typing import Iterator, List, Optional, TextIO, Tuple, Union
+
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+import crud
+from events import publish, survey_event
+from models import ImportJob
+from schemas import ImportReport, ImportRowError, SurveyImportRecord
+
+TREE_COLUMNS = ["species_name", "tree_count", "height_avg", "diameter_avg", "age_avg", "notes"]
+MAX_REPORTED_ERRORS = 1000
+
+
+def import_surveys(
+    db: Session,
+    stream: TextIO,
+    import_format: str = "csv",
+    batch_size: int = 1000,
+    start_row: int = 0,
+    job_id: Optional[str] = None
+) -> ImportReport:
+    """Import surveys from a CSV or NDJSON text stream, committing every batch_size rows"""
+    job = None
+    if job_id is not None:
+        job = db.get(ImportJob, job_id)
+        if job is None:
+            job = ImportJob(job_id=job_id, last_committed_row=0, surveys_imported=0, trees_imported=0)
+            db.add(job)
+        start_row = max(start_row, job.last_committed_row)
+
+    pending: List[SurveyImportRecord] = []
+    errors: List[ImportRowError] = []
+    error_count = surveys_imported = trees_imported = 0
+    committed_row = last_row = start_row
+
+    def flush():
+        nonlocal committed_row, surveys_imported, trees_imported
+        now = datetime.utcnow()
+        survey_ids = crud.bulk_insert_surveys(db, pending, now)
+        tree_count = sum(len(record.trees) for record in pending)
+        if job is not None:
+            job.last_committed_row = last_row
+            job.surveys_imported += len(pending)
+            job.trees_imported += tree_count
+            job.updated_at = now
+        db.commit()
+        publish(survey_event("created", survey_id, now) for survey_id in survey_ids)
+        surveys_imported += len(pending)
+        trees_imported += tree_count
+        committed_row = last_row
+        pending.clear()
+
+    for first_row, last_row, payload in _read_records(stream, import_format):
+        if last_row <= start_row:
+            # Already committed by an earlier run of this import
+            continue
+        try:
+            if isinstance(payload, Exception):
+                raise payload
+            pending.append(SurveyImportRecord.model_validate(payload))
+        except (ValidationError, ValueError) as exc:
+            error_count += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append(ImportRowError(row=first_row, errors=_error_messages(exc)))
+        if last_row - committed_row >= batch_size:
+            flush()
+    if last_row > committed_row:
+        flush()
+
+    return ImportReport(
+        job_id=job_id,
+        rows_processed=last_row - start_row,
+        surveys_imported=surveys_imported,
+        trees_imported=trees_imported,
+        error_count=error_count,
+        errors=errors,
+        last_committed_row=committed_row
+    )
+
+
+def _read_records(stream: TextIO, import_format: str) -> Iterator[Tuple[int, int, Union[dict, Exception]]]:
+    """Yield (first_row, last_row, payload) for each survey record in the stream"""
+    if import_format == "ndjson":
+        for row_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield row_number, row_number, json.loads(line)
+            except ValueError as exc:
+                yield row_number, row_number, ValueError(f"Invalid JSON: {exc}")
+        return
+
+    group, group_key, first_row, last_row = None, None, 0, 0
+    for row_number, row in enumerate(csv.DictReader(stream), start=1):
+        key = (row.get("survey_id") or "").strip()
+        if group is not None and key and key == group_key:
+            tree = _csv_tree(row)
+            if tree is not None:
+                group["trees"].append(tree)
+            last_row = row_number
+            continue
+        if group is not None:
+            yield first_row, last_row, group
+        group, group_key, first_row, last_row = _csv_survey(row), key, row_number, row_number
+    if group is not None:
+        yield first_row, last_row, group
+
+
+def _csv_survey(row: dict) -> dict:
+    """Build a survey payload from the survey columns of a CSV row"""
+    survey = {
+        "farmer_name": row.get("farmer_name"),
+        "crop_type": row.get("crop_type"),
+        "geo_location": {"latitude": _blank(row.get("latitude")), "longitude": _blank(row.get("longitude"))},
+        "trees": [],
+    }
+    if _blank(row.get("sync_status")) is not None:
+        survey["sync_status"] = row["sync_status"].strip()
+    tree = _csv_tree(row)
+    if tree is not None:
+        survey["trees"].append(tree)
+    return survey
+
+
+def _csv_tree(row: dict) -> Optional[dict]:
+    """Build a tree payload from the tree columns of a CSV row, or None if they are all blank"""
+    tree = {column: _blank(row.get(column)) for column in TREE_COLUMNS}
+    if all(value is None for value in tree.values()):
+        return None
+    return tree
+
+
+def _blank(value: Optional[str]) -> Optional[str]:
+    """Treat empty CSV cells as missing values"""
+    if value is None or not value.strip():
+        return None
+    return value.strip()
+
+
+def _error_messages(exc: Exception) -> List[str]:
+    """Flatten a validation or parse error into readable messages"""
+    if isinstance(exc, ValidationError):
+        return [f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in exc.errors()]
+    return [str(exc)]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Bulk import farm surveys from a CSV or NDJSON file")
+    parser.add_argument("path", help="File to import")
+    parser.add_argument("--format", dest="import_format", choices=["csv", "ndjson"],
+                        help="File format (default: guessed from the extension)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rows per committed chunk (default: 1000)")
+    parser.add_argument("--start-row", type=int, default=0, help="Skip rows up to and including this one")
+    parser.add_argument("--job-id", help="Checkpoint progress under this ID so a re-run resumes where it stopped")
+    args = parser.parse_args(argv)
+
+    from database import SessionLocal
+
+    import_format = args.import_format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+    db = SessionLocal()
+    try:
+        with open(args.path, newline="", encoding="utf-8-sig") as stream:
+            report = import_surveys(db, stream, import_format, args.batch_size, args.start_row, args.job_id)
+    finally:
+        db.close()
+    print(report.model_dump_json(indent=2))
+    return 1 if report.error_count else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
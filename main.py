@@ -1,26 +1,50 @@
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import List, Literal, Optional
+from contextlib import asynccontextmanager
 from datetime import datetime
-
-from database import Base, engine, get_db
-from models import FarmSurvey, Tree
+import io
+import tempfile
+
+import crud
+import events
+import importer
+from async_api import router as async_router
+from cache import cache
+from database import engine, get_db, pool_stats, ASYNC_DATABASE
+from etags import not_modified, not_modified_response
+from geo import parse_bbox
+from migrations import check_schema
+from compression import CompressionMiddleware
+from metrics import MetricsMiddleware, render as render_metrics
+from profiler import SQL_PROFILE, SQLProfilerMiddleware
+from serializers import ContentNegotiationMiddleware, json_response
 from schemas import (
     FarmSurveyCreate, FarmSurveyUpdate, FarmSurvey as FarmSurveySchema,
-    TreeCreate, TreeUpdate, Tree as TreeSchema
+    TreeCreate, TreeUpdate, Tree as TreeSchema,
+    SurveyBatchRequest, SurveyBatchResponse, SyncChanges, PoolStatus, CacheStatus, EventsStatus, ImportReport, SearchHit, TreeStat as TreeStatSchema
 )
 
 from fastapi.middleware.cors import CORSMiddleware
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Refuse to start against a database the migrations haven't brought up to date. Tables
+    are created and altered by migrations.py (or serve.py --migrate), never at import, so
+    workers start without DDL or reflection."""
+    check_schema(engine)
+    yield
+
 
 app = FastAPI(
     title="Farm Survey API",
     description="API for managing farm surveys with conflict resolution",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -30,11 +54,28 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["X-Next-Cursor", "ETag"],  # Lets browsers read pagination cursors and ETags
 )
 
+# MessagePack for clients that ask for it, then Brotli/gzip for large bodies (outermost,
+# so MessagePack responses are compressed too)
+app.add_middleware(ContentNegotiationMiddleware)
+app.add_middleware(CompressionMiddleware)
+# Opt-in per-request SQL capture for the slow-query log, N+1 warnings and Server-Timing
+if SQL_PROFILE:
+    app.add_middleware(SQLProfilerMiddleware)
+# Prometheus metrics around everything, so latency and response sizes are what clients see
+app.add_middleware(MetricsMiddleware)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# With an async driver in DATABASE_URL (e.g. sqlite+aiosqlite, postgresql+asyncpg) the
+# database endpoints are served by native async handlers. They are registered first so
+# they take precedence over the threadpool handlers below, which document the API.
+if ASYNC_DATABASE:
+    app.include_router(async_router, include_in_schema=False)
+
 
 @app.get("/")
 def read_root():
@@ -45,85 +86,120 @@ def read_root():
 @app.post("/surveys/", response_model=FarmSurveySchema, status_code=201)
 def create_survey(survey: FarmSurveyCreate, db: Session = Depends(get_db)):
     """Create a new farm survey"""
-    db_survey = FarmSurvey(
-        farmer_name=survey.farmer_name,
-        crop_type=survey.crop_type,
-        latitude=survey.geo_location.latitude,
-        longitude=survey.geo_location.longitude,
-        sync_status=survey.sync_status,
-        last_updated=datetime.utcnow()
-    )
-    db.add(db_survey)
-    db.commit()
-    db.refresh(db_survey)
-    
-    # Convert to response schema
-    return _db_to_schema(db_survey)
+    return crud.create_survey(db, survey)
+
+
+@app.post("/surveys/batch", response_model=SurveyBatchResponse)
+def batch_upsert_surveys(batch: SurveyBatchRequest, db: Session = Depends(get_db)):
+    """Create or update many surveys and their trees in a single transaction"""
+    return crud.batch_upsert_surveys(db, batch)
 
 
 @app.get("/surveys/", response_model=List[FarmSurveySchema])
-def get_surveys(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """Get all farm surveys"""
-    surveys = db.query(FarmSurvey).offset(skip).limit(limit).all()
-    return [_db_to_schema(survey, include_trees=True) for survey in surveys]
+def get_surveys(
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of surveys to return"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor value from the previous page"),
+    include_trees: bool = Query(True, description="Include each survey's trees; list views can skip them"),
+    fields: Optional[str] = Query(
+        None, description="Comma-separated response fields to return (survey_id is always included), e.g. survey_id,farmer_name,geo_location"
+    ),
+    crop_type: Optional[str] = Query(None, description="Only surveys of this crop type"),
+    sync_status: Optional[bool] = Query(None, description="Only synced (true) or unsynced (false) surveys"),
+    farmer_name_prefix: Optional[str] = Query(
+        None, min_length=1, max_length=100, description="Only farmer names starting with this text (case-sensitive)"
+    ),
+    updated_since: Optional[datetime] = Query(None, description="Only surveys updated at or after this time"),
+    updated_before: Optional[datetime] = Query(None, description="Only surveys updated before this time"),
+    sort: Literal["survey_id", "-survey_id", "last_updated", "-last_updated", "farmer_name", "-farmer_name"] = Query(
+        "survey_id", description="Sort field, prefixed with - for descending; ties are broken by survey_id"
+    ),
+    if_none_match: Optional[str] = Header(None, description="ETag of the cached page; 304 if still current"),
+    db: Session = Depends(get_db)
+):
+    """Get the farm surveys matching the filters, in `sort` order; the X-Next-Cursor header points at the next page"""
+    projection = crud.parse_survey_fields(fields)
+    filters = crud.SurveyFilters(crop_type, sync_status, farmer_name_prefix, updated_since, updated_before)
+    etag = crud.surveys_etag(db, skip, limit, cursor, include_trees, projection, filters, sort)
+    if not_modified(if_none_match, etag):
+        return not_modified_response(etag, if_none_match)
+    surveys, next_cursor = crud.list_surveys(db, skip, limit, cursor, include_trees, projection, filters, sort)
+    headers = {"ETag": etag}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+    return json_response(surveys, headers)
+
+
+@app.get("/surveys/near", response_model=List[FarmSurveySchema])
+def get_surveys_near(
+    lat: float = Query(..., ge=-90, le=90, description="Latitude of the center point"),
+    lon: float = Query(..., ge=-180, le=180, description="Longitude of the center point"),
+    radius_km: float = Query(..., gt=0, le=20000, description="Search radius in kilometers"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of surveys to return"),
+    include_trees: bool = Query(False, description="Include each survey's trees"),
+    fields: Optional[str] = Query(
+        None, description="Comma-separated response fields to return (survey_id is always included), e.g. survey_id,farmer_name,geo_location"
+    ),
+    db: Session = Depends(get_db)
+):
+    """Get surveys within a radius of a point, nearest first"""
+    projection = crud.parse_survey_fields(fields)
+    return json_response(crud.surveys_near(db, lat, lon, radius_km, limit, include_trees, projection))
+
+
+@app.get("/surveys/within", response_model=List[FarmSurveySchema])
+def get_surveys_within(
+    bbox: str = Query(..., description="Bounding box as min_lon,min_lat,max_lon,max_lat"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of surveys to return"),
+    include_trees: bool = Query(False, description="Include each survey's trees"),
+    fields: Optional[str] = Query(
+        None, description="Comma-separated response fields to return (survey_id is always included), e.g. survey_id,farmer_name,geo_location"
+    ),
+    db: Session = Depends(get_db)
+):
+    """Get surveys inside a bounding box (min_lon greater than max_lon crosses the antimeridian)"""
+    try:
+        bounds = parse_bbox(bbox)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid bbox: {exc}")
+    projection = crud.parse_survey_fields(fields)
+    return json_response(crud.surveys_within(db, bounds, limit, include_trees, projection))
 
 
 @app.get("/surveys/{survey_id}", response_model=FarmSurveySchema)
-def get_survey(survey_id: int, db: Session = Depends(get_db)):
+def get_survey(
+    survey_id: int,
+    include_trees: bool = Query(True, description="Include the survey's trees"),
+    if_none_match: Optional[str] = Header(None, description="ETag of the cached survey; 304 if still current"),
+    db: Session = Depends(get_db)
+):
     """Get a specific farm survey by ID"""
-    survey = db.query(FarmSurvey).filter(FarmSurvey.survey_id == survey_id).first()
-    if not survey:
-        raise HTTPException(status_code=404, detail="Survey not found")
-    return _db_to_schema(survey)
+    etag = crud.survey_etag(db, survey_id, include_trees)
+    if not_modified(if_none_match, etag):
+        return not_modified_response(etag, if_none_match)
+    survey = crud.get_survey(db, survey_id, include_trees, etag)
+    # The ETag of the body actually returned, which is newer than `etag` if a write landed in between
+    return json_response(survey, {"ETag": crud.survey_etag_for(survey, include_trees)})
 
 
 @app.put("/surveys/{survey_id}", response_model=FarmSurveySchema)
 def update_survey(
-    survey_id: int, 
-    survey_update: FarmSurveyUpdate, 
+    survey_id: int,
+    survey_update: FarmSurveyUpdate,
     db: Session = Depends(get_db),
-    last_updated: Optional[datetime] = Query(None, description="Last updated timestamp for conflict resolution")
+    last_updated: Optional[datetime] = Query(None, description="Last updated timestamp for conflict resolution"),
+    if_match: Optional[str] = Header(None, description="Only update if the survey still has this ETag (412 otherwise)"),
+    version: Optional[int] = Query(None, description="Only update if the survey still has this version (409 otherwise)")
 ):
-    """Update a farm survey with conflict resolution using last_updated timestamp"""
-    db_survey = db.query(FarmSurvey).filter(FarmSurvey.survey_id == survey_id).first()
-    if not db_survey:
-        raise HTTPException(status_code=404, detail="Survey not found")
-    
-    # Conflict resolution: check if last_updated matches (if provided)
-    if last_updated is not None:
-        # Normalize timestamps for comparison (remove microseconds difference)
-        if abs((db_survey.last_updated - last_updated).total_seconds()) > 1:
-            raise HTTPException(
-                status_code=409, 
-                detail="Conflict: Survey was modified since last read. Please fetch the latest version and retry."
-            )
-    
-    # Update fields if provided
-    if survey_update.farmer_name is not None:
-        db_survey.farmer_name = survey_update.farmer_name
-    if survey_update.crop_type is not None:
-        db_survey.crop_type = survey_update.crop_type
-    if survey_update.geo_location is not None:
-        db_survey.latitude = survey_update.geo_location.latitude
-        db_survey.longitude = survey_update.geo_location.longitude
-    if survey_update.sync_status is not None:
-        db_survey.sync_status = survey_update.sync_status
-    
-    db_survey.last_updated = datetime.utcnow()
-    db.commit()
-    db.refresh(db_survey)
-    
-    return _db_to_schema(db_survey)
+    """Update a farm survey with conflict resolution using its version, last_updated timestamp or If-Match"""
+    survey = crud.update_survey(db, survey_id, survey_update, last_updated, if_match, version)
+    return json_response(survey, {"ETag": crud.survey_etag_for(survey)})
 
 
 @app.delete("/surveys/{survey_id}", status_code=204)
 def delete_survey(survey_id: int, db: Session = Depends(get_db)):
     """Delete a farm survey (cascades to delete all associated trees)"""
-    survey = db.query(FarmSurvey).filter(FarmSurvey.survey_id == survey_id).first()
-    if not survey:
-        raise HTTPException(status_code=404, detail="Survey not found")
-    db.delete(survey)
-    db.commit()
+    crud.delete_survey(db, survey_id)
     return None
 
 
@@ -131,123 +207,183 @@ def delete_survey(survey_id: int, db: Session = Depends(get_db)):
 @app.post("/surveys/{survey_id}/trees/", response_model=TreeSchema, status_code=201)
 def create_tree(survey_id: int, tree: TreeCreate, db: Session = Depends(get_db)):
     """Create a new tree record for a survey"""
-    # Verify survey exists
-    survey = db.query(FarmSurvey).filter(FarmSurvey.survey_id == survey_id).first()
-    if not survey:
-        raise HTTPException(status_code=404, detail="Survey not found")
-    
-    db_tree = Tree(
-        survey_id=survey_id,
-        species_name=tree.species_name,
-        tree_count=tree.tree_count,
-        height_avg=tree.height_avg,
-        diameter_avg=tree.diameter_avg,
-        age_avg=tree.age_avg,
-        notes=tree.notes,
-        created_at=datetime.utcnow(),
-        updated_at=datetime.utcnow()
-    )
-    db.add(db_tree)
-    db.commit()
-    db.refresh(db_tree)
-    
-    return _db_tree_to_schema(db_tree)
+    return crud.create_tree(db, survey_id, tree)
+
+
+@app.post("/surveys/{survey_id}/trees/bulk", response_model=List[TreeSchema], status_code=201)
+def create_trees(survey_id: int, trees: List[TreeCreate], db: Session = Depends(get_db)):
+    """Create many tree records for a survey in one transaction"""
+    return crud.create_trees(db, survey_id, trees)
+
+
+@app.put("/surveys/{survey_id}/trees/", response_model=List[TreeSchema])
+def replace_trees(
+    survey_id: int,
+    trees: List[TreeCreate],
+    merge_species: bool = Query(False, description="Merge trees of the same species into one record"),
+    db: Session = Depends(get_db)
+):
+    """Replace all tree records of a survey in one transaction"""
+    return crud.replace_trees(db, survey_id, trees, merge_species)
 
 
 @app.get("/surveys/{survey_id}/trees/", response_model=List[TreeSchema])
-def get_trees(survey_id: int, db: Session = Depends(get_db)):
-    """Get all trees for a specific survey"""
-    # Verify survey exists
-    survey = db.query(FarmSurvey).filter(FarmSurvey.survey_id == survey_id).first()
-    if not survey:
-        raise HTTPException(status_code=404, detail="Survey not found")
-    
-    trees = db.query(Tree).filter(Tree.survey_id == survey_id).all()
-    return [_db_tree_to_schema(tree) for tree in trees]
+def get_trees(
+    survey_id: int,
+    limit: Optional[int] = Query(None, ge=1, description="Maximum number of trees to return (default: all)"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor value from the previous page"),
+    db: Session = Depends(get_db)
+):
+    """Get all trees for a specific survey, ordered by ID"""
+    trees, next_cursor = crud.list_trees(db, survey_id, limit, cursor)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor is not None else None
+    return json_response(trees, headers)
 
 
 @app.get("/trees/{tree_id}", response_model=TreeSchema)
-def get_tree(tree_id: int, db: Session = Depends(get_db)):
+def get_tree(
+    tree_id: int,
+    if_none_match: Optional[str] = Header(None, description="ETag of the cached tree; 304 if still current"),
+    db: Session = Depends(get_db)
+):
     """Get a specific tree by ID"""
-    tree = db.query(Tree).filter(Tree.tree_id == tree_id).first()
-    if not tree:
-        raise HTTPException(status_code=404, detail="Tree not found")
-    return _db_tree_to_schema(tree)
+    etag = crud.tree_etag(db, tree_id)
+    if not_modified(if_none_match, etag):
+        return not_modified_response(etag, if_none_match)
+    tree = crud.get_tree(db, tree_id, etag)
+    return json_response(tree, {"ETag": crud.tree_etag_for(tree)})
 
 
 @app.put("/trees/{tree_id}", response_model=TreeSchema)
-def update_tree(tree_id: int, tree_update: TreeUpdate, db: Session = Depends(get_db)):
-    """Update a tree record"""
-    db_tree = db.query(Tree).filter(Tree.tree_id == tree_id).first()
-    if not db_tree:
-        raise HTTPException(status_code=404, detail="Tree not found")
-    
-    # Update fields if provided
-    if tree_update.species_name is not None:
-        db_tree.species_name = tree_update.species_name
-    if tree_update.tree_count is not None:
-        db_tree.tree_count = tree_update.tree_count
-    if tree_update.height_avg is not None:
-        db_tree.height_avg = tree_update.height_avg
-    if tree_update.diameter_avg is not None:
-        db_tree.diameter_avg = tree_update.diameter_avg
-    if tree_update.age_avg is not None:
-        db_tree.age_avg = tree_update.age_avg
-    if tree_update.notes is not None:
-        db_tree.notes = tree_update.notes
-    
-    db_tree.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(db_tree)
-    
-    return _db_tree_to_schema(db_tree)
+def update_tree(
+    tree_id: int,
+    tree_update: TreeUpdate,
+    if_match: Optional[str] = Header(None, description="Only update if the tree still has this ETag (412 otherwise)"),
+    version: Optional[int] = Query(None, description="Only update if the tree still has this version (409 otherwise)"),
+    db: Session = Depends(get_db)
+):
+    """Update a tree record, optionally only if it still has the given version or ETag"""
+    tree = crud.update_tree(db, tree_id, tree_update, if_match, version)
+    return json_response(tree, {"ETag": crud.tree_etag_for(tree)})
 
 
 @app.delete("/trees/{tree_id}", status_code=204)
 def delete_tree(tree_id: int, db: Session = Depends(get_db)):
     """Delete a tree record"""
-    tree = db.query(Tree).filter(Tree.tree_id == tree_id).first()
-    if not tree:
-        raise HTTPException(status_code=404, detail="Tree not found")
-    db.delete(tree)
-    db.commit()
+    crud.delete_tree(db, tree_id)
     return None
 
 
-def _db_to_schema(db_survey: FarmSurvey, include_trees: bool = True) -> FarmSurveySchema:
-    """Helper function to convert database model to Pydantic schema"""
-    from schemas import GeoLocation
-    
-    trees = []
-    if include_trees and db_survey.trees:
-        trees = [_db_tree_to_schema(tree) for tree in db_survey.trees]
-    
-    return FarmSurveySchema(
-        survey_id=db_survey.survey_id,
-        farmer_name=db_survey.farmer_name,
-        crop_type=db_survey.crop_type,
-        geo_location=GeoLocation(
-            latitude=db_survey.latitude,
-            longitude=db_survey.longitude
-        ),
-        sync_status=db_survey.sync_status,
-        last_updated=db_survey.last_updated,
-        trees=trees
+@app.get("/sync/changes", response_model=SyncChanges)
+def get_changes(
+    since: Optional[str] = Query(None, description="Cursor returned by the previous sync; omit for a full sync"),
+    limit: int = Query(1000, ge=1, le=10000, description="Maximum number of surveys, of trees and of deletes to return"),
+    db: Session = Depends(get_db)
+):
+    """Get surveys, trees and deletes changed since the given cursor, a page at a time; repeat
+    with next_cursor while has_more is true"""
+    return json_response(crud.get_changes(db, since, limit))
+
+
+@app.get("/search", response_model=List[SearchHit])
+def search(
+    q: str = Query(..., min_length=1, max_length=200, description="Words to find in farmer names, species and tree notes; each may be the start of a word"),
+    skip: int = Query(0, ge=0, le=1000, description="Number of hits to skip"),
+    limit: int = Query(20, ge=1, le=100, description="Maximum number of hits to return"),
+    db: Session = Depends(get_db)
+):
+    """Full-text search over farmer names, tree species and tree notes, best match first"""
+    return json_response(crud.search(db, q, skip, limit))
+
+
+@app.get("/stats/{dimension}", response_model=List[TreeStatSchema])
+def get_tree_stats(
+    dimension: Literal["species", "crop_type", "region"],
+    limit: int = Query(1000, ge=1, le=10000, description="Maximum number of groups to return"),
+    db: Session = Depends(get_db)
+):
+    """Get tree totals per species, crop type or 1-degree region from the precomputed statistics"""
+    return crud.get_tree_stats(db, dimension, limit)
+
+
+@app.get("/export/surveys", response_class=StreamingResponse)
+def export_surveys(
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$", description="ndjson or csv"),
+    updated_since: Optional[datetime] = Query(None, description="Only surveys with last_updated at or after this time"),
+    updated_until: Optional[datetime] = Query(None, description="Only surveys with last_updated before this time"),
+    crop_type: Optional[str] = Query(None, description="Only surveys of this crop type"),
+    db: Session = Depends(get_db)
+):
+    """Stream a full dump of surveys with their trees as NDJSON (one survey per line) or CSV (one row per tree)"""
+    rows = crud.export_surveys(db, export_format, updated_since, updated_until, crop_type)
+    if export_format == "csv":
+        media_type, filename = "text/csv", "surveys.csv"
+    else:
+        media_type, filename = "application/x-ndjson", "surveys.ndjson"
+    return StreamingResponse(
+        rows, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'}
     )
 
 
-def _db_tree_to_schema(db_tree: Tree) -> TreeSchema:
-    """Helper function to convert Tree database model to Pydantic schema"""
-    return TreeSchema(
-        tree_id=db_tree.tree_id,
-        survey_id=db_tree.survey_id,
-        species_name=db_tree.species_name,
-        tree_count=db_tree.tree_count,
-        height_avg=db_tree.height_avg,
-        diameter_avg=db_tree.diameter_avg,
-        age_avg=db_tree.age_avg,
-        notes=db_tree.notes,
-        created_at=db_tree.created_at,
-        updated_at=db_tree.updated_at
+@app.post("/import/surveys", response_model=ImportReport)
+async def import_surveys(
+    request: Request,
+    import_format: str = Query("csv", alias="format", pattern="^(ndjson|csv)$", description="csv or ndjson"),
+    batch_size: int = Query(1000, ge=1, description="Rows per committed chunk"),
+    start_row: int = Query(0, ge=0, description="Skip rows up to and including this one (resume point)"),
+    job_id: Optional[str] = Query(None, description="Checkpoint progress under this ID so a retry resumes automatically"),
+    db: Session = Depends(get_db)
+):
+    """Bulk import surveys from a CSV or NDJSON request body in committed chunks"""
+    # Spool the upload (to disk once it outgrows memory) and parse it as a stream
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as spool:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        stream = io.TextIOWrapper(spool, encoding="utf-8-sig", newline="")
+        return await run_in_threadpool(
+            importer.import_surveys, db, stream, import_format, batch_size, start_row, job_id
+        )
+
+
+@app.get("/db/pool", response_model=PoolStatus)
+def get_pool_status():
+    """Get connection pool occupancy and checkout wait statistics for sizing the pool"""
+    return pool_stats()
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Get per-route request, response size and database metrics in the Prometheus text format"""
+    content, media_type = render_metrics()
+    return Response(content=content, media_type=media_type)
+
+
+@app.get("/cache/stats", response_model=CacheStatus)
+def get_cache_stats():
+    """Get read cache hit/miss/eviction counters"""
+    return cache.stats()
+
+
+@app.get("/events", response_class=StreamingResponse)
+async def stream_events():
+    """Stream survey and tree changes as Server-Sent Events, one `data:` line of JSON per change:
+    entity ("survey" or "tree"), op ("created", "updated" or "deleted"), id, survey_id and last_updated"""
+    try:
+        subscriber = events.hub.subscribe()
+    except OverflowError:
+        raise HTTPException(status_code=503, detail="Too many event subscribers; retry later",
+                            headers={"Retry-After": "30"})
+    events.broker.start()
+    return StreamingResponse(
+        events.stream(subscriber),
+        media_type="text/event-stream",
+        # No caching, and no buffering by reverse proxies such as nginx
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
+
+@app.get("/events/stats", response_model=EventsStatus)
+def get_events_stats():
+    """Get this worker's event stream subscriber and delivery counters"""
+    return events.stats()
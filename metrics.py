@@ -0,0 +1,140 @@
+"""
+Prometheus metrics for the API.
+
+MetricsMiddleware labels every request with its method and route template (e.g.
+/surveys/{survey_id}, so IDs don't multiply the series) and records:
+- http_requests_total by status, http_requests_in_flight, and histograms of
+  http_request_duration_seconds and http_response_size_bytes (bytes on the wire,
+  after compression)
+- db_queries_per_request, db_seconds_per_request and db_pool_wait_seconds_per_request,
+  collected from the engine events in database.py. An N+1 regression, such as a lazy
+  survey.trees load per listed survey, shows up as a jump in queries per request.
+
+GET /metrics serves them in the Prometheus text format, together with the connection
+pool counters from database.pool_stats(). Each replica is scraped separately. Under a
+multi-worker server, point PROMETHEUS_MULTIPROC_DIR at an empty directory shared by
+the workers so /metrics reports all of them (the pool counters are then left out, as
+they only describe the worker that answers).
+"""
+import os
+import time
+from typing import Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from database import pool_stats, track_queries
+
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+UNMATCHED_ROUTE = "<unmatched>"
+
+REQUESTS = Counter(
+    "http_requests", "Requests handled", ["method", "route", "status"]
+)
+IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requests being handled", ["method", "route"], multiprocess_mode="livesum"
+)
+LATENCY = Histogram(
+    "http_request_duration_seconds", "Time from receiving a request to sending the last body byte",
+    ["method", "route"]
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Response body size as sent", ["method", "route"],
+    buckets=(100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+)
+DB_QUERIES = Histogram(
+    "db_queries_per_request", "SQL statements executed per request", ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+)
+DB_SECONDS = Histogram(
+    "db_seconds_per_request", "Time spent executing SQL statements per request", ["method", "route"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+POOL_WAIT = Histogram(
+    "db_pool_wait_seconds_per_request", "Time spent waiting for a pooled connection per request",
+    ["method", "route"], buckets=(0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+)
+
+
+class PoolCollector:
+    """Exposes database.pool_stats() at scrape time"""
+
+    def collect(self):
+        stats = pool_stats()
+        yield CounterMetricFamily("db_pool_checkouts", "Connections checked out of the pool", value=stats["checkouts"])
+        yield CounterMetricFamily("db_pool_timeouts", "Checkouts that timed out waiting", value=stats["timeouts"])
+        yield CounterMetricFamily(
+            "db_pool_wait_seconds", "Time spent waiting for pooled connections", value=stats["wait_seconds_total"]
+        )
+        for key, description in (("size", "Pool size"), ("checked_out", "Connections in use"),
+                                 ("overflow", "Connections opened beyond the pool size")):
+            if key in stats:
+                yield GaugeMetricFamily(f"db_pool_{key}", description, value=stats[key])
+
+
+if not MULTIPROCESS:
+    REGISTRY.register(PoolCollector())
+
+
+def render() -> Tuple[bytes, str]:
+    """The current metrics in the Prometheus text format, and its content type"""
+    registry = REGISTRY
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def route_template(scope: Scope) -> str:
+    """Path template of the route that will handle the request, matched the way the router does"""
+    partial = None
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """Record request, response and database metrics per route"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        labels = (scope["method"], route_template(scope))
+        status = 500
+        size = 0
+
+        async def send_wrapper(message: Message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        in_flight = IN_FLIGHT.labels(*labels)
+        in_flight.inc()
+        start = time.perf_counter()
+        with track_queries() as queries:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                LATENCY.labels(*labels).observe(time.perf_counter() - start)
+                in_flight.dec()
+                REQUESTS.labels(*labels, str(status)).inc()
+                RESPONSE_SIZE.labels(*labels).observe(size)
+                DB_QUERIES.labels(*labels).observe(queries.queries)
+                DB_SECONDS.labels(*labels).observe(queries.seconds)
+                POOL_WAIT.labels(*labels).observe(queries.pool_wait_seconds)
@@ -0,0 +1,219 @@
+"""
+Versioned schema migrations.
+
+The app doesn't create or alter tables when it starts. Schema changes are applied
+explicitly, once per deploy, before workers start serving:
+
+    python migrations.py            # upgrade DATABASE_URL to the latest version
+    python migrations.py --check    # exit 1 if it needs upgrading
+
+schema_version records each step applied. An empty database gets the current schema
+straight from the models. A database at an older version, or one created by
+`create_all` before this module existed (it has tables but no schema_version), runs
+the MIGRATIONS steps it is missing. Steps check what exists before changing anything,
+so they can build on the current model definitions and an interrupted upgrade can
+simply be rerun. On PostgreSQL an advisory lock keeps replicas that start together
+from migrating at the same time.
+
+At startup main.py only calls check_schema(), which reads schema_version, and refuses
+to serve a database that is behind.
+"""
+import argparse
+import sys
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import Column, DateTime, Integer, String, Table, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from database import Base
+from geo import cell_for
+from models import FarmSurvey
+from search import create_search_index, rebuild_search_index
+from stats import rebuild
+
+SCHEMA_VERSION = Table(
+    "schema_version", Base.metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, default=datetime.utcnow, nullable=False),
+)
+
+# Arbitrary key for pg_advisory_lock, shared by every process migrating this schema
+MIGRATION_LOCK_KEY = 72_310_451
+BACKFILL_BATCH_SIZE = 10000
+
+
+def _has_column(conn: Connection, table: str, column: str) -> bool:
+    return column in {info["name"] for info in inspect(conn).get_columns(table)}
+
+
+def _add_column(conn: Connection, table: str, column: str, ddl: str) -> bool:
+    """ALTER TABLE ... ADD COLUMN unless the column exists; returns whether it was added"""
+    if _has_column(conn, table, column):
+        return False
+    conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+    return True
+
+
+def _create_table(conn: Connection, table: str) -> bool:
+    """Create a model's table (with its indexes) unless it exists; returns whether it was created"""
+    if inspect(conn).has_table(table):
+        return False
+    Base.metadata.tables[table].create(conn)
+    return True
+
+
+def _create_indexes(conn: Connection, table: str, *columns: str):
+    """Create the model's indexes on the given columns of a table, skipping existing ones"""
+    existing = {info["name"] for info in inspect(conn).get_indexes(table)}
+    for index in Base.metadata.tables[table].indexes:
+        if index.name not in existing and {column.name for column in index.columns} <= set(columns):
+            index.create(conn)
+
+
+def _sync_feed(conn: Connection):
+    _create_table(conn, "deleted_records")
+    _create_indexes(conn, "farm_surveys", "last_updated")
+    _create_indexes(conn, "trees", "updated_at")
+
+
+def _import_jobs(conn: Connection):
+    _create_table(conn, "import_jobs")
+
+
+def _geo_cell(conn: Connection):
+    if _add_column(conn, "farm_surveys", "geo_cell", "INTEGER NOT NULL DEFAULT 0"):
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                select(FarmSurvey.survey_id, FarmSurvey.latitude, FarmSurvey.longitude)
+                .where(FarmSurvey.survey_id > last_id)
+                .order_by(FarmSurvey.survey_id)
+                .limit(BACKFILL_BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            conn.execute(
+                text("UPDATE farm_surveys SET geo_cell = :cell WHERE survey_id = :survey_id"),
+                [{"cell": cell_for(latitude, longitude), "survey_id": survey_id}
+                 for survey_id, latitude, longitude in rows]
+            )
+            last_id = rows[-1].survey_id
+    _create_indexes(conn, "farm_surveys", "geo_cell")
+
+
+def _tree_stats(conn: Connection):
+    if _create_table(conn, "tree_stats"):
+        with Session(bind=conn) as db:
+            rebuild(db)
+
+
+def _version_columns(conn: Connection):
+    _add_column(conn, "farm_surveys", "version", "INTEGER NOT NULL DEFAULT 1")
+    _add_column(conn, "trees", "version", "INTEGER NOT NULL DEFAULT 1")
+
+
+def _search_index(conn: Connection):
+    create_search_index(conn)
+    rebuild_search_index(conn)
+
+
+def _list_filter_indexes(conn: Connection):
+    _create_indexes(conn, "farm_surveys", "crop_type", "sync_status", "last_updated")
+
+
+# (version, description, step) in the order they were introduced; append new steps
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "deleted_records tombstones and change-feed indexes", _sync_feed),
+    (2, "import_jobs checkpoints", _import_jobs),
+    (3, "farm_surveys.geo_cell spatial grid cell", _geo_cell),
+    (4, "tree_stats running totals", _tree_stats),
+    (5, "version columns for compare-and-swap updates", _version_columns),
+    (6, "full-text search index over farmer names, species and notes", _search_index),
+    (7, "composite indexes for filtered survey lists", _list_filter_indexes),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn: Connection) -> Optional[int]:
+    """Schema version of the database: None if it has no schema_version table"""
+    if not inspect(conn).has_table(SCHEMA_VERSION.name):
+        return None
+    return conn.scalar(select(func.max(SCHEMA_VERSION.c.version))) or 0
+
+
+def upgrade(engine: Engine) -> Tuple[int, int]:
+    """Bring the database up to LATEST_VERSION; returns the versions before and after"""
+    with engine.connect() as conn:
+        locked = conn.dialect.name == "postgresql"
+        if locked:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        try:
+            version = current_version(conn)
+            if version is None and not inspect(conn).has_table(FarmSurvey.__tablename__):
+                # Empty database: the models describe the latest schema
+                Base.metadata.create_all(conn)
+                _stamp(conn, LATEST_VERSION, "initial schema")
+                conn.commit()
+                return 0, LATEST_VERSION
+            if version is None:
+                SCHEMA_VERSION.create(conn)
+                version = 0
+            start = version
+            for step_version, description, step in MIGRATIONS:
+                if step_version > version:
+                    step(conn)
+                    _stamp(conn, step_version, description)
+                    conn.commit()
+                    version = step_version
+            return start, version
+        finally:
+            if locked:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+                conn.commit()
+
+
+def check_schema(engine: Engine) -> int:
+    """Raise RuntimeError if the database is behind LATEST_VERSION (newer is fine: steps only
+    add to the schema, so replicas still on the previous release keep working). Returns the version."""
+    with engine.connect() as conn:
+        version = current_version(conn)
+    if version is None or version < LATEST_VERSION:
+        raise RuntimeError(
+            f"Database schema is at version {version or 0} but this release needs {LATEST_VERSION}; "
+            f"run `python migrations.py` (or start with `python serve.py --migrate`)"
+        )
+    return version
+
+
+def _stamp(conn: Connection, version: int, description: str):
+    conn.execute(SCHEMA_VERSION.insert().values(version=version, description=description))
+
+
+def main(argv=None) -> int:
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Upgrade the DATABASE_URL schema to the latest version")
+    parser.add_argument("--check", action="store_true", help="Only report whether an upgrade is needed")
+    args = parser.parse_args(argv)
+
+    from database import engine
+
+    if args.check:
+        try:
+            print(f"Schema is up to date at version {check_schema(engine)}")
+        except RuntimeError as error:
+            print(error)
+            return 1
+        return 0
+    before, after = upgrade(engine)
+    if before == after:
+        print(f"Schema is up to date at version {after}")
+    else:
+        print(f"Upgraded schema from version {before} to {after}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,14 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Index, Text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
+from geo import cell_for
+
+
+def _default_geo_cell(context):
+    """Column default computing the grid cell from the row's latitude/longitude (works for bulk inserts too)"""
+    params = context.get_current_parameters()
+    return cell_for(params["latitude"], params["longitude"])
 
 
 class FarmSurvey(Base):
@@ -12,12 +19,23 @@ class FarmSurvey(Base):
     crop_type = Column(String, nullable=False)
     latitude = Column(Float, nullable=False)
     longitude = Column(Float, nullable=False)
+    geo_cell = Column(Integer, nullable=False, index=True, default=_default_geo_cell,
+                      comment="Spatial grid cell of (latitude, longitude), see geo.py")
     sync_status = Column(Boolean, default=False, nullable=False)
-    last_updated = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    last_updated = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False, index=True)
+    version = Column(Integer, nullable=False, server_default="1",
+                     comment="Incremented by every update; updates compare-and-swap on it")
     
     # Relationship to trees
     trees = relationship("Tree", back_populates="survey", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Filtered survey lists: seek the filter value, read the rows already in last_updated order
+        Index("ix_farm_surveys_crop_type_last_updated", "crop_type", "last_updated"),
+        Index("ix_farm_surveys_sync_status_last_updated", "sync_status", "last_updated"),
+    )
+    __mapper_args__ = {"version_id_col": version}
+
 
 class Tree(Base):
     __tablename__ = "trees"
@@ -31,9 +49,43 @@ class Tree(Base):
     age_avg = Column(Integer, nullable=True, comment="Average age in years")
     notes = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False, index=True)
+    version = Column(Integer, nullable=False, server_default="1",
+                     comment="Incremented by every update; updates compare-and-swap on it")
     
     # Relationship to survey
     survey = relationship("FarmSurvey", back_populates="trees")
 
+    __mapper_args__ = {"version_id_col": version}
+
+
+class DeletedRecord(Base):
+    """Tombstone left behind by a delete so sync clients can drop their cached copy"""
+    __tablename__ = "deleted_records"
+
+    id = Column(Integer, primary_key=True, index=True)
+    entity_type = Column(String, nullable=False, comment="'survey' or 'tree'")
+    entity_id = Column(Integer, nullable=False)
+    survey_id = Column(Integer, nullable=False, comment="Survey the deleted record belonged to")
+    deleted_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
+class ImportJob(Base):
+    """Checkpoint of a resumable bulk import, committed together with each imported chunk"""
+    __tablename__ = "import_jobs"
+
+    job_id = Column(String, primary_key=True)
+    last_committed_row = Column(Integer, default=0, nullable=False)
+    surveys_imported = Column(Integer, default=0, nullable=False)
+    trees_imported = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class TreeStat(Base):
+    """Running tree totals per species, crop type and region, maintained by stats.py"""
+    __tablename__ = "tree_stats"
 
+    dimension = Column(String, primary_key=True, comment="'species', 'crop_type' or 'region'")
+    key = Column(String, primary_key=True, comment="Species name, crop type or region name")
+    tree_count = Column(Integer, default=0, nullable=False, comment="Sum of tree_count")
+    record_count = Column(Integer, default=0, nullable=False, comment="Number of tree records")
@@ -0,0 +1,136 @@
+"""
+Opt-in SQL profiling for finding slow and fanned-out queries.
+
+With SQL_PROFILE=true, SQLProfilerMiddleware captures every statement a request runs,
+with its parameters and timing, through the engine events in database.py, and:
+- logs each statement slower than SQL_SLOW_QUERY_MS to the "farm_survey.sql" logger,
+  which writes to the file SQL_SLOW_QUERY_LOG names (stderr if unset)
+- logs a warning when one parameterized statement runs SQL_N_PLUS_ONE_THRESHOLD or more
+  times in a request. That is the mark of an N+1 query, such as a lazy FarmSurvey.trees
+  or Tree.survey load per row.
+- with SQL_SERVER_TIMING=true, adds a Server-Timing header (query count and database
+  time, plus total handler time), which browser dev tools show next to each request
+
+Profiling stays off by default, since holding every statement costs memory on bulk
+requests. Tests don't need it: capture_queries() and assert_max_queries() capture the
+statements run on an engine, e.g. `with assert_max_queries(engine, 3): client.get(...)`.
+"""
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from database import CapturedStatement, track_queries
+
+SQL_PROFILE = os.getenv("SQL_PROFILE", "false").lower() in ("1", "true", "yes")
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "100"))
+SQL_SLOW_QUERY_LOG = os.getenv("SQL_SLOW_QUERY_LOG")
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "5"))
+SQL_SERVER_TIMING = os.getenv("SQL_SERVER_TIMING", "false").lower() in ("1", "true", "yes")
+
+logger = logging.getLogger("farm_survey.sql")
+if SQL_SLOW_QUERY_LOG:
+    _handler = logging.FileHandler(SQL_SLOW_QUERY_LOG)
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+MAX_LOGGED_PARAMETERS = 500
+
+
+def repeated_statements(statements: List[CapturedStatement], threshold: int) -> List[Tuple[str, int]]:
+    """Statements run at least `threshold` times (each with its count, most repeated first),
+    ignoring executemany batches, which are one round trip however many rows they carry"""
+    counts = Counter(captured.statement for captured in statements if not captured.executemany)
+    return [(statement, count) for statement, count in counts.most_common() if count >= threshold]
+
+
+class SQLProfilerMiddleware:
+    """Capture each request's statements for the slow-query log, N+1 warnings and Server-Timing"""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        slow_query_ms: float = SQL_SLOW_QUERY_MS,
+        n_plus_one_threshold: int = SQL_N_PLUS_ONE_THRESHOLD,
+        server_timing: bool = SQL_SERVER_TIMING
+    ):
+        self.app = app
+        self.slow_query_seconds = slow_query_ms / 1000
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.server_timing = server_timing
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        with track_queries(capture=True) as queries:
+
+            async def send_wrapper(message: Message):
+                if message["type"] == "http.response.start" and self.server_timing:
+                    # Statements a streaming body runs after this point aren't included
+                    headers = MutableHeaders(raw=message["headers"])
+                    headers.append("Server-Timing", (
+                        f'db;dur={queries.seconds * 1000:.1f};desc="{queries.queries} queries", '
+                        f"app;dur={(time.perf_counter() - start) * 1000:.1f}"
+                    ))
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                self._report(f"{scope['method']} {scope['path']}", queries.statements)
+
+    def _report(self, request: str, statements: List[CapturedStatement]):
+        for captured in statements:
+            if captured.seconds >= self.slow_query_seconds:
+                parameters = repr(captured.parameters)[:MAX_LOGGED_PARAMETERS]
+                logger.warning("slow query %.1f ms in %s: %s %s", captured.seconds * 1000, request,
+                               captured.statement, parameters)
+        for statement, count in repeated_statements(statements, self.n_plus_one_threshold):
+            logger.warning("possible N+1 in %s: statement ran %d times: %s", request, count, statement)
+
+
+@contextmanager
+def capture_queries(engine: Engine) -> Iterator[List[CapturedStatement]]:
+    """Capture the statements run on `engine` inside the block, from any thread or task"""
+    statements = []
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._capture_started = time.perf_counter()
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - getattr(context, "_capture_started", time.perf_counter())
+        statements.append(CapturedStatement(statement, parameters, elapsed, executemany))
+
+    event.listen(engine, "before_cursor_execute", before)
+    event.listen(engine, "after_cursor_execute", after)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before)
+        event.remove(engine, "after_cursor_execute", after)
+
+
+@contextmanager
+def assert_max_queries(engine: Engine, limit: int) -> Iterator[List[CapturedStatement]]:
+    """Fail with the statements run (and any repeated ones) if the block runs more than `limit`
+    statements on `engine`"""
+    with capture_queries(engine) as statements:
+        yield statements
+    if len(statements) > limit:
+        repeated = "".join(
+            f"\n  repeated {count}x: {statement}" for statement, count in repeated_statements(statements, 2)
+        )
+        listing = "".join(f"\n  {captured.statement}" for captured in statements)
+        raise AssertionError(f"{len(statements)} queries run, expected at most {limit}{repeated}\nQueries:{listing}")
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Literal
 
 
 class GeoLocation(BaseModel):
@@ -69,6 +69,7 @@ class Tree(TreeBase):
     survey_id: int = Field(..., description="Foreign key to the survey")
     created_at: datetime = Field(..., description="Timestamp when tree record was created")
     updated_at: datetime = Field(..., description="Timestamp when tree record was last updated")
+    version: int = Field(1, description="Row version, incremented by every update; pass it as `version` on PUT")
 
     class Config:
         from_attributes = True
@@ -83,7 +84,8 @@ class Tree(TreeBase):
                 "age_avg": 15,
                 "notes": "Mature trees in good condition",
                 "created_at": "2024-01-15T10:30:00",
-                "updated_at": "2024-01-15T10:30:00"
+                "updated_at": "2024-01-15T10:30:00",
+                "version": 1
             }
         }
 
@@ -92,6 +94,7 @@ class FarmSurvey(FarmSurveyBase):
     """Schema for FarmSurvey response"""
     survey_id: int = Field(..., description="Unique identifier for the survey")
     last_updated: datetime = Field(..., description="Timestamp of last update for conflict resolution")
+    version: int = Field(1, description="Row version, incremented by every update; pass it as `version` on PUT")
     trees: Optional[List[Tree]] = Field(default=[], description="List of trees associated with this survey")
 
     class Config:
@@ -107,7 +110,139 @@ class FarmSurvey(FarmSurveyBase):
                 },
                 "sync_status": False,
                 "last_updated": "2024-01-15T10:30:00",
+                "version": 1,
                 "trees": []
             }
         }
 
+
+
+class SurveyBatchItem(FarmSurveyBase):
+    """Schema for one survey in a batch upsert, with its nested trees"""
+    survey_id: Optional[int] = Field(None, description="Existing survey to update; omit to create a new survey")
+    last_updated: Optional[datetime] = Field(None, description="Last updated timestamp for conflict resolution (updates only)")
+    version: Optional[int] = Field(None, description="Only update if the survey still has this version (updates only)")
+    trees: Optional[List[TreeCreate]] = Field(
+        None, description="Trees for this survey; on update, replaces the existing trees when provided"
+    )
+
+
+class SurveyBatchRequest(BaseModel):
+    """Schema for a batch upsert of surveys"""
+    surveys: List[SurveyBatchItem] = Field(..., description="Surveys to create or update")
+
+
+class SurveyBatchResult(BaseModel):
+    """Outcome of a single item in a batch upsert"""
+    index: int = Field(..., description="Position of the item in the request")
+    survey_id: Optional[int] = Field(None, description="ID of the created or updated survey")
+    status: Literal["created", "updated", "conflict"] = Field(..., description="Outcome for this item")
+    detail: Optional[str] = Field(None, description="Reason for a conflict")
+
+
+class SurveyBatchResponse(BaseModel):
+    """Schema for the batch upsert response"""
+    results: List[SurveyBatchResult] = Field(..., description="One result per submitted survey, in request order")
+
+
+class Tombstone(BaseModel):
+    """A deleted survey or tree reported by the change feed"""
+    entity_type: Literal["survey", "tree"] = Field(..., description="Kind of record that was deleted")
+    entity_id: int = Field(..., description="ID of the deleted survey or tree")
+    survey_id: int = Field(..., description="Survey the deleted record belonged to")
+    deleted_at: datetime = Field(..., description="Timestamp of the delete")
+
+    class Config:
+        from_attributes = True
+
+
+class SyncChanges(BaseModel):
+    """Schema for the delta sync change feed"""
+    surveys: List[FarmSurvey] = Field(default=[], description="Surveys changed since the cursor (without nested trees)")
+    trees: List[Tree] = Field(default=[], description="Trees changed since the cursor")
+    deleted: List[Tombstone] = Field(
+        default=[], description="Deletes since the cursor; deleting a survey also removes its trees"
+    )
+    next_cursor: str = Field(..., description="Opaque cursor to pass as `since` on the next sync")
+    has_more: bool = Field(False, description="More changes are waiting; call again with next_cursor right away")
+
+
+class PoolStatus(BaseModel):
+    """Connection pool occupancy and checkout wait statistics"""
+    pool_class: str = Field(..., description="SQLAlchemy pool implementation in use")
+    checkouts: int = Field(..., description="Connections handed out since startup")
+    timeouts: int = Field(..., description="Checkouts that gave up after DB_POOL_TIMEOUT")
+    wait_seconds_total: float = Field(..., description="Total time spent waiting for a connection")
+    wait_seconds_max: float = Field(..., description="Longest single wait for a connection")
+    wait_seconds_avg: float = Field(..., description="Average wait per checkout")
+    size: Optional[int] = Field(None, description="Configured pool size (DB_POOL_SIZE)")
+    checked_out: Optional[int] = Field(None, description="Connections currently in use")
+    checked_in: Optional[int] = Field(None, description="Idle connections held by the pool")
+    overflow: Optional[int] = Field(None, description="Current overflow count (negative while below pool size)")
+    max_overflow: Optional[int] = Field(None, description="Configured overflow limit (DB_MAX_OVERFLOW)")
+
+
+class SurveyImportRecord(FarmSurveyCreate):
+    """Schema for one survey read from an import file, with its trees"""
+    trees: List[TreeCreate] = Field(default=[], description="Trees recorded for this survey")
+
+
+class ImportRowError(BaseModel):
+    """Validation failure for one record of an import file"""
+    row: int = Field(..., description="Data row (CSV, excluding the header) or line (NDJSON) where the record starts")
+    errors: List[str] = Field(..., description="Validation messages for the record")
+
+
+class ImportReport(BaseModel):
+    """Schema for the result of a bulk import"""
+    job_id: Optional[str] = Field(None, description="Import job whose checkpoint was updated")
+    rows_processed: int = Field(..., description="Rows read from the file in this run (after skipping resumed rows)")
+    surveys_imported: int = Field(..., description="Surveys written in this run")
+    trees_imported: int = Field(..., description="Trees written in this run")
+    error_count: int = Field(..., description="Records rejected by validation")
+    errors: List[ImportRowError] = Field(default=[], description="Rejected records (capped at the first 1000)")
+    last_committed_row: int = Field(..., description="Last row covered by a commit; pass as start_row to resume")
+
+
+class TreeStat(BaseModel):
+    """Schema for the tree totals of one species, crop type or region"""
+    key: str = Field(..., description="Species name, crop type, or region (latitude,longitude of its south-west corner)")
+    tree_count: int = Field(..., description="Total number of trees")
+    record_count: int = Field(..., description="Number of tree records")
+
+    class Config:
+        from_attributes = True
+
+
+class SearchHit(BaseModel):
+    """Schema for one ranked search result: a survey whose farmer name matched, or a tree whose species or notes matched"""
+    kind: Literal["survey", "tree"] = Field(..., description="What matched")
+    survey_id: int = Field(..., description="Matching survey, or the survey of the matching tree")
+    farmer_name: str = Field(..., description="Farmer of the survey")
+    crop_type: str = Field(..., description="Crop type of the survey")
+    tree_id: Optional[int] = Field(None, description="Matching tree (tree hits only)")
+    species_name: Optional[str] = Field(None, description="Species of the matching tree (tree hits only)")
+    snippet: Optional[str] = Field(None, description="Excerpt of the tree's notes around the match (tree hits only)")
+    score: float = Field(..., description="Relevance; higher is better")
+
+
+class CacheStatus(BaseModel):
+    """Read cache configuration and hit/miss/eviction counters"""
+    backend: str = Field(..., description="memory, redis or disabled")
+    hits: int = Field(..., description="Lookups answered from the cache")
+    misses: int = Field(..., description="Lookups that went to the database")
+    evictions: int = Field(..., description="Entries dropped to stay within CACHE_MAX_ENTRIES")
+    expirations: int = Field(..., description="Entries dropped after CACHE_TTL_SECONDS")
+    invalidations: int = Field(..., description="Entries dropped by writes")
+    size: Optional[int] = Field(None, description="Entries currently held (unknown for Redis)")
+    max_entries: Optional[int] = Field(None, description="Configured capacity (CACHE_MAX_ENTRIES)")
+    ttl_seconds: float = Field(..., description="Configured entry lifetime (CACHE_TTL_SECONDS)")
+
+
+class EventsStatus(BaseModel):
+    """Live event stream subscribers and deliveries of the worker that answered"""
+    backend: str = Field(..., description="local or redis")
+    subscribers: int = Field(..., description="Open GET /events streams")
+    max_subscribers: int = Field(..., description="Configured limit per worker (EVENTS_MAX_SUBSCRIBERS)")
+    batches_delivered: int = Field(..., description="Batches of events fanned out to the subscribers")
+    subscribers_dropped: int = Field(..., description="Streams closed for falling EVENTS_QUEUE_SIZE batches behind")
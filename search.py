@@ -0,0 +1,212 @@
+"""
+Full-text search over farmer names, tree species and tree notes.
+
+On SQLite the text is indexed by two FTS5 tables, survey_search (farmer_name) and
+tree_search (species_name, notes). They are external-content tables that keep only
+the index, and triggers on farm_surveys and trees update them in the same
+transaction as every insert, update and delete, bulk writes and imports included. On
+PostgreSQL, generated tsvector columns with GIN indexes do the same job.
+
+Every word of the query must match, as a word or the start of one (so "ash pat"
+finds "Asha Patel" and "blig" finds "blight"). Matches are ranked with bm25 (SQLite)
+or ts_rank (PostgreSQL) among the newest RANK_WINDOW matches. Each index returns only
+its best skip + limit hits, which are merged, so a page costs index lookups rather
+than a scan of the notes.
+
+The index is created with the tables (create_all) or by migration step 6 for existing
+databases, which also fills it.
+"""
+import re
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from fastapi import HTTPException
+from sqlalchemy import event, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from database import Base
+
+MAX_QUERY_TERMS = 10
+SNIPPET_WORDS = 16
+
+_TOKENIZE = "tokenize='unicode61 remove_diacritics 2', prefix='2 3'"
+SQLITE_INDEX_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS survey_search USING fts5("
+    f"farmer_name, content='farm_surveys', content_rowid='survey_id', {_TOKENIZE})",
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS tree_search USING fts5("
+    f"species_name, notes, content='trees', content_rowid='tree_id', {_TOKENIZE})",
+    """CREATE TRIGGER IF NOT EXISTS farm_surveys_search_insert AFTER INSERT ON farm_surveys BEGIN
+        INSERT INTO survey_search (rowid, farmer_name) VALUES (new.survey_id, new.farmer_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS farm_surveys_search_delete AFTER DELETE ON farm_surveys BEGIN
+        INSERT INTO survey_search (survey_search, rowid, farmer_name) VALUES ('delete', old.survey_id, old.farmer_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS farm_surveys_search_update AFTER UPDATE OF farmer_name ON farm_surveys BEGIN
+        INSERT INTO survey_search (survey_search, rowid, farmer_name) VALUES ('delete', old.survey_id, old.farmer_name);
+        INSERT INTO survey_search (rowid, farmer_name) VALUES (new.survey_id, new.farmer_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trees_search_insert AFTER INSERT ON trees BEGIN
+        INSERT INTO tree_search (rowid, species_name, notes) VALUES (new.tree_id, new.species_name, new.notes);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trees_search_delete AFTER DELETE ON trees BEGIN
+        INSERT INTO tree_search (tree_search, rowid, species_name, notes)
+        VALUES ('delete', old.tree_id, old.species_name, old.notes);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trees_search_update AFTER UPDATE OF species_name, notes ON trees BEGIN
+        INSERT INTO tree_search (tree_search, rowid, species_name, notes)
+        VALUES ('delete', old.tree_id, old.species_name, old.notes);
+        INSERT INTO tree_search (rowid, species_name, notes) VALUES (new.tree_id, new.species_name, new.notes);
+    END""",
+]
+SQLITE_INSERT_TRIGGERS = ["farm_surveys_search_insert", "trees_search_insert"]
+
+POSTGRES_INDEX_DDL = [
+    "ALTER TABLE farm_surveys ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('simple', farmer_name)) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_farm_surveys_search_vector ON farm_surveys USING gin (search_vector)",
+    "ALTER TABLE trees ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('simple', species_name), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(notes, '')), 'B')) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_trees_search_vector ON trees USING gin (search_vector)",
+]
+
+# Only the newest RANK_WINDOW matches of an index are ranked. Scoring costs a few
+# microseconds per match, so a word found in half a million notes would otherwise take
+# a second; this keeps every query's cost bounded however common its words are.
+RANK_WINDOW = 5000
+
+SQLITE_SURVEY_HITS = text("""
+    SELECT s.survey_id, s.farmer_name, s.crop_type, hits.score
+    FROM (
+        SELECT rowid, -rank AS score FROM survey_search
+        WHERE survey_search MATCH :query AND rowid >= coalesce((
+            SELECT rowid FROM survey_search WHERE survey_search MATCH :query
+            ORDER BY rowid DESC LIMIT 1 OFFSET :window - 1
+        ), 0)
+        ORDER BY rank LIMIT :limit
+    ) AS hits
+    JOIN farm_surveys s ON s.survey_id = hits.rowid
+""")
+SQLITE_TREE_HITS = text(f"""
+    SELECT t.tree_id, t.survey_id, t.species_name, hits.snippet, s.farmer_name, s.crop_type, hits.score
+    FROM (
+        SELECT rowid, -rank AS score, snippet(tree_search, 1, '', '', '…', {SNIPPET_WORDS}) AS snippet
+        FROM tree_search
+        WHERE tree_search MATCH :query AND rowid >= coalesce((
+            SELECT rowid FROM tree_search WHERE tree_search MATCH :query
+            ORDER BY rowid DESC LIMIT 1 OFFSET :window - 1
+        ), 0)
+        ORDER BY rank LIMIT :limit
+    ) AS hits
+    JOIN trees t ON t.tree_id = hits.rowid
+    JOIN farm_surveys s ON s.survey_id = t.survey_id
+""")
+POSTGRES_SURVEY_HITS = text("""
+    SELECT survey_id, farmer_name, crop_type, ts_rank(search_vector, query) AS score
+    FROM (
+        SELECT s.survey_id, s.farmer_name, s.crop_type, s.search_vector, query
+        FROM farm_surveys s, to_tsquery('simple', :query) AS query
+        WHERE s.search_vector @@ query
+        ORDER BY s.survey_id DESC LIMIT :window
+    ) AS matches
+    ORDER BY score DESC LIMIT :limit
+""")
+POSTGRES_TREE_HITS = text(f"""
+    SELECT t.tree_id, t.survey_id, t.species_name,
+           ts_headline('simple', coalesce(t.notes, ''), hits.query,
+                       'StartSel="", StopSel="", MaxWords={SNIPPET_WORDS}, MinWords=5') AS snippet,
+           s.farmer_name, s.crop_type, hits.score
+    FROM (
+        SELECT tree_id, query, ts_rank(search_vector, query) AS score
+        FROM (
+            SELECT t.tree_id, t.search_vector, query
+            FROM trees t, to_tsquery('simple', :query) AS query
+            WHERE t.search_vector @@ query
+            ORDER BY t.tree_id DESC LIMIT :window
+        ) AS matches
+        ORDER BY score DESC LIMIT :limit
+    ) AS hits
+    JOIN trees t ON t.tree_id = hits.tree_id
+    JOIN farm_surveys s ON s.survey_id = t.survey_id
+""")
+
+
+def create_search_index(conn: Connection):
+    """Create the search index and what keeps it in sync, unless they exist"""
+    for statement in POSTGRES_INDEX_DDL if conn.dialect.name == "postgresql" else SQLITE_INDEX_DDL:
+        conn.exec_driver_sql(statement)
+
+
+def rebuild_search_index(conn: Connection):
+    """Index every existing survey and tree (generated columns on PostgreSQL need nothing)"""
+    if conn.dialect.name != "postgresql":
+        conn.exec_driver_sql("INSERT INTO survey_search (survey_search) VALUES ('rebuild')")
+        conn.exec_driver_sql("INSERT INTO tree_search (tree_search) VALUES ('rebuild')")
+
+
+@contextmanager
+def deferred_indexing(db: Session) -> Iterator[None]:
+    """Index rows inserted inside the block with one rebuild at the end instead of row by row,
+    for bulk loads on SQLite (about twice as fast). Updates and deletes are indexed as usual."""
+    if db.get_bind().dialect.name == "postgresql":
+        yield
+        return
+    for trigger in SQLITE_INSERT_TRIGGERS:
+        db.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+    db.commit()
+    try:
+        yield
+    finally:
+        db.rollback()
+        create_search_index(db.connection())
+        rebuild_search_index(db.connection())
+        db.commit()
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _after_create(target, connection: Connection, **kw):
+    create_search_index(connection)
+
+
+@event.listens_for(Base.metadata, "before_drop")
+def _before_drop(target, connection: Connection, **kw):
+    # The PostgreSQL columns and SQLite triggers go with their tables
+    if connection.dialect.name != "postgresql":
+        connection.exec_driver_sql("DROP TABLE IF EXISTS survey_search")
+        connection.exec_driver_sql("DROP TABLE IF EXISTS tree_search")
+
+
+def query_terms(q: str) -> List[str]:
+    """Words (runs of letters and digits) of a search query, lower-cased"""
+    return [term.lower() for term in re.findall(r"[^\W_]+", q)][:MAX_QUERY_TERMS]
+
+
+def search(db: Session, q: str, skip: int = 0, limit: int = 20) -> List[dict]:
+    """Surveys whose farmer name and trees whose species or notes match every word of `q` (as
+    a prefix), best match first, as SearchHit dicts"""
+    terms = query_terms(q)
+    if not terms:
+        raise HTTPException(status_code=400, detail="Search query must contain at least one letter or digit")
+    if db.get_bind().dialect.name == "postgresql":
+        query = " & ".join(f"{term}:*" for term in terms)
+        statements = POSTGRES_SURVEY_HITS, POSTGRES_TREE_HITS
+    else:
+        query = " ".join(f'"{term}"*' for term in terms)
+        statements = SQLITE_SURVEY_HITS, SQLITE_TREE_HITS
+
+    parameters = {"query": query, "limit": skip + limit, "window": RANK_WINDOW}
+    hits = [
+        {"kind": "survey", "survey_id": row.survey_id, "farmer_name": row.farmer_name,
+         "crop_type": row.crop_type, "tree_id": None, "species_name": None, "snippet": None,
+         "score": row.score}
+        for row in db.execute(statements[0], parameters)
+    ]
+    hits.extend(
+        {"kind": "tree", "survey_id": row.survey_id, "farmer_name": row.farmer_name,
+         "crop_type": row.crop_type, "tree_id": row.tree_id, "species_name": row.species_name,
+         "snippet": row.snippet or None, "score": row.score}
+        for row in db.execute(statements[1], parameters)
+    )
+    hits.sort(key=lambda hit: (-hit["score"], hit["kind"], hit["tree_id"] or hit["survey_id"]))
+    return hits[skip:skip + limit]
@@ -0,0 +1,125 @@
+"""
+Fast JSON and MessagePack responses for trusted database rows.
+
+The read endpoints (survey and tree lookups, lists, near/within and sync) don't build
+a validated Pydantic model per row: crud.py selects plain columns and shapes them into
+dicts matching the response schemas, and the handlers return `json_response(...)`,
+which serializes them once, in Rust, with pydantic_core.to_json. Returning the data
+normally would make FastAPI validate every row against `response_model`, convert it
+with jsonable_encoder and then run json.dumps. The rows already passed validation
+when they were written, so none of that is repeated. `response_model` stays on the
+routes for the OpenAPI docs.
+
+Clients that send `Accept: application/msgpack` get the same documents encoded as
+MessagePack (datetimes stay ISO 8601 strings). ContentNegotiationMiddleware marks the
+request so json_response encodes MessagePack directly, and transcodes every other
+JSON response (writes, errors) on the way out. The ETag of a MessagePack response gets
+a "-msgpack" suffix, so JSON and MessagePack copies never share a strong validator.
+"""
+import json
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+import msgpack
+from fastapi import Response
+from pydantic_core import to_json, to_jsonable_python
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from etags import representation_etag
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack")
+
+_wants_msgpack: ContextVar[bool] = ContextVar("wants_msgpack", default=False)
+
+
+def json_response(content: Any, headers: Optional[Dict[str, str]] = None) -> Response:
+    """200 response with the content (dicts, lists or Pydantic models) serialized straight to
+    bytes: MessagePack if the client asked for it, JSON otherwise"""
+    if _wants_msgpack.get():
+        return Response(content=msgpack_bytes(content), media_type=MSGPACK_MEDIA_TYPE, headers=headers)
+    return Response(content=to_json(content), media_type=JSON_MEDIA_TYPE, headers=headers)
+
+
+def msgpack_bytes(content: Any) -> bytes:
+    """MessagePack encoding of the document json_response would send as JSON"""
+    return msgpack.packb(to_jsonable_python(content))
+
+
+def accepts_msgpack(accept: str) -> bool:
+    """Whether an Accept header lists MessagePack with a non-zero quality"""
+    for media_range in accept.split(","):
+        media_type, _, params = media_range.partition(";")
+        if media_type.strip().lower() in MSGPACK_MEDIA_TYPES:
+            return _quality(params) > 0
+    return False
+
+
+class ContentNegotiationMiddleware:
+    """Serve MessagePack instead of JSON to clients that send Accept: application/msgpack"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        wants_msgpack = accepts_msgpack(Headers(scope=scope).get("accept", ""))
+        token = _wants_msgpack.set(wants_msgpack)
+        try:
+            await self.app(scope, receive, _NegotiatingSender(send, wants_msgpack).send)
+        finally:
+            _wants_msgpack.reset(token)
+
+
+class _NegotiatingSender:
+    """Adds Vary: Accept to negotiable responses and transcodes JSON bodies when MessagePack was asked for"""
+
+    def __init__(self, send: Send, wants_msgpack: bool):
+        self._send = send
+        self._wants_msgpack = wants_msgpack
+        self._start: Optional[Message] = None
+        self._body = []
+
+    async def send(self, message: Message):
+        if message["type"] == "http.response.start":
+            headers = MutableHeaders(raw=message["headers"])
+            media_type = headers.get("content-type", "").partition(";")[0].strip()
+            if media_type in (JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE):
+                headers.add_vary_header("Accept")
+            if media_type == MSGPACK_MEDIA_TYPE and "etag" in headers:
+                headers["ETag"] = representation_etag(headers["etag"], "msgpack")
+            if self._wants_msgpack and media_type == JSON_MEDIA_TYPE:
+                # Hold the response until the whole JSON body has arrived
+                self._start = message
+                return
+        elif message["type"] == "http.response.body" and self._start is not None:
+            self._body.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body = b"".join(self._body)
+            if body:
+                body = msgpack.packb(json.loads(body))
+                headers = MutableHeaders(raw=self._start["headers"])
+                headers["content-type"] = MSGPACK_MEDIA_TYPE
+                headers["content-length"] = str(len(body))
+                if "etag" in headers:
+                    headers["ETag"] = representation_etag(headers["etag"], "msgpack")
+            await self._send(self._start)
+            message = {"type": "http.response.body", "body": body, "more_body": False}
+            self._start = None
+        await self._send(message)
+
+
+def _quality(params: str) -> float:
+    for param in params.split(";"):
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value)
+            except ValueError:
+                return 0.0
+    return 1.0
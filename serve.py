@@ -0,0 +1,140 @@
+"""
+Production launcher: migrate once, load the app once, fork the workers.
+
+    python serve.py --migrate --workers 4 --port 8000
+
+The parent process upgrades the schema (with --migrate) or checks it, imports main.py
+and binds the listening socket. Only then does it fork the workers, so the import of
+FastAPI, SQLAlchemy and the routes (most of a cold start) is paid once. Workers
+inherit it copy-on-write and are serving within milliseconds, and no two processes
+run DDL at once. A worker that dies is replaced; SIGTERM or SIGINT stops them all.
+
+More than one worker needs the read cache and the event stream shared through Redis
+(CACHE_URL or CACHE_ENABLED=false, and EVENTS_URL); otherwise serve.py refuses to
+start unless given --allow-per-worker-state. PROMETHEUS_MULTIPROC_DIR is then pointed
+at a fresh temporary directory unless already set, so /metrics reports every worker.
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+
+def _serve(app, sock: socket.socket, args):
+    """Run one uvicorn server on the shared socket until it is told to stop"""
+    import uvicorn
+
+    config = uvicorn.Config(app, proxy_headers=True, forwarded_allow_ips=args.forwarded_allow_ips,
+                            log_level=args.log_level, timeout_keep_alive=args.keep_alive,
+                            timeout_graceful_shutdown=args.graceful_timeout)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def _fork_worker(app, sock: socket.socket, args) -> int:
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        try:
+            _serve(app, sock, args)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def main(argv=None) -> int:
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Serve the API with preloaded, forked uvicorn workers")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")),
+                        help="Worker processes (default: WEB_CONCURRENCY or 1)")
+    parser.add_argument("--migrate", action="store_true", help="Upgrade the schema before serving")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--keep-alive", type=int, default=5, help="Seconds to hold idle keep-alive connections")
+    parser.add_argument("--graceful-timeout", type=int, default=10,
+                        help="Seconds to let open requests finish on shutdown before closing them (GET /events never does)")
+    parser.add_argument("--forwarded-allow-ips", default=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"))
+    parser.add_argument("--allow-per-worker-state", action="store_true",
+                        help="Run several workers even though the read cache or event stream is private to each one")
+    args = parser.parse_args(argv)
+
+    if args.workers > 1:
+        import cache
+        import events
+
+        per_worker = []
+        if cache.cache.name == "memory":
+            per_worker.append("the read cache (set CACHE_URL, or CACHE_ENABLED=false)")
+        if events.broker.name == "local":
+            per_worker.append("the event stream (set EVENTS_URL)")
+        if per_worker:
+            message = (f"With {args.workers} workers, {' and '.join(per_worker)} would be private to each worker, "
+                       f"so one worker's writes would not reach the others")
+            if not args.allow_per_worker_state:
+                parser.error(f"{message}; pass --allow-per-worker-state to start anyway")
+            print(f"Warning: {message}", file=sys.stderr, flush=True)
+
+    start = time.perf_counter()
+    if args.workers > 1 and "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        # Must be set before prometheus_client is imported
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="farm-survey-metrics-")
+
+    from database import engine
+    from migrations import check_schema, upgrade
+
+    if args.migrate:
+        before, after = upgrade(engine)
+        if before != after:
+            print(f"Upgraded schema from version {before} to {after}", flush=True)
+    else:
+        check_schema(engine)
+    from main import app
+    # Workers must not share the parent's database connections
+    engine.dispose()
+
+    sock = socket.socket(socket.AF_INET6 if ":" in args.host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    print(f"Loaded app in {time.perf_counter() - start:.2f}s; serving on {args.host}:{args.port} "
+          f"with {args.workers} worker(s)", flush=True)
+
+    if args.workers <= 1:
+        _serve(app, sock, args)
+        return 0
+
+    from prometheus_client import multiprocess
+
+    workers = {_fork_worker(app, sock, args) for _ in range(args.workers)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        multiprocess.mark_process_dead(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}; starting a replacement", flush=True)
+            workers.add(_fork_worker(app, sock, args))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,7 +3,7 @@
  * Master-Detail View Architecture
  */
 
-import type { FarmSurvey, FarmSurveyCreate, ApiError, Tree, TreeCreate } from './types';
+import type { FarmSurvey, FarmSurveyCreate, ApiError, Tree, TreeCreate, ChangeEvent } from './types';
 
 const API_BASE_URL = '';
 
@@ -23,12 +23,13 @@ const surveyIdInput = document.getElementById('survey-id') as HTMLInputElement;
 const searchInput = document.getElementById('search-input') as HTMLInputElement;
 
 let editingSurvey: FarmSurvey | null = null;
-let currentDetailId: number | null = null; // Store for client-side filtering
+let currentDetailId: number | null = null; // Survey shown in the detail view, refreshed by live updates
 let allSurveys: FarmSurvey[] = []; // Store for client-side filtering
 
 // Initialize
 document.addEventListener('DOMContentLoaded', () => {
     loadSurveys();
+    subscribeToChanges();
 
     if (surveyForm) {
         surveyForm.addEventListener('submit', handleFormSubmit);
@@ -202,6 +203,7 @@ async function viewSurvey(id: number) {
         document.getElementById('detail-crop')!.textContent = survey.crop_type;
         document.getElementById('detail-location')!.textContent = `${survey.geo_location.latitude}, ${survey.geo_location.longitude}`;
 
+        currentDetailId = survey.survey_id;
         const title = document.getElementById('detail-title');
         if (title) title.textContent = `Survey #${survey.survey_id}`;
 
@@ -496,6 +498,81 @@ async function deleteTree(treeId: number, surveyId: number) {
     } catch (e) { showError('Failed delete'); }
 }
 
+// ---------------------------------------------------------
+// LIVE UPDATES
+// ---------------------------------------------------------
+// Changes are collected for a short while and applied together, so a bulk write (an
+// import, a tree replace, a batch upsert) costs one refetch per survey, or one reload
+const LIVE_UPDATE_DELAY_MS = 500;
+const LIVE_UPDATE_MAX_FETCHES = 20; // More changed surveys than this: reload the list instead
+const pendingChanges = new Map<number, 'changed' | 'deleted'>(); // survey_id -> what to do
+let pendingDetailTrees = false;
+let flushTimer: number | null = null;
+
+function subscribeToChanges() {
+    if (!('EventSource' in window)) return;
+    const source = new EventSource(`${API_BASE_URL}/events`);
+    source.onmessage = (message) => queueChange(JSON.parse(message.data) as ChangeEvent);
+
+    // EventSource reconnects by itself; reload once it has, as changes may have been missed meanwhile
+    let disconnected = false;
+    source.onerror = () => { disconnected = true; };
+    source.onopen = () => {
+        if (disconnected) {
+            disconnected = false;
+            loadSurveys();
+        }
+    };
+}
+
+function queueChange(change: ChangeEvent) {
+    if (change.entity === 'survey' && change.op === 'deleted') {
+        pendingChanges.set(change.survey_id, 'deleted');
+    } else if (pendingChanges.get(change.survey_id) !== 'deleted') {
+        pendingChanges.set(change.survey_id, 'changed');
+    }
+    if (change.entity === 'tree' && change.survey_id === currentDetailId) pendingDetailTrees = true;
+    if (flushTimer === null) flushTimer = window.setTimeout(applyChanges, LIVE_UPDATE_DELAY_MS);
+}
+
+async function applyChanges() {
+    const changes = new Map(pendingChanges);
+    const detailTrees = pendingDetailTrees;
+    pendingChanges.clear();
+    pendingDetailTrees = false;
+
+    try {
+        const changed = [...changes].filter(([, action]) => action === 'changed').map(([surveyId]) => surveyId);
+        if (changed.length > LIVE_UPDATE_MAX_FETCHES) {
+            await loadSurveys();
+        } else {
+            allSurveys = allSurveys.filter(s => changes.get(s.survey_id) !== 'deleted');
+            // Refetch only the surveys that changed instead of the whole list
+            const surveys = await Promise.all(changed.map(async (surveyId) => {
+                const response = await fetch(`${API_BASE_URL}/surveys/${surveyId}`);
+                return response.ok ? await response.json() as FarmSurvey : null;
+            }));
+            for (const survey of surveys) {
+                if (!survey) continue;
+                const index = allSurveys.findIndex(s => s.survey_id === survey.survey_id);
+                if (index >= 0) allSurveys[index] = survey;
+                else allSurveys.push(survey);
+            }
+            if (searchInput && searchInput.value.trim()) {
+                filterSurveys(searchInput.value);
+            } else {
+                renderSurveys(allSurveys);
+            }
+        }
+        if (detailTrees && currentDetailId !== null && viewDetail && viewDetail.style.display !== 'none') {
+            loadTreesForDetail(currentDetailId);
+        }
+    } finally {
+        // Changes that arrived while this batch was applied get their own batch
+        flushTimer = pendingChanges.size ? window.setTimeout(applyChanges, LIVE_UPDATE_DELAY_MS) : null;
+    }
+}
+
 // ---------------------------------------------------------
 // SYNC & HELPERS
 // ---------------------------------------------------------
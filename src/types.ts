@@ -62,6 +62,14 @@ export interface TreeUpdate {
   notes?: string | null;
 }
 
+export interface ChangeEvent {
+  entity: 'survey' | 'tree';
+  op: 'created' | 'updated' | 'deleted';
+  id: number;
+  survey_id: number;
+  last_updated: string;
+}
+
 export interface ApiError {
   detail: string;
 }
@@ -14,9 +14,11 @@
   var surveyIdInput = document.getElementById("survey-id");
   var searchInput = document.getElementById("search-input");
   var editingSurvey = null;
+  var currentDetailId = null;
   var allSurveys = [];
   document.addEventListener("DOMContentLoaded", () => {
     loadSurveys();
+    subscribeToChanges();
     if (surveyForm) {
       surveyForm.addEventListener("submit", handleFormSubmit);
     }
@@ -152,6 +154,7 @@
       document.getElementById("detail-farmer").textContent = survey.farmer_name;
       document.getElementById("detail-crop").textContent = survey.crop_type;
       document.getElementById("detail-location").textContent = `${survey.geo_location.latitude}, ${survey.geo_location.longitude}`;
+      currentDetailId = survey.survey_id;
       const title = document.getElementById("detail-title");
       if (title)
         title.textContent = `Survey #${survey.survey_id}`;
@@ -427,6 +430,75 @@
       showError("Failed delete");
     }
   }
+  var LIVE_UPDATE_DELAY_MS = 500;
+  var LIVE_UPDATE_MAX_FETCHES = 20;
+  var pendingChanges = /* @__PURE__ */ new Map();
+  var pendingDetailTrees = false;
+  var flushTimer = null;
+  function subscribeToChanges() {
+    if (!("EventSource" in window))
+      return;
+    const source = new EventSource(`${API_BASE_URL}/events`);
+    source.onmessage = (message) => queueChange(JSON.parse(message.data));
+    let disconnected = false;
+    source.onerror = () => {
+      disconnected = true;
+    };
+    source.onopen = () => {
+      if (disconnected) {
+        disconnected = false;
+        loadSurveys();
+      }
+    };
+  }
+  function queueChange(change) {
+    if (change.entity === "survey" && change.op === "deleted") {
+      pendingChanges.set(change.survey_id, "deleted");
+    } else if (pendingChanges.get(change.survey_id) !== "deleted") {
+      pendingChanges.set(change.survey_id, "changed");
+    }
+    if (change.entity === "tree" && change.survey_id === currentDetailId)
+      pendingDetailTrees = true;
+    if (flushTimer === null)
+      flushTimer = window.setTimeout(applyChanges, LIVE_UPDATE_DELAY_MS);
+  }
+  async function applyChanges() {
+    const changes = new Map(pendingChanges);
+    const detailTrees = pendingDetailTrees;
+    pendingChanges.clear();
+    pendingDetailTrees = false;
+    try {
+      const changed = [...changes].filter(([, action]) => action === "changed").map(([surveyId]) => surveyId);
+      if (changed.length > LIVE_UPDATE_MAX_FETCHES) {
+        await loadSurveys();
+      } else {
+        allSurveys = allSurveys.filter((s) => changes.get(s.survey_id) !== "deleted");
+        const surveys = await Promise.all(changed.map(async (surveyId) => {
+          const response = await fetch(`${API_BASE_URL}/surveys/${surveyId}`);
+          return response.ok ? await response.json() : null;
+        }));
+        for (const survey of surveys) {
+          if (!survey)
+            continue;
+          const index = allSurveys.findIndex((s) => s.survey_id === survey.survey_id);
+          if (index >= 0)
+            allSurveys[index] = survey;
+          else
+            allSurveys.push(survey);
+        }
+        if (searchInput && searchInput.value.trim()) {
+          filterSurveys(searchInput.value);
+        } else {
+          renderSurveys(allSurveys);
+        }
+      }
+      if (detailTrees && currentDetailId !== null && viewDetail && viewDetail.style.display !== "none") {
+        loadTreesForDetail(currentDetailId);
+      }
+    } finally {
+      flushTimer = pendingChanges.size ? window.setTimeout(applyChanges, LIVE_UPDATE_DELAY_MS) : null;
+    }
+  }
   var SyncManager = class {
     static updateUI() {
     }
@@ -0,0 +1,191 @@
+"""
+Incrementally maintained tree statistics.
+
+The tree_stats table holds the total tree_count and number of tree records per
+species, per crop type and per region (1-degree block, see geo.py). Every write in
+crud.py that changes trees, or the crop type / location of a survey with trees,
+collects the change in a StatsDelta and applies it in the same transaction as an
+atomic upsert, so the dashboards read O(groups) rows instead of scanning trees.
+
+`python stats.py rebuild` recomputes the table from scratch and `python stats.py
+verify` reports any drift between the stored and recomputed totals.
+"""
+import argparse
+import sys
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from geo import LON_CELLS, REGION_CELLS, region_for_cell, region_name
+from models import FarmSurvey, Tree, TreeStat
+
+DIMENSIONS = ("species", "crop_type", "region")
+
+StatKey = Tuple[str, str]
+
+
+class StatsDelta:
+    """Accumulates signed changes to tree_stats and applies them in one statement"""
+
+    def __init__(self):
+        self.changes: Dict[StatKey, List[int]] = defaultdict(lambda: [0, 0])
+
+    def add(self, crop_type: str, geo_cell: int, species_name: str, tree_count: int, records: int = 1):
+        """Record records tree rows totalling tree_count trees (negative values remove them)"""
+        for key in (("species", species_name), ("crop_type", crop_type), ("region", region_for_cell(geo_cell))):
+            self.changes[key][0] += tree_count
+            self.changes[key][1] += records
+
+    def move(self, old_key: Tuple[str, int], new_key: Tuple[str, int], species_name: str,
+             tree_count: int, records: int = 1):
+        """Record tree rows moving from one (crop_type, geo_cell) group to another"""
+        self.add(*old_key, species_name, -tree_count, -records)
+        self.add(*new_key, species_name, tree_count, records)
+
+    def move_survey_trees(self, db: Session, old_keys: Dict[int, Tuple[str, int]]):
+        """Move the current trees of the given surveys from their old (crop_type, geo_cell),
+        by survey ID, to the one now stored. The same rows are subtracted and added back, so
+        run it after the surveys are updated and a concurrent tree write can't make them drift."""
+        if not old_keys:
+            return
+        rows = db.execute(
+            select(FarmSurvey.survey_id, FarmSurvey.crop_type, FarmSurvey.geo_cell, Tree.species_name,
+                   func.sum(Tree.tree_count), func.count())
+            .join(Tree, Tree.survey_id == FarmSurvey.survey_id)
+            .where(FarmSurvey.survey_id.in_(old_keys))
+            .group_by(FarmSurvey.survey_id, FarmSurvey.crop_type, FarmSurvey.geo_cell, Tree.species_name)
+        )
+        for survey_id, crop_type, geo_cell, species_name, tree_count, records in rows:
+            self.move(old_keys[survey_id], (crop_type, geo_cell), species_name, tree_count, records)
+
+    def apply(self, db: Session):
+        """Upsert the accumulated changes into tree_stats (does not commit)"""
+        rows = [
+            {"dimension": dimension, "key": key, "tree_count": tree_count, "record_count": records}
+            for (dimension, key), (tree_count, records) in self.changes.items()
+            if tree_count or records
+        ]
+        if rows:
+            _upsert(db, rows)
+        self.changes.clear()
+
+
+def _upsert(db: Session, rows: List[dict]):
+    """Add the rows' counts to existing tree_stats rows, inserting missing ones"""
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        statement = dialect_insert(TreeStat)
+        db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[TreeStat.dimension, TreeStat.key],
+                set_={
+                    "tree_count": TreeStat.tree_count + statement.excluded.tree_count,
+                    "record_count": TreeStat.record_count + statement.excluded.record_count,
+                }
+            ),
+            rows
+        )
+        return
+
+    # Portable fallback: increment existing rows, then insert the ones that were missing
+    for row in rows:
+        result = db.execute(
+            update(TreeStat)
+            .where(TreeStat.dimension == row["dimension"], TreeStat.key == row["key"])
+            .values(tree_count=TreeStat.tree_count + row["tree_count"],
+                    record_count=TreeStat.record_count + row["record_count"])
+        )
+        if result.rowcount == 0:
+            db.execute(insert(TreeStat).values(**row))
+
+
+def get_stats(db: Session, dimension: str, limit: int = 1000) -> List[TreeStat]:
+    """Read the totals of one dimension, largest tree_count first"""
+    return db.scalars(
+        select(TreeStat)
+        .where(TreeStat.dimension == dimension, TreeStat.record_count > 0)
+        .order_by(TreeStat.tree_count.desc(), TreeStat.key)
+        .limit(limit)
+    ).all()
+
+
+def compute_stats(db: Session) -> Dict[StatKey, Tuple[int, int]]:
+    """Recompute every total from the trees table with GROUP BY queries"""
+    totals: Dict[StatKey, Tuple[int, int]] = {}
+    region_row = FarmSurvey.geo_cell // LON_CELLS // REGION_CELLS
+    region_col = FarmSurvey.geo_cell % LON_CELLS // REGION_CELLS
+    groupings = {
+        "species": (Tree.species_name,),
+        "crop_type": (FarmSurvey.crop_type,),
+        "region": (region_row, region_col),
+    }
+    for dimension, columns in groupings.items():
+        rows = db.execute(
+            select(*columns, func.sum(Tree.tree_count), func.count())
+            .select_from(Tree)
+            .join(FarmSurvey, Tree.survey_id == FarmSurvey.survey_id)
+            .group_by(*columns)
+        )
+        for *group, tree_count, records in rows:
+            key = region_name(*group) if dimension == "region" else group[0]
+            totals[(dimension, key)] = (tree_count, records)
+    return totals
+
+
+def rebuild(db: Session) -> int:
+    """Replace tree_stats with freshly computed totals; returns the number of rows written"""
+    totals = compute_stats(db)
+    db.execute(delete(TreeStat))
+    if totals:
+        db.execute(insert(TreeStat), [
+            {"dimension": dimension, "key": key, "tree_count": tree_count, "record_count": records}
+            for (dimension, key), (tree_count, records) in totals.items()
+        ])
+    db.commit()
+    return len(totals)
+
+
+def verify(db: Session) -> List[str]:
+    """Compare stored totals with recomputed ones; returns a description of each mismatch"""
+    expected = compute_stats(db)
+    stored = {
+        (row.dimension, row.key): (row.tree_count, row.record_count)
+        for row in db.scalars(select(TreeStat)) if row.record_count or row.tree_count
+    }
+    return [
+        f"{dimension}={key!r}: stored {stored.get((dimension, key))}, expected {expected.get((dimension, key))}"
+        for dimension, key in sorted(set(expected) | set(stored))
+        if expected.get((dimension, key)) != stored.get((dimension, key))
+    ]
+
+
+def main(argv=None) -> int:
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Maintain the tree statistics summary table")
+    parser.add_argument("command", choices=["rebuild", "verify"])
+    args = parser.parse_args(argv)
+
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        if args.command == "rebuild":
+            print(f"Rebuilt tree_stats with {rebuild(db)} rows")
+            return 0
+        mismatches = verify(db)
+        for mismatch in mismatches:
+            print(mismatch)
+        print("tree_stats is consistent" if not mismatches else f"{len(mismatches)} mismatched totals")
+        return 1 if mismatches else 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,7 @@
 Tests for API endpoints
 """
 import pytest
+from typing import List
 from datetime import datetime, timedelta
 from fastapi.testclient import TestClient
 
@@ -237,3 +238,803 @@ def test_crud_workflow(client: TestClient, sample_survey_data, sample_survey_upd
     assert get_after_delete.status_code == 404
 
 
+
+
+def test_batch_upsert_creates_surveys_with_trees(client: TestClient, sample_survey_data):
+    """Test batch upsert creates surveys and their nested trees"""
+    payload = {
+        "surveys": [
+            {**sample_survey_data, "trees": [{"species_name": "Oak", "tree_count": 5}]},
+            {**sample_survey_data, "farmer_name": "Second Farmer"},
+        ]
+    }
+    response = client.post("/surveys/batch", json=payload)
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["status"] for r in results] == ["created", "created"]
+    assert [r["index"] for r in results] == [0, 1]
+
+    survey = client.get(f"/surveys/{results[0]['survey_id']}").json()
+    assert survey["farmer_name"] == sample_survey_data["farmer_name"]
+    assert [t["species_name"] for t in survey["trees"]] == ["Oak"]
+    assert client.get(f"/surveys/{results[1]['survey_id']}").json()["farmer_name"] == "Second Farmer"
+
+
+def test_batch_upsert_updates_and_replaces_trees(client: TestClient, sample_survey_data):
+    """Test batch upsert updates existing surveys and replaces their trees"""
+    created = client.post("/surveys/", json=sample_survey_data).json()
+    client.post(f"/surveys/{created['survey_id']}/trees/", json={"species_name": "Oak", "tree_count": 5})
+
+    payload = {
+        "surveys": [{
+            **sample_survey_data,
+            "survey_id": created["survey_id"],
+            "last_updated": created["last_updated"],
+            "farmer_name": "Updated Name",
+            "trees": [{"species_name": "Pine", "tree_count": 3}],
+        }]
+    }
+    response = client.post("/surveys/batch", json=payload)
+    assert response.status_code == 200
+    assert response.json()["results"][0]["status"] == "updated"
+
+    survey = client.get(f"/surveys/{created['survey_id']}").json()
+    assert survey["farmer_name"] == "Updated Name"
+    assert [t["species_name"] for t in survey["trees"]] == ["Pine"]
+
+
+def test_batch_upsert_reports_conflicts(client: TestClient, sample_survey_data):
+    """Test batch upsert reports stale and unknown surveys without failing the batch"""
+    created = client.post("/surveys/", json=sample_survey_data).json()
+    stale = (datetime.fromisoformat(created["last_updated"]) - timedelta(hours=1)).isoformat()
+
+    payload = {
+        "surveys": [
+            {**sample_survey_data, "survey_id": created["survey_id"], "last_updated": stale, "farmer_name": "Stale"},
+            {**sample_survey_data, "survey_id": 99999},
+            sample_survey_data,
+        ]
+    }
+    response = client.post("/surveys/batch", json=payload)
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["status"] for r in results] == ["conflict", "conflict", "created"]
+    assert "conflict" in results[0]["detail"].lower()
+    assert "not found" in results[1]["detail"].lower()
+
+    assert client.get(f"/surveys/{created['survey_id']}").json()["farmer_name"] == sample_survey_data["farmer_name"]
+
+
+def test_sync_changes_full_then_delta(client: TestClient, sample_survey_data, monkeypatch):
+    """Test the change feed returns everything first, then only later changes and deletes"""
+    import crud
+    monkeypatch.setattr(crud, "SYNC_SAFETY_LAG", timedelta(0))
+    first = client.post("/surveys/", json=sample_survey_data).json()
+    second = client.post("/surveys/", json=sample_survey_data).json()
+    tree = client.post(f"/surveys/{first['survey_id']}/trees/", json={"species_name": "Oak", "tree_count": 5}).json()
+
+    full = client.get("/sync/changes")
+    assert full.status_code == 200
+    data = full.json()
+    assert {s["survey_id"] for s in data["surveys"]} == {first["survey_id"], second["survey_id"]}
+    assert [t["tree_id"] for t in data["trees"]] == [tree["tree_id"]]
+    assert data["deleted"] == []
+
+    client.put(f"/surveys/{first['survey_id']}", json={"farmer_name": "Changed"})
+    client.delete(f"/trees/{tree['tree_id']}")
+    client.delete(f"/surveys/{second['survey_id']}")
+
+    delta = client.get("/sync/changes", params={"since": data["next_cursor"]}).json()
+    assert [s["survey_id"] for s in delta["surveys"]] == [first["survey_id"]]
+    assert delta["surveys"][0]["farmer_name"] == "Changed"
+    assert delta["trees"] == []
+    assert {(d["entity_type"], d["entity_id"]) for d in delta["deleted"]} == {
+        ("tree", tree["tree_id"]), ("survey", second["survey_id"])
+    }
+
+    empty = client.get("/sync/changes", params={"since": delta["next_cursor"]}).json()
+    assert empty["surveys"] == [] and empty["trees"] == [] and empty["deleted"] == []
+    assert empty["next_cursor"] == delta["next_cursor"]
+    assert not empty["has_more"]
+
+
+def test_sync_changes_pages_through_equal_timestamps(client: TestClient, db_session, sample_survey_data, monkeypatch):
+    """Test limit pages split rows sharing a timestamp without losing any, and recent writes
+    are held back until they are SYNC_SAFETY_LAG old"""
+    from sqlalchemy import update
+    import crud
+    from cursors import encode_cursor
+    from models import FarmSurvey, Tree
+    monkeypatch.setattr(crud, "SYNC_SAFETY_LAG", timedelta(0))
+    survey_ids = [client.post("/surveys/", json=sample_survey_data).json()["survey_id"] for _ in range(5)]
+    client.post(f"/surveys/{survey_ids[0]}/trees/bulk", json=[{"species_name": "Oak", "tree_count": 1}] * 3)
+    stamp = datetime(2024, 1, 1)
+    db_session.execute(update(FarmSurvey).values(last_updated=stamp))
+    db_session.execute(update(Tree).values(updated_at=stamp))
+    db_session.commit()
+
+    seen_surveys, seen_trees, pages, cursor = [], [], 0, None
+    while True:
+        page = client.get("/sync/changes", params={"limit": 2, **({"since": cursor} if cursor else {})}).json()
+        assert len(page["surveys"]) <= 2 and len(page["trees"]) <= 2
+        seen_surveys += [survey["survey_id"] for survey in page["surveys"]]
+        seen_trees += [tree["tree_id"] for tree in page["trees"]]
+        cursor, pages = page["next_cursor"], pages + 1
+        if not page["has_more"]:
+            break
+    assert seen_surveys == survey_ids and len(seen_trees) == 3 and pages == 3
+
+    # A write stamped inside the lag isn't returned, and the cursor stays before it
+    monkeypatch.setattr(crud, "SYNC_SAFETY_LAG", timedelta(minutes=1))
+    client.put(f"/surveys/{survey_ids[0]}", json={"farmer_name": "Late"})
+    held = client.get("/sync/changes", params={"since": cursor}).json()
+    assert held["surveys"] == [] and held["next_cursor"] == cursor
+    monkeypatch.setattr(crud, "SYNC_SAFETY_LAG", timedelta(0))
+    assert [s["farmer_name"] for s in client.get("/sync/changes", params={"since": cursor}).json()["surveys"]] == ["Late"]
+
+    # Cursors from before positions held IDs still work
+    old_cursor = encode_cursor([stamp])
+    assert [s["survey_id"] for s in client.get("/sync/changes", params={"since": old_cursor}).json()["surveys"]] == \
+        [survey_ids[0]]
+
+
+def test_sync_changes_invalid_cursor(client: TestClient):
+    """Test the change feed rejects a malformed cursor"""
+    response = client.get("/sync/changes", params={"since": "not-a-cursor"})
+    assert response.status_code == 400
+
+
+def test_get_surveys_loads_trees_without_n_plus_one(client: TestClient, sample_survey_data):
+    """Test listing surveys with trees issues a constant number of queries"""
+    from sqlalchemy import event
+    from conftest import test_engine
+
+    for i in range(5):
+        survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+        client.post(f"/surveys/{survey_id}/trees/", json={"species_name": f"Species {i}", "tree_count": i + 1})
+
+    statements = []
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(test_engine, "before_cursor_execute", count)
+    try:
+        response = client.get("/surveys/")
+    finally:
+        event.remove(test_engine, "before_cursor_execute", count)
+
+    assert response.status_code == 200
+    assert all(len(s["trees"]) == 1 for s in response.json())
+    # ETag aggregate, surveys page, trees of the page
+    assert len(statements) == 3
+
+
+def test_get_surveys_without_trees(client: TestClient, sample_survey_data):
+    """Test include_trees=false skips tree loading"""
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    client.post(f"/surveys/{survey_id}/trees/", json={"species_name": "Oak", "tree_count": 5})
+
+    response = client.get("/surveys/", params={"include_trees": False})
+    assert response.status_code == 200
+    assert response.json()[0]["trees"] == []
+
+    response = client.get(f"/surveys/{survey_id}", params={"include_trees": False})
+    assert response.json()["trees"] == []
+    assert len(client.get(f"/surveys/{survey_id}").json()["trees"]) == 1
+
+
+def test_get_surveys_sparse_fields(client: TestClient, sample_survey_data):
+    """Test fields= selects and returns only the requested columns"""
+    from sqlalchemy import event
+    from conftest import test_engine
+
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    client.post(f"/surveys/{survey_id}/trees/", json={"species_name": "Oak", "tree_count": 5})
+
+    statements = []
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(test_engine, "before_cursor_execute", count)
+    try:
+        response = client.get("/surveys/", params={"fields": "farmer_name,geo_location"})
+    finally:
+        event.remove(test_engine, "before_cursor_execute", count)
+
+    assert response.status_code == 200
+    assert response.json() == [{
+        "farmer_name": sample_survey_data["farmer_name"],
+        "geo_location": sample_survey_data["geo_location"],
+        "survey_id": survey_id,
+    }]
+    # ETag aggregate and the projected page; no tree query, no unrequested columns
+    assert len(statements) == 2
+    assert "crop_type" not in statements[1] and "trees" not in statements[1]
+
+    with_trees = client.get("/surveys/", params={"fields": "survey_id,trees"}).json()
+    assert [tree["species_name"] for tree in with_trees[0]["trees"]] == ["Oak"]
+    assert set(with_trees[0]) == {"survey_id", "trees"}
+    assert client.get("/surveys/", params={"fields": "farmer_name"}).headers["ETag"] != \
+        client.get("/surveys/", params={"fields": "crop_type"}).headers["ETag"]
+
+    near = client.get("/surveys/near", params={"lat": 40.7128, "lon": -74.0060, "radius_km": 1, "fields": "survey_id"})
+    assert near.json() == [{"survey_id": survey_id}]
+
+    invalid = client.get("/surveys/", params={"fields": "farmer_name,password"})
+    assert invalid.status_code == 400
+    assert "password" in invalid.json()["detail"]
+
+
+def test_get_surveys_rejects_bad_limit(client: TestClient, db_session, sample_survey_data):
+    """Test a limit outside 1..1000 is a 422 rather than a server error, and an empty page has no cursor"""
+    import crud
+
+    client.post("/surveys/", json=sample_survey_data)
+    for limit in (0, -1, 1001):
+        assert client.get(f"/surveys/?limit={limit}").status_code == 422
+
+    assert crud.list_surveys(db_session, limit=0) == ([], None)
+    assert crud.list_surveys(db_session, limit=-1) == ([], None)
+
+
+def test_get_surveys_cursor_pagination(client: TestClient, sample_survey_data):
+    """Test walking the survey list with keyset cursors"""
+    created = [client.post("/surveys/", json=sample_survey_data).json()["survey_id"] for _ in range(5)]
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, "include_trees": False}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/surveys/", params=params)
+        assert response.status_code == 200
+        seen.extend(s["survey_id"] for s in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert seen == sorted(created)
+
+
+def _filter_fixture(client: TestClient, db_session, sample_survey_data) -> dict:
+    """Surveys with distinct crops, sync states, names and update times; returns name -> survey_id"""
+    from models import FarmSurvey
+
+    rows = [
+        ("Asha Patel", "Rice", True, datetime(2024, 3, 1)),
+        ("Ashok Rao", "Wheat", False, datetime(2024, 3, 5)),
+        ("Ben Okafor", "Rice", False, datetime(2024, 3, 3)),
+        ("asha lower", "Rice", False, datetime(2024, 3, 4)),
+        ("Carla Diaz", "Rice", False, datetime(2024, 3, 2)),
+    ]
+    ids = {}
+    for farmer_name, crop_type, sync_status, last_updated in rows:
+        survey_id = client.post("/surveys/", json={
+            **sample_survey_data, "farmer_name": farmer_name, "crop_type": crop_type, "sync_status": sync_status
+        }).json()["survey_id"]
+        db_session.query(FarmSurvey).filter_by(survey_id=survey_id).update({"last_updated": last_updated})
+        ids[farmer_name] = survey_id
+    db_session.commit()
+    return ids
+
+
+def _names(client: TestClient, **params) -> List[str]:
+    response = client.get("/surveys/", params={"include_trees": False, **params})
+    assert response.status_code == 200
+    return [survey["farmer_name"] for survey in response.json()]
+
+
+def test_get_surveys_filters_and_sorts(client: TestClient, db_session, sample_survey_data):
+    """Test filtering the survey list by crop, sync status, name prefix and update window, in any sort order"""
+    _filter_fixture(client, db_session, sample_survey_data)
+
+    assert _names(client, crop_type="Rice", sort="-last_updated") == ["asha lower", "Ben Okafor", "Carla Diaz", "Asha Patel"]
+    assert _names(client, sync_status=False, sort="last_updated") == ["Carla Diaz", "Ben Okafor", "asha lower", "Ashok Rao"]
+    assert _names(client, crop_type="Rice", sync_status=True) == ["Asha Patel"]
+    # Prefixes are case-sensitive
+    assert _names(client, farmer_name_prefix="Ash", sort="farmer_name") == ["Asha Patel", "Ashok Rao"]
+    assert _names(client, farmer_name_prefix="Asha") == ["Asha Patel"]
+    assert _names(client, farmer_name_prefix="Zed") == []
+    assert _names(client, sort="-farmer_name")[:2] == ["asha lower", "Carla Diaz"]
+    # since is inclusive, before exclusive; timezone-aware times are compared in UTC
+    assert _names(client, updated_since="2024-03-02T00:00:00", updated_before="2024-03-04T00:00:00",
+                  sort="last_updated") == ["Carla Diaz", "Ben Okafor"]
+    assert _names(client, updated_since="2024-03-05T02:00:00+02:00") == ["Ashok Rao"]
+
+    assert client.get("/surveys/", params={"sort": "crop_type"}).status_code == 422
+    assert client.get("/surveys/", params={"farmer_name_prefix": ""}).status_code == 422
+
+
+def test_get_surveys_sorted_cursor_pagination(client: TestClient, db_session, sample_survey_data):
+    """Test keyset cursors walk filtered, sorted lists (ties broken by ID) and belong to their sort"""
+    from models import FarmSurvey
+
+    ids = _filter_fixture(client, db_session, sample_survey_data)
+    # A tie on last_updated
+    db_session.query(FarmSurvey).filter_by(survey_id=ids["Carla Diaz"]).update({"last_updated": datetime(2024, 3, 3)})
+    db_session.commit()
+
+    for params, expected in [
+        ({"crop_type": "Rice", "sort": "-last_updated"}, ["asha lower", "Carla Diaz", "Ben Okafor", "Asha Patel"]),
+        ({"sort": "farmer_name"}, ["Asha Patel", "Ashok Rao", "Ben Okafor", "Carla Diaz", "asha lower"]),
+        ({"sort": "-survey_id", "fields": "survey_id,farmer_name"}, list(reversed(list(ids)))),
+        ({"sort": "last_updated", "fields": "survey_id,farmer_name"},
+         ["Asha Patel", "Ben Okafor", "Carla Diaz", "asha lower", "Ashok Rao"]),
+    ]:
+        seen, cursor = [], None
+        while True:
+            response = client.get("/surveys/", params={**params, "limit": 2, "include_trees": False,
+                                                       **({"cursor": cursor} if cursor else {})})
+            assert response.status_code == 200
+            seen.extend(survey["farmer_name"] for survey in response.json())
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+        assert seen == expected, params
+
+    cursor = client.get("/surveys/", params={"limit": 1, "sort": "farmer_name"}).headers["X-Next-Cursor"]
+    assert client.get("/surveys/", params={"cursor": cursor, "sort": "last_updated"}).status_code == 400
+    assert client.get("/surveys/", params={"cursor": cursor}).status_code == 400
+
+
+def test_get_surveys_filter_plans_use_indexes(client: TestClient, db_session, sample_survey_data):
+    """Test EXPLAIN QUERY PLAN of filtered, sorted lists (first and later pages): every one seeks an
+    index in sort order, never scanning the table or sorting in a temporary B-tree"""
+    from conftest import test_engine
+    from profiler import capture_queries
+
+    _filter_fixture(client, db_session, sample_survey_data)
+    cases = [
+        ({"crop_type": "Rice", "sort": "-last_updated"}, "ix_farm_surveys_crop_type_last_updated (crop_type=?"),
+        ({"crop_type": "Rice", "updated_since": "2024-03-02T00:00:00", "sort": "last_updated"},
+         "ix_farm_surveys_crop_type_last_updated (crop_type=? AND last_updated>?"),
+        ({"sync_status": False, "sort": "last_updated"}, "ix_farm_surveys_sync_status_last_updated (sync_status=?"),
+        ({"farmer_name_prefix": "Ash", "sort": "farmer_name"}, "ix_farm_surveys_farmer_name (farmer_name>? AND farmer_name<?)"),
+        ({"updated_before": "2024-03-04T00:00:00", "sort": "-last_updated"}, "ix_farm_surveys_last_updated (last_updated<?"),
+    ]
+    for params, index in cases:
+        cursor = client.get("/surveys/", params={**params, "limit": 1}).headers["X-Next-Cursor"]
+        for page in [params, {**params, "cursor": cursor}]:
+            with capture_queries(test_engine) as statements:
+                client.get("/surveys/", params={**page, "limit": 1, "include_trees": False})
+            statement, parameters = next(
+                (captured.statement, captured.parameters) for captured in statements
+                if captured.statement.lstrip().startswith("SELECT farm_surveys.survey_id")
+            )
+            with test_engine.connect() as conn:
+                plan = [row[3] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+            assert len(plan) == 1 and plan[0].startswith(f"SEARCH farm_surveys USING INDEX {index}"), (page, plan)
+
+
+def test_get_trees_cursor_pagination(client: TestClient, sample_survey_data):
+    """Test paging through a survey's trees with keyset cursors"""
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    for i in range(3):
+        client.post(f"/surveys/{survey_id}/trees/", json={"species_name": f"Species {i}", "tree_count": 1})
+
+    first = client.get(f"/surveys/{survey_id}/trees/", params={"limit": 2})
+    assert [t["species_name"] for t in first.json()] == ["Species 0", "Species 1"]
+    second = client.get(
+        f"/surveys/{survey_id}/trees/", params={"limit": 2, "cursor": first.headers["X-Next-Cursor"]}
+    )
+    assert [t["species_name"] for t in second.json()] == ["Species 2"]
+    assert "X-Next-Cursor" not in second.headers
+
+
+def test_create_trees_bulk(client: TestClient, sample_survey_data):
+    """Test creating many trees for a survey in one request"""
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    species = [{"species_name": f"Species {index}", "tree_count": index + 1} for index in range(30)]
+
+    response = client.post(f"/surveys/{survey_id}/trees/bulk", json=species)
+    assert response.status_code == 201
+    created = response.json()
+    assert [tree["species_name"] for tree in created] == [tree["species_name"] for tree in species]
+    assert all(tree["survey_id"] == survey_id and tree["version"] == 1 for tree in created)
+    assert client.get(f"/surveys/{survey_id}/trees/").json() == created
+
+    assert client.post("/surveys/99999/trees/bulk", json=species).status_code == 404
+    invalid = client.post(f"/surveys/{survey_id}/trees/bulk", json=[species[0], {"species_name": "Oak", "tree_count": 0}])
+    assert invalid.status_code == 422
+    assert len(client.get(f"/surveys/{survey_id}/trees/").json()) == 30
+
+
+def test_replace_trees(client: TestClient, sample_survey_data):
+    """Test replacing all trees of a survey, with and without merging species"""
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    old = client.post(f"/surveys/{survey_id}/trees/", json={"species_name": "Pine", "tree_count": 4}).json()
+    trees = [
+        {"species_name": "Oak", "tree_count": 10, "height_avg": 10.0, "notes": "North field"},
+        {"species_name": "Teak", "tree_count": 2},
+        {"species_name": "Oak", "tree_count": 30, "height_avg": 20.0, "age_avg": 5, "notes": "South field"},
+    ]
+
+    replaced = client.put(f"/surveys/{survey_id}/trees/", json=trees)
+    assert replaced.status_code == 200
+    assert [tree["species_name"] for tree in replaced.json()] == ["Oak", "Teak", "Oak"]
+    assert client.get(f"/trees/{old['tree_id']}").json().get("species_name") != "Pine"
+
+    merged = client.put(f"/surveys/{survey_id}/trees/", json=trees, params={"merge_species": True}).json()
+    assert [(tree["species_name"], tree["tree_count"]) for tree in merged] == [("Oak", 40), ("Teak", 2)]
+    assert merged[0]["height_avg"] == 17.5
+    assert merged[0]["age_avg"] == 5
+    assert merged[0]["notes"] == "North field; South field"
+    assert client.get(f"/surveys/{survey_id}").json()["trees"] == merged
+
+    assert client.put(f"/surveys/{survey_id}/trees/", json=[]).json() == []
+    assert client.get(f"/surveys/{survey_id}/trees/").json() == []
+    assert client.put("/surveys/99999/trees/", json=trees).status_code == 404
+
+
+def test_get_surveys_invalid_cursor(client: TestClient):
+    """Test the survey list rejects a malformed cursor"""
+    response = client.get("/surveys/", params={"cursor": "bogus"})
+    assert response.status_code == 400
+
+
+def test_pool_status(client: TestClient):
+    """Test requests served by the app's own file-backed engine are counted by the pool
+    statistics endpoint, on connections configured with SQLITE_PRAGMAS"""
+    from database import engine, get_db
+    from main import app
+
+    before = client.get("/db/pool").json()["checkouts"]
+    # Serve these from the app's pool instead of the test session
+    app.dependency_overrides.pop(get_db)
+    for _ in range(3):
+        assert client.get("/surveys/").status_code == 200
+
+    response = client.get("/db/pool")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["pool_class"] == "TimedQueuePool"
+    assert data["checkouts"] >= before + 3
+    assert data["wait_seconds_max"] >= data["wait_seconds_avg"] >= 0
+
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+
+
+def test_export_surveys_ndjson(client: TestClient, sample_survey_data):
+    """Test NDJSON export streams one survey per line with its trees"""
+    import json
+
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    client.post(f"/surveys/{survey_id}/trees/", json={"species_name": "Oak", "tree_count": 5})
+    client.post("/surveys/", json={**sample_survey_data, "crop_type": "Rice"})
+
+    response = client.get("/export/surveys")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["crop_type"] for line in lines] == ["Wheat", "Rice"]
+    assert [t["species_name"] for t in lines[0]["trees"]] == ["Oak"]
+
+    filtered = client.get("/export/surveys", params={"crop_type": "Rice"})
+    assert [json.loads(line)["crop_type"] for line in filtered.text.splitlines()] == ["Rice"]
+
+
+def test_export_surveys_csv(client: TestClient, sample_survey_data):
+    """Test CSV export writes one row per tree plus a header"""
+    import csv
+    import io
+
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    for species in ("Oak", "Pine"):
+        client.post(f"/surveys/{survey_id}/trees/", json={"species_name": species, "tree_count": 2})
+    client.post("/surveys/", json=sample_survey_data)
+
+    response = client.get("/export/surveys", params={"format": "csv"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["species_name"] for row in rows] == ["Oak", "Pine", ""]
+    assert rows[0]["farmer_name"] == sample_survey_data["farmer_name"]
+
+
+def test_export_surveys_invalid_format(client: TestClient):
+    """Test export rejects unknown formats"""
+    assert client.get("/export/surveys", params={"format": "xml"}).status_code == 422
+
+
+def test_get_surveys_near(client: TestClient, sample_survey_data):
+    """Test radius search returns nearby surveys, nearest first"""
+    locations = {"Close": (40.72, -74.00), "Closest": (40.7128, -74.0061), "Far": (41.88, -87.63)}
+    for name, (lat, lon) in locations.items():
+        client.post("/surveys/", json={
+            **sample_survey_data, "farmer_name": name, "geo_location": {"latitude": lat, "longitude": lon}
+        })
+
+    response = client.get("/surveys/near", params={"lat": 40.7128, "lon": -74.0060, "radius_km": 10})
+    assert response.status_code == 200
+    assert [s["farmer_name"] for s in response.json()] == ["Closest", "Close"]
+
+
+def test_get_surveys_near_widens_only_as_needed(client: TestClient, sample_survey_data, monkeypatch):
+    """Test a large radius stops searching once `limit` surveys are nearer than the searched
+    distance, and keeps widening while fewer are"""
+    import crud
+    locations = {"Close": (40.72, -74.00), "Closest": (40.7128, -74.0061), "Far": (41.88, -87.63)}
+    for name, (lat, lon) in locations.items():
+        client.post("/surveys/", json={
+            **sample_survey_data, "farmer_name": name, "geo_location": {"latitude": lat, "longitude": lon}
+        })
+    searched = []
+    bbox_for_radius = crud.bbox_for_radius
+    monkeypatch.setattr(crud, "bbox_for_radius", lambda lat, lon, km: searched.append(km) or bbox_for_radius(lat, lon, km))
+
+    params = {"lat": 40.7128, "lon": -74.0060, "radius_km": 20000}
+    response = client.get("/surveys/near", params={**params, "limit": 2})
+    assert [s["farmer_name"] for s in response.json()] == ["Closest", "Close"]
+    assert searched == [crud.NEAR_START_KM]
+
+    searched.clear()
+    response = client.get("/surveys/near", params={**params, "limit": 3})
+    assert [s["farmer_name"] for s in response.json()] == ["Closest", "Close", "Far"]
+    # Far is about 1,150 km away
+    assert 1150 < searched[-1] < 2 * 1150
+
+
+def test_get_surveys_within_bbox(client: TestClient, sample_survey_data):
+    """Test bounding box search, including after a survey moves"""
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+
+    inside = client.get("/surveys/within", params={"bbox": "-74.1,40.6,-73.9,40.8"})
+    assert [s["survey_id"] for s in inside.json()] == [survey_id]
+
+    client.put(f"/surveys/{survey_id}", json={"geo_location": {"latitude": 41.8781, "longitude": -87.6298}})
+    assert client.get("/surveys/within", params={"bbox": "-74.1,40.6,-73.9,40.8"}).json() == []
+    moved = client.get("/surveys/within", params={"bbox": "-88,41,-87,42"})
+    assert [s["survey_id"] for s in moved.json()] == [survey_id]
+
+    assert client.get("/surveys/within", params={"bbox": "bad"}).status_code == 400
+
+
+def test_get_survey_etag_not_modified(client: TestClient, sample_survey_data):
+    """Test a matching If-None-Match returns 304 until the survey or its trees change"""
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    response = client.get(f"/surveys/{survey_id}")
+    etag = response.headers["ETag"]
+
+    cached = client.get(f"/surveys/{survey_id}", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["ETag"] == etag
+    assert client.get(f"/surveys/{survey_id}", headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+
+    client.post(f"/surveys/{survey_id}/trees/", json={"species_name": "Oak", "tree_count": 5})
+    refreshed = client.get(f"/surveys/{survey_id}", headers={"If-None-Match": etag})
+    assert refreshed.status_code == 200
+    assert len(refreshed.json()["trees"]) == 1
+    assert refreshed.headers["ETag"] != etag
+
+
+def test_get_surveys_etag_changes_with_list(client: TestClient, sample_survey_data):
+    """Test the list ETag covers the page parameters, new rows and deletes"""
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    etag = client.get("/surveys/").headers["ETag"]
+
+    assert client.get("/surveys/", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/surveys/", params={"limit": 10}, headers={"If-None-Match": etag}).status_code == 200
+
+    client.post("/surveys/", json=sample_survey_data)
+    client.delete(f"/surveys/{survey_id}")
+    response = client.get("/surveys/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+
+
+def test_get_surveys_etag_ignores_other_pages(client: TestClient, sample_survey_data):
+    """Test the list ETag only changes with the surveys and trees on the page"""
+    survey_ids = [client.post("/surveys/", json=sample_survey_data).json()["survey_id"] for _ in range(3)]
+    etag = client.get("/surveys/", params={"limit": 1}).headers["ETag"]
+
+    client.put(f"/surveys/{survey_ids[2]}", json={"farmer_name": "Jane"})
+    client.post(f"/surveys/{survey_ids[2]}/trees/", json={"species_name": "Oak", "tree_count": 5})
+    assert client.get("/surveys/", params={"limit": 1}, headers={"If-None-Match": etag}).status_code == 304
+
+    client.post(f"/surveys/{survey_ids[0]}/trees/", json={"species_name": "Oak", "tree_count": 5})
+    response = client.get("/surveys/", params={"limit": 1}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    client.put(f"/surveys/{survey_ids[0]}", json={"farmer_name": "Jane"})
+    assert client.get("/surveys/", params={"limit": 1}, headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_update_with_if_match(client: TestClient, sample_survey_data):
+    """Test PUT honours If-Match on surveys and trees and returns the new ETag"""
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    etag = client.get(f"/surveys/{survey_id}").headers["ETag"]
+
+    response = client.put(f"/surveys/{survey_id}", json={"farmer_name": "Jane"}, headers={"If-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] == client.get(f"/surveys/{survey_id}").headers["ETag"]
+
+    stale = client.put(f"/surveys/{survey_id}", json={"farmer_name": "Bob"}, headers={"If-Match": etag})
+    assert stale.status_code == 412
+    assert client.get(f"/surveys/{survey_id}").json()["farmer_name"] == "Jane"
+
+    tree_id = client.post(f"/surveys/{survey_id}/trees/", json={"species_name": "Oak", "tree_count": 5}).json()["tree_id"]
+    tree_etag = client.get(f"/trees/{tree_id}").headers["ETag"]
+    assert client.get(f"/trees/{tree_id}", headers={"If-None-Match": tree_etag}).status_code == 304
+    assert client.put(f"/trees/{tree_id}", json={"tree_count": 6}, headers={"If-Match": tree_etag}).status_code == 200
+    assert client.put(f"/trees/{tree_id}", json={"tree_count": 7}, headers={"If-Match": tree_etag}).status_code == 412
+    assert client.put(f"/trees/{tree_id}", json={"tree_count": 8}, headers={"If-Match": "*"}).status_code == 200
+
+
+def test_update_with_version(client: TestClient, sample_survey_data):
+    """Test PUT with ?version= is a compare-and-swap on the row version"""
+    created = client.post("/surveys/", json=sample_survey_data).json()
+    assert created["version"] == 1
+
+    response = client.put(f"/surveys/{created['survey_id']}", json={"farmer_name": "Jane"}, params={"version": 1})
+    assert response.status_code == 200
+    assert response.json()["version"] == 2
+    assert response.headers["ETag"] == client.get(f"/surveys/{created['survey_id']}").headers["ETag"]
+
+    stale = client.put(f"/surveys/{created['survey_id']}", json={"farmer_name": "Bob"}, params={"version": 1})
+    assert stale.status_code == 409
+    assert client.get(f"/surveys/{created['survey_id']}").json()["farmer_name"] == "Jane"
+
+    tree = client.post(f"/surveys/{created['survey_id']}/trees/", json={"species_name": "Oak", "tree_count": 5}).json()
+    updated = client.put(f"/trees/{tree['tree_id']}", json={"tree_count": 6}, params={"version": tree["version"]})
+    assert updated.status_code == 200
+    assert updated.json()["version"] == tree["version"] + 1
+    assert client.put(f"/trees/{tree['tree_id']}", json={"tree_count": 7}, params={"version": tree["version"]}).status_code == 409
+    assert client.get(f"/trees/{tree['tree_id']}").json()["tree_count"] == 6
+
+
+def test_update_tree_without_version_retries_concurrent_write(client: TestClient, db_session, sample_survey_data):
+    """Test a recounting tree update the client didn't make conditional is retried, not
+    rejected, when another write lands between its read and its UPDATE"""
+    from sqlalchemy import event
+    from conftest import test_engine
+    from stats import verify
+
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    tree = client.post(f"/surveys/{survey_id}/trees/", json={"species_name": "Oak", "tree_count": 5}).json()
+    interleaved = []
+
+    def concurrent_write(conn, cursor, statement, parameters, context, executemany):
+        # Bump the version just before the first guarded UPDATE, as a competing writer would
+        if statement.startswith("UPDATE trees") and not interleaved:
+            interleaved.append(statement)
+            cursor.execute("UPDATE trees SET version = version + 1 WHERE tree_id = ?", (tree["tree_id"],))
+
+    event.listen(test_engine, "before_cursor_execute", concurrent_write)
+    try:
+        response = client.put(f"/trees/{tree['tree_id']}", json={"tree_count": 8})
+        interleaved.clear()
+        stale = client.put(f"/trees/{tree['tree_id']}", json={"tree_count": 9}, params={"version": 2})
+    finally:
+        event.remove(test_engine, "before_cursor_execute", concurrent_write)
+
+    assert response.status_code == 200
+    assert response.json()["tree_count"] == 8 and response.json()["version"] == tree["version"] + 1
+    assert stale.status_code == 409
+    assert verify(db_session) == []
+
+
+def test_delete_races_concurrent_update(client: TestClient, db_session, sample_survey_data):
+    """Test deleting a tree or survey still succeeds when another client's update lands
+    between the lookup and the DELETE, and the statistics lose exactly the deleted trees"""
+    from sqlalchemy import event
+    from conftest import test_engine
+    from stats import verify
+
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    trees = client.post(f"/surveys/{survey_id}/trees/bulk", json=[
+        {"species_name": "Oak", "tree_count": 5}, {"species_name": "Neem", "tree_count": 2}
+    ]).json()
+
+    def concurrent_update(conn, cursor, statement, parameters, context, executemany):
+        # Another writer edits every row just before each DELETE runs
+        if statement.startswith("DELETE FROM trees"):
+            cursor.execute("UPDATE trees SET notes = 'edited', version = version + 1")
+        elif statement.startswith("DELETE FROM farm_surveys"):
+            cursor.execute("UPDATE farm_surveys SET farmer_name = 'edited', version = version + 1")
+
+    event.listen(test_engine, "before_cursor_execute", concurrent_update)
+    try:
+        deleted_tree = client.delete(f"/trees/{trees[0]['tree_id']}")
+        deleted_survey = client.delete(f"/surveys/{survey_id}")
+    finally:
+        event.remove(test_engine, "before_cursor_execute", concurrent_update)
+
+    assert deleted_tree.status_code == 204 and deleted_survey.status_code == 204
+    assert client.get(f"/surveys/{survey_id}").status_code == 404
+    assert client.get(f"/trees/{trees[1]['tree_id']}").status_code == 404
+    assert verify(db_session) == []
+    assert client.delete(f"/surveys/{survey_id}").status_code == 404
+    assert client.delete(f"/trees/{trees[0]['tree_id']}").status_code == 404
+
+
+def test_batch_upsert_rejects_stale_version(client: TestClient, sample_survey_data):
+    """Test batch items carrying an outdated version are reported as conflicts"""
+    created = client.post("/surveys/", json=sample_survey_data).json()
+    client.put(f"/surveys/{created['survey_id']}", json={"farmer_name": "Jane"})
+
+    response = client.post("/surveys/batch", json={"surveys": [
+        {**sample_survey_data, "survey_id": created["survey_id"], "version": created["version"]}
+    ]})
+    assert response.json()["results"][0]["status"] == "conflict"
+    assert client.get(f"/surveys/{created['survey_id']}").json()["farmer_name"] == "Jane"
+
+
+def test_batch_upsert_accepts_timezone_aware_timestamps(client: TestClient, sample_survey_data):
+    """Test a batch item's timezone-aware last_updated is compared with the stored time in UTC"""
+    from datetime import timezone
+
+    def local_time(survey, hours=0):
+        stored = datetime.fromisoformat(survey["last_updated"].replace("Z", "")).replace(tzinfo=timezone.utc)
+        return (stored.astimezone(timezone(timedelta(hours=2))) - timedelta(hours=hours)).isoformat()
+
+    current = client.post("/surveys/", json=sample_survey_data).json()
+    stale = client.post("/surveys/", json=sample_survey_data).json()
+    response = client.post("/surveys/batch", json={"surveys": [
+        {**sample_survey_data, "survey_id": current["survey_id"], "last_updated": local_time(current)},
+        {**sample_survey_data, "survey_id": stale["survey_id"], "last_updated": local_time(stale, hours=1)},
+    ]})
+    assert response.status_code == 200
+    assert [result["status"] for result in response.json()["results"]] == ["updated", "conflict"]
+
+
+def test_fast_read_path_matches_response_schema(client: TestClient, sample_survey_data):
+    """Test the row-based read endpoints return documents valid against their response models"""
+    from pydantic import TypeAdapter
+    from schemas import FarmSurvey as FarmSurveySchema, Tree as TreeSchema
+
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    tree = client.post(f"/surveys/{survey_id}/trees/", json={"species_name": "Oak", "tree_count": 5, "height_avg": 2.5})
+
+    listed = client.get("/surveys/").json()
+    TypeAdapter(List[FarmSurveySchema]).validate_python(listed)
+    single = client.get(f"/surveys/{survey_id}").json()
+    assert single == listed[0]
+    assert single["trees"] == [tree.json()]
+    assert client.get(f"/trees/{tree.json()['tree_id']}").json() == tree.json()
+    TreeSchema.model_validate(client.get(f"/surveys/{survey_id}/trees/").json()[0])
+
+
+def test_endpoint_query_budgets(client: TestClient, sample_survey_data, max_queries):
+    """Test each endpoint runs a fixed number of statements, however many rows it touches"""
+    from cache import cache
+
+    survey_ids = []
+    for _ in range(5):
+        survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+        client.post(f"/surveys/{survey_id}/trees/bulk", json=[
+            {"species_name": "Oak", "tree_count": 2}, {"species_name": "Pine", "tree_count": 3}
+        ])
+        survey_ids.append(survey_id)
+    tree_id = client.get(f"/surveys/{survey_ids[0]}/trees/").json()[0]["tree_id"]
+    trees = [{"species_name": f"Species {index}", "tree_count": index + 1} for index in range(10)]
+    batch = {"surveys": [{**sample_survey_data, "trees": trees} for _ in range(5)]}
+
+    budgets = [
+        (3, "GET", "/surveys/", {}),
+        (3, "GET", f"/surveys/{survey_ids[0]}", {}),
+        (2, "GET", f"/surveys/{survey_ids[0]}/trees/", {}),
+        (2, "GET", f"/trees/{tree_id}", {}),
+        (2, "GET", "/surveys/near", {"params": {"lat": 40.7, "lon": -74.0, "radius_km": 10}}),
+        (2, "GET", "/sync/changes", {}),
+        (1, "GET", "/stats/species", {}),
+        (2, "GET", "/search", {"params": {"q": "oak"}}),
+        (2, "POST", "/surveys/", {"json": sample_survey_data}),
+        (3, "POST", "/surveys/batch", {"json": batch}),
+        (4, "PUT", f"/surveys/{survey_ids[1]}", {"json": sample_survey_data}),
+        (4, "POST", f"/surveys/{survey_ids[1]}/trees/", {"json": trees[0]}),
+        (3, "PUT", f"/trees/{tree_id}", {"json": trees[0]}),
+        (3, "POST", f"/surveys/{survey_ids[2]}/trees/bulk", {"json": trees}),
+        (6, "PUT", f"/surveys/{survey_ids[2]}/trees/", {"json": trees}),
+        (5, "DELETE", f"/trees/{tree_id}", {}),
+        (7, "DELETE", f"/surveys/{survey_ids[3]}", {}),
+    ]
+    for limit, method, path, kwargs in budgets:
+        # Measure the uncached path
+        cache.clear()
+        with max_queries(limit):
+            response = client.request(method, path, **kwargs)
+        assert response.status_code < 300, (method, path, response.text)
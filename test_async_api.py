@@ -0,0 +1,89 @@
+"""
+Tests for the native async endpoints (DATABASE_URL with an async driver)
+"""
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+
+from async_api import router
+from cache import cache
+from database import Base, get_async_db
+from conftest import TEST_DB_PATH, test_engine, sample_survey_data
+
+
+@pytest.fixture(scope="function")
+def async_client():
+    """Create a test client serving the async router against an aiosqlite engine"""
+    Base.metadata.create_all(bind=test_engine)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{TEST_DB_PATH}", poolclass=NullPool)
+    AsyncTestingSessionLocal = async_sessionmaker(async_engine, autoflush=False)
+
+    async def override_get_async_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_async_db] = override_get_async_db
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+    Base.metadata.drop_all(bind=test_engine)
+    cache.clear()
+
+
+def test_async_survey_crud_workflow(async_client: TestClient, sample_survey_data):
+    """Test create, read, update and delete through the async handlers"""
+    created = async_client.post("/surveys/", json=sample_survey_data)
+    assert created.status_code == 201
+    survey_id = created.json()["survey_id"]
+
+    tree = async_client.post(f"/surveys/{survey_id}/trees/", json={"species_name": "Oak", "tree_count": 5})
+    assert tree.status_code == 201
+
+    survey = async_client.get(f"/surveys/{survey_id}").json()
+    assert [t["species_name"] for t in survey["trees"]] == ["Oak"]
+
+    updated = async_client.put(
+        f"/surveys/{survey_id}",
+        json={"farmer_name": "Async Farmer"},
+        params={"last_updated": created.json()["last_updated"]}
+    )
+    assert updated.status_code == 200
+    assert updated.json()["farmer_name"] == "Async Farmer"
+    hits = async_client.get("/search", params={"q": "async"}).json()
+    assert [(hit["kind"], hit["survey_id"]) for hit in hits] == [("survey", survey_id)]
+
+    assert async_client.delete(f"/surveys/{survey_id}").status_code == 204
+    assert async_client.get(f"/surveys/{survey_id}").status_code == 404
+
+
+def test_async_list_surveys_pagination(async_client: TestClient, sample_survey_data):
+    """Test the async survey list pages with keyset cursors"""
+    for _ in range(3):
+        async_client.post("/surveys/", json=sample_survey_data)
+
+    first = async_client.get("/surveys/", params={"limit": 2})
+    assert len(first.json()) == 2
+    second = async_client.get("/surveys/", params={"limit": 2, "cursor": first.headers["X-Next-Cursor"]})
+    assert len(second.json()) == 1
+    assert "X-Next-Cursor" not in second.headers
+
+
+def test_async_tree_not_found(async_client: TestClient):
+    """Test the async handlers surface 404s from the shared CRUD code"""
+    assert async_client.get("/trees/99999").status_code == 404
+    assert async_client.put("/trees/99999", json={"tree_count": 2}).status_code == 404
+
+
+def test_async_conditional_requests(async_client: TestClient, sample_survey_data):
+    """Test ETag, If-None-Match and If-Match through the async handlers"""
+    survey_id = async_client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    etag = async_client.get(f"/surveys/{survey_id}").headers["ETag"]
+
+    assert async_client.get(f"/surveys/{survey_id}", headers={"If-None-Match": etag}).status_code == 304
+    assert async_client.put(f"/surveys/{survey_id}", json={"crop_type": "Rice"}, headers={"If-Match": etag}).status_code == 200
+    assert async_client.put(f"/surveys/{survey_id}", json={"crop_type": "Corn"}, headers={"If-Match": etag}).status_code == 412
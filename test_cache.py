@@ -0,0 +1,182 @@
+"""
+Tests for the survey/tree read cache
+"""
+import json
+import threading
+import time
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from cache import MemoryCache, RedisCache
+from conftest import client, db_session, sample_survey_data, test_engine
+
+
+def test_memory_cache_evicts_least_recently_used():
+    """Test the LRU drops the oldest untouched entry once full"""
+    cache = MemoryCache(ttl_seconds=60, max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["size"]) == (3, 1, 1, 2)
+
+
+def test_memory_cache_expires_and_invalidates():
+    """Test entries expire after the TTL and can be deleted explicitly"""
+    cache = MemoryCache(ttl_seconds=0.01, max_entries=10)
+    cache.set("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+    cache.ttl_seconds = 60
+    cache.set("b", 2)
+    cache.delete(["b", "missing"])
+    assert cache.get("b") is None
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["invalidations"] == 1
+
+
+class _FakeRedis:
+    """The subset of redis.Redis RedisCache uses, recording the thread of each command"""
+
+    def __init__(self):
+        self.values = {}
+        self.threads = []
+
+    def get(self, key):
+        self.threads.append(threading.get_ident())
+        return self.values.get(key)
+
+    def set(self, key, value, px=None):
+        assert isinstance(value, bytes)
+        self.threads.append(threading.get_ident())
+        self.values[key] = value
+
+    def delete(self, *keys):
+        return sum(self.values.pop(key, None) is not None for key in keys)
+
+    def scan_iter(self, match):
+        return [key for key in self.values if key.startswith(match.rstrip("*"))]
+
+
+def test_redis_cache_stores_json_off_the_event_loop(monkeypatch):
+    """Test Redis entries are JSON that round-trips datetimes, and that commands issued
+    from AsyncSession.run_sync run in a worker thread"""
+    import asyncio
+    import sys
+    from datetime import datetime
+    from types import SimpleNamespace
+    from sqlalchemy.util.concurrency import greenlet_spawn
+
+    client = _FakeRedis()
+    monkeypatch.setitem(sys.modules, "redis", SimpleNamespace(Redis=SimpleNamespace(from_url=lambda url: client)))
+    cache = RedisCache("redis://localhost:6379/0", ttl_seconds=60)
+    survey = {"survey_id": 1, "geo_location": {"latitude": 1.5, "longitude": 2.5},
+              "last_updated": datetime(2024, 5, 1, 12, 30, 15, 250000), "trees": []}
+
+    cache.set("survey:1", survey)
+    assert json.loads(client.values["farm-survey:survey:1"])["last_updated"] == {"dt": "2024-05-01T12:30:15.250000"}
+    assert cache.get("survey:1") == survey
+    assert client.threads == [threading.get_ident()] * 2
+
+    async def read():
+        return await greenlet_spawn(cache.get, "survey:1"), threading.get_ident()
+
+    value, loop_thread = asyncio.run(read())
+    assert value == survey
+    assert client.threads[-1] != loop_thread
+    cache.delete(["survey:1"])
+    assert cache.get("survey:1") is None
+
+
+def _count_statements(client: TestClient, path: str):
+    statements = []
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(test_engine, "before_cursor_execute", count)
+    try:
+        response = client.get(path)
+    finally:
+        event.remove(test_engine, "before_cursor_execute", count)
+    return response, statements
+
+
+def test_cached_reads_skip_database_until_write(client: TestClient, sample_survey_data):
+    """Test repeated reads are served from the cache and writes invalidate them"""
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    tree_id = client.post(f"/surveys/{survey_id}/trees/", json={"species_name": "Oak", "tree_count": 5}).json()["tree_id"]
+    client.get(f"/surveys/{survey_id}")
+    client.get(f"/trees/{tree_id}")
+    client.get(f"/surveys/{survey_id}/trees/")
+
+    # Only the ETag query reaches the database once the body is cached
+    _, statements = _count_statements(client, f"/surveys/{survey_id}")
+    assert len(statements) == 1
+    _, statements = _count_statements(client, f"/surveys/{survey_id}/trees/")
+    assert statements == []
+
+    client.put(f"/trees/{tree_id}", json={"tree_count": 9})
+    assert client.get(f"/trees/{tree_id}").json()["tree_count"] == 9
+    assert client.get(f"/surveys/{survey_id}").json()["trees"][0]["tree_count"] == 9
+    assert client.get(f"/surveys/{survey_id}/trees/").json()[0]["tree_count"] == 9
+
+    client.put(f"/surveys/{survey_id}", json={"farmer_name": "Jane"})
+    assert client.get(f"/surveys/{survey_id}").json()["farmer_name"] == "Jane"
+
+    client.delete(f"/surveys/{survey_id}")
+    assert client.get(f"/surveys/{survey_id}").status_code == 404
+    assert client.get(f"/trees/{tree_id}").status_code == 404
+
+    stats = client.get("/cache/stats").json()
+    assert stats["backend"] == "memory"
+    assert stats["hits"] >= 2 and stats["invalidations"] >= 3
+
+
+def test_batch_update_invalidates_cached_survey(client: TestClient, sample_survey_data):
+    """Test a batch update replacing trees drops the cached survey and trees"""
+    response = client.post("/surveys/batch", json={"surveys": [
+        {**sample_survey_data, "trees": [{"species_name": "Oak", "tree_count": 3}]}
+    ]})
+    survey_id = response.json()["results"][0]["survey_id"]
+    survey = client.get(f"/surveys/{survey_id}").json()
+    old_tree_id = survey["trees"][0]["tree_id"]
+    client.get(f"/trees/{old_tree_id}")
+
+    client.post("/surveys/batch", json={"surveys": [{
+        **sample_survey_data, "survey_id": survey_id, "last_updated": survey["last_updated"],
+        "trees": [{"species_name": "Teak", "tree_count": 8}]
+    }]})
+    assert [tree["species_name"] for tree in client.get(f"/surveys/{survey_id}").json()["trees"]] == ["Teak"]
+    # SQLite may hand the replaced tree's ID to the new tree, so check the content
+    old_tree = client.get(f"/trees/{old_tree_id}")
+    assert old_tree.status_code == 404 or old_tree.json()["species_name"] == "Teak"
+
+
+def test_stale_cached_copy_is_not_served_with_a_newer_etag(client: TestClient, sample_survey_data):
+    """Test a cached body older than the row (a read that cached the old row after the write
+    invalidated it, or a write by another worker) is reloaded instead of sent with the new ETag"""
+    from cache import cache, survey_key, tree_key
+
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    tree_id = client.post(f"/surveys/{survey_id}/trees/", json={"species_name": "Oak", "tree_count": 5}).json()["tree_id"]
+    old_survey = client.get(f"/surveys/{survey_id}").json()
+    old_tree = client.get(f"/trees/{tree_id}").json()
+
+    client.put(f"/surveys/{survey_id}", json={"farmer_name": "Jane"})
+    client.put(f"/trees/{tree_id}", json={"tree_count": 9})
+    cache.set(survey_key(survey_id), old_survey)
+    cache.set(tree_key(tree_id), old_tree)
+
+    response = client.get(f"/surveys/{survey_id}")
+    assert response.json()["farmer_name"] == "Jane" and response.json()["version"] == 2
+    assert client.get(f"/surveys/{survey_id}", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    response = client.get(f"/trees/{tree_id}")
+    assert response.json()["tree_count"] == 9
+    assert client.get(f"/trees/{tree_id}", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    assert cache.get(survey_key(survey_id))["farmer_name"] == "Jane"
@@ -0,0 +1,119 @@
+"""
+Tests for MessagePack content negotiation and response compression
+"""
+import gzip
+import json
+import msgpack
+import pytest
+from fastapi.testclient import TestClient
+
+from compression import choose_compressor, BrotliCompressor, GzipCompressor
+from conftest import client, db_session, sample_survey_data
+from serializers import accepts_msgpack
+
+MSGPACK = {"Accept": "application/msgpack"}
+
+
+def _seed(client: TestClient, sample_survey_data, surveys: int = 20, trees: int = 5):
+    for _ in range(surveys):
+        survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+        client.post(f"/surveys/{survey_id}/trees/bulk", json=[
+            {"species_name": f"Species {index}", "tree_count": index + 1, "notes": "Healthy canopy"}
+            for index in range(trees)
+        ])
+
+
+def test_accept_header_parsing():
+    """Test MessagePack is only chosen when listed with a non-zero quality"""
+    assert accepts_msgpack("application/msgpack")
+    assert accepts_msgpack("application/json;q=0.5, application/x-msgpack")
+    assert not accepts_msgpack("application/msgpack;q=0, application/json")
+    assert not accepts_msgpack("text/html,*/*;q=0.8")
+
+    assert choose_compressor("gzip, deflate") is GzipCompressor
+    assert choose_compressor("br;q=0, gzip") is GzipCompressor
+    assert choose_compressor("identity") is None
+    assert choose_compressor("") is None
+
+
+def test_msgpack_read_matches_json(client: TestClient, sample_survey_data):
+    """Test list, single-record and write responses carry the same document in MessagePack"""
+    _seed(client, sample_survey_data, surveys=2, trees=2)
+    survey_id = client.get("/surveys/").json()[0]["survey_id"]
+
+    for path in ("/surveys/", f"/surveys/{survey_id}", f"/surveys/{survey_id}/trees/", "/surveys/999999"):
+        as_json = client.get(path)
+        as_msgpack = client.get(path, headers=MSGPACK)
+        assert as_msgpack.status_code == as_json.status_code
+        assert as_msgpack.headers["content-type"] == "application/msgpack"
+        assert "Accept" in as_msgpack.headers["vary"]
+        assert msgpack.unpackb(as_msgpack.content) == as_json.json()
+
+    # Responses from validated write endpoints are transcoded
+    created = client.post("/surveys/", json=sample_survey_data, headers=MSGPACK)
+    assert created.status_code == 201
+    assert msgpack.unpackb(created.content)["farmer_name"] == sample_survey_data["farmer_name"]
+
+
+def test_large_responses_are_compressed(client: TestClient, sample_survey_data):
+    """Test large JSON and export bodies are gzip/brotli encoded and small ones are left alone"""
+    _seed(client, sample_survey_data)
+
+    plain = client.get("/surveys/", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+
+    gzipped = client.get("/surveys/", headers={"Accept-Encoding": "gzip"})
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in gzipped.headers["vary"]
+    assert json.loads(gzipped.content) == plain.json()
+    # The decoded body is what httpx hands back; check the wire size through a raw stream
+    with client.stream("GET", "/surveys/", headers={"Accept-Encoding": "gzip"}) as raw:
+        wire = b"".join(raw.iter_raw())
+    assert gzip.decompress(wire) == plain.content
+    assert len(wire) * 4 < len(plain.content)
+
+    export = client.get("/export/surveys", headers={"Accept-Encoding": "gzip"})
+    assert export.headers["content-encoding"] == "gzip"
+    assert len(export.text.splitlines()) == 20
+
+    small = client.get("/surveys/999999", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+
+
+def test_brotli_compression(client: TestClient, sample_survey_data):
+    """Test Brotli is preferred when the package is installed"""
+    brotli = pytest.importorskip("brotli")
+    _seed(client, sample_survey_data, surveys=5)
+
+    assert choose_compressor("gzip, br") is BrotliCompressor
+    with client.stream("GET", "/surveys/", headers={"Accept-Encoding": "gzip, br"}) as raw:
+        assert raw.headers["content-encoding"] == "br"
+        wire = b"".join(raw.iter_raw())
+    assert json.loads(brotli.decompress(wire)) == client.get("/surveys/", headers={"Accept-Encoding": "identity"}).json()
+
+
+def test_each_representation_has_its_own_etag(client: TestClient, sample_survey_data):
+    """Test JSON, MessagePack and compressed copies get distinct strong ETags, and any of them
+    revalidates with 304 (echoing the client's tag) or satisfies If-Match"""
+    _seed(client, sample_survey_data, surveys=1, trees=40)
+    survey_id = client.get("/surveys/").json()[0]["survey_id"]
+    path = f"/surveys/{survey_id}"
+
+    variants = {
+        "json": {"Accept-Encoding": "identity"},
+        "gzip": {"Accept-Encoding": "gzip"},
+        "msgpack": {**MSGPACK, "Accept-Encoding": "identity"},
+        "msgpack-gzip": {**MSGPACK, "Accept-Encoding": "gzip"},
+    }
+    etags = {name: client.get(path, headers=headers).headers["ETag"] for name, headers in variants.items()}
+    assert len(set(etags.values())) == 4
+    assert etags["gzip"] == etags["json"][:-1] + '-gzip"'
+    assert etags["msgpack-gzip"] == etags["json"][:-1] + '-msgpack-gzip"'
+
+    for name, headers in variants.items():
+        response = client.get(path, headers={**headers, "If-None-Match": etags[name]})
+        assert response.status_code == 304 and response.headers["ETag"] == etags[name]
+
+    updated = client.put(path, json={"farmer_name": "Jane"}, headers={"If-Match": etags["msgpack-gzip"]})
+    assert updated.status_code == 200
+    assert client.get(path, headers={**variants["gzip"], "If-None-Match": etags["gzip"]}).status_code == 200
@@ -0,0 +1,95 @@
+"""
+Tests for the synthetic dataset generator
+"""
+from collections import Counter
+
+from sqlalchemy import event, func, select, text
+from sqlalchemy.orm import Session
+
+from conftest import db_session, test_engine
+from crud import insert_rows
+from datagen import Generator, generate
+from models import FarmSurvey, Tree
+from search import SQLITE_INSERT_TRIGGERS, search
+from stats import verify
+
+
+def _sample(seed: int, surveys: int = 200) -> list:
+    generator = Generator(seed)
+    rows = []
+    for chunk in generator.chunks(surveys, 50):
+        for values, count in chunk:
+            rows.append((values, generator.trees(len(rows) + 1, count, values["last_updated"])))
+    return rows
+
+
+def test_same_seed_same_rows():
+    """Test the generator is reproducible for a seed and differs between seeds"""
+    assert _sample(7) == _sample(7)
+    assert _sample(7) != _sample(8)
+
+
+def test_distributions_are_skewed():
+    """Test species, trees per survey and farm locations are long-tailed and clustered"""
+    rows = _sample(42, surveys=2000)
+    trees = [tree for _, survey_trees in rows for tree in survey_trees]
+    per_survey = sorted(len(survey_trees) for _, survey_trees in rows)
+
+    species = Counter(tree["species_name"] for tree in trees).most_common()
+    assert species[0][1] > 10 * species[-1][1]
+    # Long tail: the busiest surveys hold far more trees than the median one
+    assert per_survey[-1] > 10 * per_survey[len(per_survey) // 2]
+    # Farms cluster in villages, so many share a geo cell
+    cells = Counter(values["geo_cell"] for values, _ in rows)
+    assert cells.most_common(1)[0][1] >= 20
+
+
+def test_generate_writes_consistent_dataset(db_session: Session):
+    """Test generated rows land in the database with matching statistics"""
+    surveys, trees = generate(db_session, 300, mean_trees=10, seed=3, chunk_size=100)
+
+    assert db_session.scalar(select(func.count()).select_from(FarmSurvey)) == surveys == 300
+    assert db_session.scalar(select(func.count()).select_from(Tree)) == trees
+    assert trees > 0
+    orphans = select(func.count()).select_from(Tree).where(Tree.survey_id.not_in(select(FarmSurvey.survey_id)))
+    assert db_session.scalar(orphans) == 0
+    assert verify(db_session) == []
+
+    # The search index was rebuilt for the bulk load and is maintained row by row again afterwards
+    farmer_name = db_session.get(FarmSurvey, 1).farmer_name
+    assert 1 in {hit["survey_id"] for hit in search(db_session, farmer_name, limit=100) if hit["kind"] == "survey"}
+    triggers = db_session.scalars(select(text("name")).select_from(text("sqlite_master")).where(text("type = 'trigger'")))
+    assert set(SQLITE_INSERT_TRIGGERS) <= set(triggers)
+
+
+def test_insert_rows_batches_and_keeps_order(db_session: Session):
+    """Test rows with mixed None values go in one INSERT and RETURNING comes back in input order"""
+    survey_ids = [
+        survey_id for survey_id, in insert_rows(db_session, FarmSurvey, [
+            {"farmer_name": f"Farmer {index}", "crop_type": "Rice", "latitude": 10.0, "longitude": 20.0}
+            for index in range(5)
+        ], FarmSurvey.survey_id)
+    ]
+    assert survey_ids == sorted(survey_ids)
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    rows = [
+        {"survey_id": survey_ids[0], "species_name": f"Species {index}", "tree_count": index + 1,
+         "height_avg": None if index % 2 else 5.0, "notes": None if index % 3 else "Leaf rust spreading"}
+        for index in range(30)
+    ]
+    event.listen(test_engine, "before_cursor_execute", count)
+    try:
+        returned = insert_rows(db_session, Tree, rows, Tree.tree_id, Tree.species_name, Tree.height_avg)
+    finally:
+        event.remove(test_engine, "before_cursor_execute", count)
+
+    assert len(statements) == 1
+    assert [row.species_name for row in returned] == [row["species_name"] for row in rows]
+    assert [row.height_avg for row in returned] == [row["height_avg"] for row in rows]
+    farm_survey = db_session.get(FarmSurvey, survey_ids[0])
+    assert farm_survey.version == 1 and farm_survey.geo_cell is not None
@@ -0,0 +1,118 @@
+"""
+Tests for the live change event stream
+"""
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import events
+from conftest import client, db_session, sample_survey_data
+from events import EventHub, encode_frames
+from main import app
+
+
+class _Stream:
+    """GET /events called straight through the ASGI app, since TestClient waits for the
+    whole body and an event stream never ends"""
+
+    def __init__(self):
+        self.start = asyncio.get_running_loop().create_future()
+        self.chunks: "asyncio.Queue[bytes]" = asyncio.Queue()
+        self._disconnect = asyncio.Event()
+        scope = {
+            "type": "http", "http_version": "1.1", "method": "GET", "scheme": "http", "path": "/events",
+            "raw_path": b"/events", "root_path": "", "query_string": b"", "headers": [(b"host", b"testserver")],
+            "client": ("testclient", 50000), "server": ("testserver", 80),
+        }
+        self.task = asyncio.create_task(app(scope, self._receive, self._send))
+
+    async def _receive(self):
+        await self._disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def _send(self, message):
+        if message["type"] == "http.response.start":
+            self.start.set_result(message)
+        elif message.get("body"):
+            await self.chunks.put(message["body"])
+
+    async def events(self, count: int) -> list:
+        """The next `count` data lines, decoded"""
+        received = []
+        while len(received) < count:
+            chunk = await asyncio.wait_for(self.chunks.get(), 5)
+            received.extend(json.loads(line[len("data: "):]) for line in chunk.decode().split("\n")
+                            if line.startswith("data: "))
+        return received
+
+    async def close(self):
+        self._disconnect.set()
+        await asyncio.wait_for(self.task, 5)
+
+
+@pytest.mark.asyncio
+async def test_writes_are_streamed_to_subscribers(client: TestClient, sample_survey_data):
+    """Test every subscriber gets one compact event per committed survey and tree change"""
+    streams = [_Stream(), _Stream()]
+    for stream in streams:
+        start = await asyncio.wait_for(stream.start, 5)
+        assert start["status"] == 200
+        assert (b"content-type", b"text/event-stream; charset=utf-8") in start["headers"]
+        assert (await stream.chunks.get()).startswith(b"retry: ")
+    assert events.hub.subscribers == 2
+
+    # The sync handlers run in the TestClient's own thread and loop, like the threadpool
+    post = lambda path, body: asyncio.to_thread(lambda: client.post(path, json=body).json())
+    survey = await post("/surveys/", sample_survey_data)
+    trees = await post(f"/surveys/{survey['survey_id']}/trees/bulk",
+                       [{"species_name": "Oak", "tree_count": 2}, {"species_name": "Neem", "tree_count": 1}])
+    await asyncio.to_thread(client.delete, f"/trees/{trees[0]['tree_id']}")
+    await asyncio.to_thread(client.delete, f"/surveys/{survey['survey_id']}")
+
+    expected = [
+        ("survey", "created", survey["survey_id"]),
+        ("tree", "created", trees[0]["tree_id"]),
+        ("tree", "created", trees[1]["tree_id"]),
+        ("tree", "deleted", trees[0]["tree_id"]),
+        ("survey", "deleted", survey["survey_id"]),
+    ]
+    for stream in streams:
+        received = await stream.events(len(expected))
+        assert [(event["entity"], event["op"], event["id"]) for event in received] == expected
+        assert {event["survey_id"] for event in received} == {survey["survey_id"]}
+        assert received[0]["last_updated"] == survey["last_updated"]
+
+    for stream in streams:
+        await stream.close()
+    assert events.hub.subscribers == 0
+    assert client.get("/events/stats").json()["subscribers"] == 0
+
+
+@pytest.mark.asyncio
+async def test_hub_fans_out_shared_frames_and_drops_slow_subscribers():
+    """Test thousands of idle subscribers share one encoded frame, a full queue is dropped,
+    and subscribe() refuses more than max_subscribers"""
+    hub = EventHub(queue_size=2, max_subscribers=5000)
+    subscribers = [hub.subscribe() for _ in range(5000)]
+    with pytest.raises(OverflowError):
+        hub.subscribe()
+
+    frames = encode_frames(['{"id":1}'])
+    hub.deliver(frames)
+    assert all(subscriber.queue.get_nowait() is frames for subscriber in subscribers)
+
+    slow = subscribers[0]
+    for subscriber in subscribers[1:]:
+        hub.unsubscribe(subscriber)
+    hub.deliver(frames)
+    hub.deliver(frames)
+    assert not slow.closed
+    hub.deliver(frames)
+    assert slow.closed and hub.subscribers == 0 and hub.dropped == 1
+
+    # Delivery from another thread is handed to the loop
+    subscriber = hub.subscribe()
+    await asyncio.to_thread(hub.deliver_threadsafe, frames)
+    assert await asyncio.wait_for(subscriber.queue.get(), 5) is frames
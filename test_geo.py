@@ -0,0 +1,45 @@
+"""
+Tests for the grid-cell spatial index helpers
+"""
+import pytest
+
+from geo import bbox_for_radius, cell_for, cell_ranges, haversine_km, parse_bbox
+
+
+def test_haversine_known_distance():
+    """Test haversine distance between New York and London"""
+    assert haversine_km(40.7128, -74.0060, 51.5074, -0.1278) == pytest.approx(5570, rel=0.01)
+
+
+def test_cell_ranges_cover_points_in_box():
+    """Test every point inside a bounding box falls in one of its cell ranges"""
+    bbox = bbox_for_radius(12.97, 77.59, 25)
+    ranges = cell_ranges(bbox)
+    min_lat, min_lon, max_lat, max_lon = bbox
+    for i in range(11):
+        for j in range(11):
+            lat = min_lat + (max_lat - min_lat) * i / 10
+            lon = min_lon + (max_lon - min_lon) * j / 10
+            cell = cell_for(lat, lon)
+            assert any(low <= cell <= high for low, high in ranges)
+
+
+def test_bbox_for_radius_crosses_antimeridian():
+    """Test a circle near the antimeridian wraps its longitude range"""
+    min_lat, min_lon, max_lat, max_lon = bbox_for_radius(0, 179.9, 50)
+    assert min_lon > max_lon
+    assert len(cell_ranges((min_lat, min_lon, max_lat, max_lon))) > 1
+
+
+def test_bbox_for_radius_covers_pole():
+    """Test a circle around a pole spans every longitude"""
+    assert bbox_for_radius(89.9, 10, 50)[1::2] == (-180.0, 180.0)
+
+
+def test_parse_bbox_validation():
+    """Test bounding box parsing uses GeoJSON order and rejects bad input"""
+    assert parse_bbox("-74.1,40.6,-73.9,40.8") == (40.6, -74.1, 40.8, -73.9)
+    with pytest.raises(ValueError):
+        parse_bbox("1,2,3")
+    with pytest.raises(ValueError):
+        parse_bbox("0,50,10,40")
@@ -0,0 +1,64 @@
+"""
+Tests for the Prometheus metrics middleware and endpoint
+"""
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from sqlalchemy import event
+
+from conftest import client, db_session, sample_survey_data, test_engine
+
+SURVEY_ROUTE = {"method": "GET", "route": "/surveys/{survey_id}"}
+
+
+def _sample(name: str, labels: dict) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_requests_are_labelled_by_route_template(client: TestClient, sample_survey_data):
+    """Test latency, status, size and in-flight series use the route template, not the raw path"""
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    requests = _sample("http_requests_total", {**SURVEY_ROUTE, "status": "200"})
+    missing = _sample("http_requests_total", {**SURVEY_ROUTE, "status": "404"})
+    unmatched = _sample("http_requests_total", {"method": "GET", "route": "<unmatched>", "status": "404"})
+
+    response = client.get(f"/surveys/{survey_id}")
+    client.get("/surveys/999999")
+    client.get("/no/such/path")
+
+    assert _sample("http_requests_total", {**SURVEY_ROUTE, "status": "200"}) == requests + 1
+    assert _sample("http_requests_total", {**SURVEY_ROUTE, "status": "404"}) == missing + 1
+    assert _sample("http_requests_total", {"method": "GET", "route": "<unmatched>", "status": "404"}) == unmatched + 1
+    assert _sample("http_request_duration_seconds_count", SURVEY_ROUTE) >= 2
+    assert _sample("http_response_size_bytes_sum", SURVEY_ROUTE) >= len(response.content)
+    assert _sample("http_requests_in_flight", SURVEY_ROUTE) == 0
+
+    metrics = client.get("/metrics")
+    assert metrics.status_code == 200
+    assert metrics.headers["content-type"].startswith("text/plain")
+    assert 'http_requests_total{method="GET",route="/surveys/{survey_id}",status="200"}' in metrics.text
+    assert "db_pool_checkouts_total" in metrics.text
+
+
+def test_queries_per_request(client: TestClient, sample_survey_data):
+    """Test every statement a request runs is counted against its route"""
+    for _ in range(3):
+        survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+        client.post(f"/surveys/{survey_id}/trees/", json={"species_name": "Oak", "tree_count": 3})
+    route = {"method": "GET", "route": "/surveys/"}
+    before = _sample("db_queries_per_request_sum", route), _sample("db_queries_per_request_count", route)
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(test_engine, "before_cursor_execute", count)
+    try:
+        assert client.get("/surveys/").status_code == 200
+    finally:
+        event.remove(test_engine, "before_cursor_execute", count)
+
+    assert statements
+    assert _sample("db_queries_per_request_sum", route) == before[0] + len(statements)
+    assert _sample("db_queries_per_request_count", route) == before[1] + 1
+    assert _sample("db_seconds_per_request_sum", route) > 0
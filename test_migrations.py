@@ -0,0 +1,140 @@
+"""
+Tests for the versioned schema migrations
+"""
+import os
+import tempfile
+from datetime import datetime
+
+import pytest
+from sqlalchemy import (
+    Boolean, Column, DateTime, Float, ForeignKey, Integer, MetaData, String, Table, Text, create_engine, inspect
+)
+from sqlalchemy.orm import Session
+
+from database import Base
+from geo import cell_for
+from migrations import LATEST_VERSION, check_schema, current_version, upgrade
+from models import FarmSurvey, Tree
+from search import search
+from stats import verify
+
+
+@pytest.fixture
+def engine():
+    handle, path = tempfile.mkstemp(suffix=".db")
+    os.close(handle)
+    engine = create_engine(f"sqlite:///{path}")
+    yield engine
+    engine.dispose()
+    os.unlink(path)
+
+
+def _create_original_schema(engine):
+    """Tables as the first release created them, before any migration existed"""
+    metadata = MetaData()
+    Table(
+        "farm_surveys", metadata,
+        Column("survey_id", Integer, primary_key=True, index=True),
+        Column("farmer_name", String, nullable=False, index=True),
+        Column("crop_type", String, nullable=False),
+        Column("latitude", Float, nullable=False),
+        Column("longitude", Float, nullable=False),
+        Column("sync_status", Boolean, nullable=False),
+        Column("last_updated", DateTime, nullable=False),
+    )
+    Table(
+        "trees", metadata,
+        Column("tree_id", Integer, primary_key=True, index=True),
+        Column("survey_id", Integer, ForeignKey("farm_surveys.survey_id"), nullable=False, index=True),
+        Column("species_name", String, nullable=False, index=True),
+        Column("tree_count", Integer, nullable=False),
+        Column("height_avg", Float),
+        Column("diameter_avg", Float),
+        Column("age_avg", Integer),
+        Column("notes", Text),
+        Column("created_at", DateTime, nullable=False),
+        Column("updated_at", DateTime, nullable=False),
+    )
+    metadata.create_all(engine)
+    now = datetime(2024, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(metadata.tables["farm_surveys"].insert(), [
+            {"farmer_name": "Asha", "crop_type": "Rice", "latitude": 12.97, "longitude": 77.59,
+             "sync_status": True, "last_updated": now},
+            {"farmer_name": "Ben", "crop_type": "Wheat", "latitude": -33.87, "longitude": 151.21,
+             "sync_status": False, "last_updated": now},
+        ])
+        conn.execute(metadata.tables["trees"].insert(), [
+            {"survey_id": 1, "species_name": "Neem", "tree_count": 4, "created_at": now, "updated_at": now},
+            {"survey_id": 2, "species_name": "Oak", "tree_count": 9, "created_at": now, "updated_at": now},
+        ])
+
+
+def _schema(engine) -> dict:
+    inspector = inspect(engine)
+    return {
+        table: ({column["name"] for column in inspector.get_columns(table)},
+                {index["name"] for index in inspector.get_indexes(table)})
+        for table in inspector.get_table_names()
+    }
+
+
+def test_empty_database_gets_latest_schema(engine):
+    """Test an empty database is created from the models and stamped with the latest version"""
+    with pytest.raises(RuntimeError, match="run `python migrations.py`"):
+        check_schema(engine)
+
+    assert upgrade(engine) == (0, LATEST_VERSION)
+    assert check_schema(engine) == LATEST_VERSION
+    # The models' tables, plus the SQLite full-text index (FTS5 tables and their shadow tables)
+    extra = set(_schema(engine)) - set(Base.metadata.tables)
+    assert set(Base.metadata.tables) <= set(_schema(engine))
+    assert extra and all(table.startswith(("survey_search", "tree_search")) for table in extra)
+    # Upgrading again does nothing
+    assert upgrade(engine) == (LATEST_VERSION, LATEST_VERSION)
+
+
+def test_original_database_is_upgraded(engine):
+    """Test a database from before migrations gains every later column, index and table"""
+    _create_original_schema(engine)
+
+    assert upgrade(engine) == (0, LATEST_VERSION)
+    assert check_schema(engine) == LATEST_VERSION
+
+    # Same tables, columns and indexes as a database created from the models
+    handle, path = tempfile.mkstemp(suffix=".db")
+    os.close(handle)
+    fresh = create_engine(f"sqlite:///{path}")
+    try:
+        upgrade(fresh)
+        assert _schema(engine) == _schema(fresh)
+    finally:
+        fresh.dispose()
+        os.unlink(path)
+
+    with Session(engine) as db:
+        for survey in db.query(FarmSurvey):
+            assert survey.geo_cell == cell_for(survey.latitude, survey.longitude)
+            assert survey.version == 1
+        assert {tree.version for tree in db.query(Tree)} == {1}
+        assert verify(db) == []
+        # Existing rows were indexed for search
+        assert [(hit["kind"], hit["survey_id"]) for hit in search(db, "asha")] == [("survey", 1)]
+        assert [hit["tree_id"] for hit in search(db, "oak")] == [2]
+
+        # The migrated tables work with the current models
+        survey = db.get(FarmSurvey, 1)
+        survey.farmer_name = "Asha K"
+        db.commit()
+        assert survey.version == 2
+
+
+def test_interrupted_upgrade_can_be_rerun(engine):
+    """Test steps skip what an earlier, interrupted run already applied"""
+    _create_original_schema(engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("ALTER TABLE farm_surveys ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+
+    assert upgrade(engine) == (0, LATEST_VERSION)
+    with engine.connect() as conn:
+        assert current_version(conn) == LATEST_VERSION
@@ -0,0 +1,62 @@
+"""
+Tests for the SQL profiler and query-count assertions
+"""
+import logging
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from conftest import client, db_session, sample_survey_data, test_engine
+from main import app
+from models import FarmSurvey
+from profiler import SQLProfilerMiddleware, assert_max_queries, capture_queries, repeated_statements
+
+
+def _seed(client: TestClient, sample_survey_data, surveys: int = 6):
+    for _ in range(surveys):
+        survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+        client.post(f"/surveys/{survey_id}/trees/", json={"species_name": "Oak", "tree_count": 2})
+
+
+def test_lazy_loads_are_reported_as_n_plus_one(client: TestClient, db_session: Session, sample_survey_data):
+    """Test a lazy FarmSurvey.trees load per survey shows up as one repeated statement"""
+    _seed(client, sample_survey_data)
+    db_session.expire_all()
+
+    with capture_queries(test_engine) as statements:
+        for survey in db_session.scalars(select(FarmSurvey)):
+            assert len(survey.trees) == 1
+
+    assert len(statements) == 7
+    (statement, count), = repeated_statements(statements, 5)
+    assert count == 6 and "FROM trees" in statement
+
+    with pytest.raises(AssertionError, match=r"7 queries run, expected at most 2\n  repeated 6x: SELECT"):
+        with assert_max_queries(test_engine, 2):
+            db_session.expire_all()
+            for survey in db_session.scalars(select(FarmSurvey)):
+                survey.trees
+
+
+def test_profiler_middleware(client: TestClient, sample_survey_data, caplog):
+    """Test the middleware adds Server-Timing, logs slow statements and flags repeated ones"""
+    _seed(client, sample_survey_data, surveys=2)
+    profiled = TestClient(SQLProfilerMiddleware(app, slow_query_ms=0, n_plus_one_threshold=1, server_timing=True))
+
+    with caplog.at_level(logging.WARNING, logger="farm_survey.sql"):
+        response = profiled.get("/surveys/")
+
+    assert response.status_code == 200
+    timing = response.headers["server-timing"]
+    assert timing.startswith("db;dur=") and 'desc="3 queries"' in timing and "app;dur=" in timing
+    slow = [record for record in caplog.records if record.getMessage().startswith("slow query")]
+    assert len(slow) == 3 and "GET /surveys/" in slow[0].getMessage()
+    assert any(record.getMessage().startswith("possible N+1 in GET /surveys/") for record in caplog.records)
+
+    caplog.clear()
+    quiet = TestClient(SQLProfilerMiddleware(app, slow_query_ms=60_000, n_plus_one_threshold=5))
+    response = quiet.get("/surveys/")
+    assert "server-timing" not in response.headers
+    assert not caplog.records
@@ -0,0 +1,107 @@
+"""
+Tests for full-text search over farmer names, species and tree notes
+"""
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+import search
+from conftest import client, db_session, sample_survey_data
+
+
+def _hits(client: TestClient, q: str, **params) -> list:
+    response = client.get("/search", params={"q": q, **params})
+    assert response.status_code == 200
+    return [(hit["kind"], hit["tree_id"] or hit["survey_id"]) for hit in response.json()]
+
+
+def _survey(client: TestClient, sample_survey_data, farmer_name: str) -> int:
+    return client.post("/surveys/", json={**sample_survey_data, "farmer_name": farmer_name}).json()["survey_id"]
+
+
+def test_search_matches_words_and_prefixes(client: TestClient, db_session: Session, sample_survey_data):
+    """Test farmer names, species and notes match whole words and word prefixes, case-insensitively"""
+    asha = _survey(client, sample_survey_data, "Asha Patel")
+    ravi = _survey(client, sample_survey_data, "Ravi Kumar")
+    neem = client.post(f"/surveys/{asha}/trees/", json={
+        "species_name": "Neem", "tree_count": 3, "notes": "Leaf spots on the lower branches, possibly early blight",
+    }).json()["tree_id"]
+    mango = client.post(f"/surveys/{ravi}/trees/", json={"species_name": "Mango", "tree_count": 8}).json()["tree_id"]
+
+    assert _hits(client, "asha") == [("survey", asha)]
+    assert _hits(client, "ash pat") == [("survey", asha)]
+    assert _hits(client, "PATEL") == [("survey", asha)]
+    assert _hits(client, "asha kumar") == []
+    assert _hits(client, "mang") == [("tree", mango)]
+    assert _hits(client, "blig") == [("tree", neem)]
+
+    hit, = client.get("/search", params={"q": "blight"}).json()
+    assert hit["survey_id"] == asha and hit["farmer_name"] == "Asha Patel" and hit["crop_type"] == "Wheat"
+    assert hit["species_name"] == "Neem"
+    assert "blight" in hit["snippet"]
+    assert hit["score"] > 0
+
+
+def test_search_ranks_and_pages(client: TestClient, db_session: Session, sample_survey_data, monkeypatch):
+    """Test better matches come first and skip/limit page through the merged hits"""
+    survey_id = _survey(client, sample_survey_data, "Oakley Farms")
+    trees = [
+        {"species_name": "Oak", "tree_count": 1, "notes": "oak oak oak"},
+        {"species_name": "Pine", "tree_count": 1, "notes": "Planted beside an old oak with many other trees nearby"},
+        {"species_name": "Oak", "tree_count": 1},
+    ]
+    ids = [tree["tree_id"] for tree in client.post(f"/surveys/{survey_id}/trees/bulk", json=trees).json()]
+
+    everything = _hits(client, "oak")
+    assert len(everything) == 4 and set(everything) == {("survey", survey_id)} | {("tree", id) for id in ids}
+    assert everything[0] == ("tree", ids[0])
+    assert everything.index(("tree", ids[2])) < everything.index(("tree", ids[1]))
+
+    assert _hits(client, "oak", limit=2) == everything[:2]
+    assert _hits(client, "oak", skip=2, limit=2) == everything[2:]
+    assert _hits(client, "oak", skip=4) == []
+
+    # Very common words are ranked among their newest matches only
+    monkeypatch.setattr(search, "RANK_WINDOW", 2)
+    assert set(_hits(client, "oak")) == {("survey", survey_id), ("tree", ids[1]), ("tree", ids[2])}
+
+
+def test_search_follows_writes(client: TestClient, db_session: Session, sample_survey_data):
+    """Test updates, deletes, tree replacement and batch upserts keep the index in step"""
+    survey = client.post("/surveys/", json={**sample_survey_data, "farmer_name": "Meera"}).json()
+    tree_id = client.post(f"/surveys/{survey['survey_id']}/trees/", json={
+        "species_name": "Teak", "tree_count": 2, "notes": "termite damage",
+    }).json()["tree_id"]
+
+    client.put(f"/surveys/{survey['survey_id']}", json={"farmer_name": "Meenakshi"},
+               params={"last_updated": survey["last_updated"]})
+    assert _hits(client, "meera") == []
+    assert _hits(client, "meenakshi") == [("survey", survey["survey_id"])]
+
+    client.put(f"/trees/{tree_id}", json={"notes": "recovered well"})
+    assert _hits(client, "termite") == []
+    assert _hits(client, "recovered teak") == [("tree", tree_id)]
+
+    replaced, = client.put(f"/surveys/{survey['survey_id']}/trees/",
+                           json=[{"species_name": "Sandalwood", "tree_count": 1}]).json()
+    assert _hits(client, "teak") == []
+    assert _hits(client, "sandal") == [("tree", replaced["tree_id"])]
+
+    client.delete(f"/trees/{replaced['tree_id']}")
+    assert _hits(client, "sandal") == []
+
+    results = client.post("/surveys/batch", json={"surveys": [
+        {**sample_survey_data, "farmer_name": "Batch Farmer", "trees": [{"species_name": "Jamun", "tree_count": 4}]},
+    ]}).json()["results"]
+    assert _hits(client, "batch") == [("survey", results[0]["survey_id"])]
+    assert [kind for kind, _ in _hits(client, "jamun")] == ["tree"]
+
+    client.delete(f"/surveys/{survey['survey_id']}")
+    assert _hits(client, "meenakshi") == []
+
+
+def test_search_rejects_empty_queries(client: TestClient, db_session: Session):
+    """Test queries without a letter or digit are rejected rather than matching everything"""
+    assert client.get("/search", params={"q": "  *\"- "}).status_code == 400
+    assert client.get("/search", params={"q": ""}).status_code == 422
+    assert client.get("/search").status_code == 422
+    assert client.get("/search", params={"q": "oak", "limit": 0}).status_code == 422
@@ -0,0 +1,162 @@
+"""
+Tests for the incrementally maintained tree statistics
+"""
+import io
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from conftest import client, db_session, sample_survey_data
+from importer import import_surveys
+from stats import rebuild, verify
+from models import TreeStat
+
+
+OAK = {"species_name": "Oak", "tree_count": 25}
+
+
+def _totals(client: TestClient, dimension: str) -> dict:
+    response = client.get(f"/stats/{dimension}")
+    assert response.status_code == 200
+    return {row["key"]: (row["tree_count"], row["record_count"]) for row in response.json()}
+
+
+def test_stats_follow_tree_writes(client: TestClient, db_session: Session, sample_survey_data):
+    """Test creating, updating and deleting trees keeps every dimension in step"""
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    oak = client.post(f"/surveys/{survey_id}/trees/", json={"species_name": "Oak", "tree_count": 10}).json()
+    client.post(f"/surveys/{survey_id}/trees/", json={"species_name": "Pine", "tree_count": 4})
+
+    assert _totals(client, "species") == {"Oak": (10, 1), "Pine": (4, 1)}
+    assert _totals(client, "crop_type") == {"Wheat": (14, 2)}
+    assert _totals(client, "region") == {"40,-75": (14, 2)}
+
+    client.put(f"/trees/{oak['tree_id']}", json={"species_name": "Maple", "tree_count": 7})
+    assert _totals(client, "species") == {"Maple": (7, 1), "Pine": (4, 1)}
+
+    client.delete(f"/trees/{oak['tree_id']}")
+    assert _totals(client, "species") == {"Pine": (4, 1)}
+    assert _totals(client, "crop_type") == {"Wheat": (4, 1)}
+    assert verify(db_session) == []
+
+
+def test_stats_follow_survey_changes(client: TestClient, db_session: Session, sample_survey_data):
+    """Test changing a survey's crop type or location moves its trees, and deleting it removes them"""
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    client.post(f"/surveys/{survey_id}/trees/", json=OAK)
+
+    client.put(f"/surveys/{survey_id}", json={
+        "crop_type": "Corn", "geo_location": {"latitude": 12.5, "longitude": 77.5}
+    })
+    assert _totals(client, "crop_type") == {"Corn": (25, 1)}
+    assert _totals(client, "region") == {"12,77": (25, 1)}
+
+    client.delete(f"/surveys/{survey_id}")
+    assert _totals(client, "crop_type") == {}
+    assert verify(db_session) == []
+
+
+def test_stats_follow_batch_and_import(client: TestClient, db_session: Session, sample_survey_data):
+    """Test batch upserts and bulk imports update the statistics"""
+    response = client.post("/surveys/batch", json={"surveys": [
+        {**sample_survey_data, "trees": [{"species_name": "Oak", "tree_count": 3}]}
+    ]})
+    survey_id = response.json()["results"][0]["survey_id"]
+    last_updated = client.get(f"/surveys/{survey_id}").json()["last_updated"]
+    client.post("/surveys/batch", json={"surveys": [{
+        **sample_survey_data, "survey_id": survey_id, "last_updated": last_updated,
+        "crop_type": "Rice", "trees": [{"species_name": "Teak", "tree_count": 8}]
+    }]})
+    import_surveys(db_session, io.StringIO(
+        "farmer_name,crop_type,latitude,longitude,species_name,tree_count\n"
+        "Jane Doe,Rice,41.8,-87.6,Oak,2\n"
+    ), "csv")
+
+    assert _totals(client, "species") == {"Teak": (8, 1), "Oak": (2, 1)}
+    assert _totals(client, "crop_type") == {"Rice": (10, 2)}
+    assert verify(db_session) == []
+
+
+def test_stats_follow_bulk_tree_writes(client: TestClient, db_session: Session, sample_survey_data):
+    """Test bulk creating and replacing trees update the statistics"""
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    client.post(f"/surveys/{survey_id}/trees/bulk", json=[OAK, {"species_name": "Pine", "tree_count": 4}])
+    assert _totals(client, "species") == {"Oak": (25, 1), "Pine": (4, 1)}
+
+    client.put(f"/surveys/{survey_id}/trees/", params={"merge_species": True}, json=[OAK, OAK])
+    assert _totals(client, "species") == {"Oak": (50, 1)}
+    assert _totals(client, "crop_type") == {"Wheat": (50, 1)}
+    assert verify(db_session) == []
+
+
+@pytest.mark.parametrize("prefix", ["UPDATE farm_surveys", "DELETE FROM trees"])
+def test_stats_survive_concurrent_tree_insert(client: TestClient, db_session: Session, sample_survey_data, prefix):
+    """Test moving or replacing a survey's trees while another client adds one leaves the
+    statistics equal to a rebuild"""
+    from datetime import datetime
+    from sqlalchemy import event
+    from conftest import test_engine
+    from geo import region_for_cell
+
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    client.post(f"/surveys/{survey_id}/trees/", json=OAK)
+    inserted = []
+
+    def concurrent_insert(conn, cursor, statement, parameters, context, executemany):
+        # Another client's tree insert, statistics included, commits just before the statement
+        if not statement.startswith(prefix) or inserted:
+            return
+        crop_type, geo_cell = cursor.execute(
+            "SELECT crop_type, geo_cell FROM farm_surveys WHERE survey_id = ?", (survey_id,)
+        ).fetchone()
+        cursor.execute(
+            "INSERT INTO trees (survey_id, species_name, tree_count, created_at, updated_at, version) "
+            "VALUES (?, 'Pine', 3, ?, ?, 1)", (survey_id, datetime.utcnow(), datetime.utcnow())
+        )
+        for key in (("species", "Pine"), ("crop_type", crop_type), ("region", region_for_cell(geo_cell))):
+            cursor.execute(
+                "INSERT INTO tree_stats (dimension, key, tree_count, record_count) VALUES (?, ?, 3, 1) "
+                "ON CONFLICT (dimension, key) DO UPDATE SET tree_count = tree_count + 3, record_count = record_count + 1",
+                key
+            )
+        inserted.append(statement)
+
+    moved = {"crop_type": "Corn", "geo_location": {"latitude": 12.5, "longitude": 77.5}}
+    event.listen(test_engine, "before_cursor_execute", concurrent_insert)
+    try:
+        if prefix == "UPDATE farm_surveys":
+            client.put(f"/surveys/{survey_id}", json=moved)
+            inserted.clear()
+            last_updated = client.get(f"/surveys/{survey_id}").json()["last_updated"]
+            client.post("/surveys/batch", json={"surveys": [{
+                **sample_survey_data, "survey_id": survey_id, "last_updated": last_updated, "crop_type": "Rice"
+            }]})
+        else:
+            client.put(f"/surveys/{survey_id}/trees/", json=[OAK])
+    finally:
+        event.remove(test_engine, "before_cursor_execute", concurrent_insert)
+
+    assert inserted
+    assert verify(db_session) == []
+    assert set(_totals(client, "crop_type")) == ({"Rice"} if prefix == "UPDATE farm_surveys" else {"Wheat"})
+    totals = {dimension: _totals(client, dimension) for dimension in ("species", "crop_type", "region")}
+    rebuild(db_session)
+    assert totals == {dimension: _totals(client, dimension) for dimension in ("species", "crop_type", "region")}
+
+
+def test_rebuild_repairs_drift(db_session: Session, client: TestClient, sample_survey_data):
+    """Test verify reports a tampered total and rebuild restores it"""
+    survey_id = client.post("/surveys/", json=sample_survey_data).json()["survey_id"]
+    client.post(f"/surveys/{survey_id}/trees/", json=OAK)
+    db_session.get(TreeStat, ("species", "Oak")).tree_count = 99
+    db_session.commit()
+
+    assert len(verify(db_session)) == 1
+    assert rebuild(db_session) == 3
+    assert verify(db_session) == []
+    assert _totals(client, "species") == {"Oak": (25, 1)}
+
+
+def test_stats_rejects_unknown_dimension(client: TestClient):
+    """Test an unknown dimension is a validation error"""
+    assert client.get("/stats/farmer").status_code == 422